@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+# program to illustrate channel with history: messages sent to channel are
+# numbered and kept (last 'history' messages) so late subscribers can get
+# messages sent before they subscribed. With 'log', messages are also saved in
+# a file, so channel (history and sequence numbers) survives restarts; run this
+# program more than once to see sequence numbers continue from previous run.
+
+import sys, os, tempfile
+import asyncoro
+
+def subscriber_proc(name, coro=None):
+    last = None
+    while True:
+        msg = yield coro.receive()
+        # messages are ChannelMessage instances with sequence number
+        if last is not None and msg.seq != last + 1:
+            print('%s: missed messages %d to %d' % (name, last + 1, msg.seq - 1))
+        last = msg.seq
+        if msg.message == 'quit':
+            break
+        print('%s: %d %s' % (name, msg.seq, msg.message))
+
+def client_proc(log, coro=None):
+    channel = asyncoro.Channel('news', history=5, log=log)
+    early = asyncoro.Coro(subscriber_proc, 'early')
+    yield channel.subscribe(early)
+    for i in range(8):
+        channel.send('message %d' % i)
+    yield coro.sleep(0.1)
+    # late subscriber gets last 3 messages from history before new messages
+    late = asyncoro.Coro(subscriber_proc, 'late')
+    yield channel.subscribe(late, replay_last=3)
+    channel.send('quit')
+    yield early.finish()
+    yield late.finish()
+    channel.close()
+
+if __name__ == '__main__':
+    log = os.path.join(tempfile.gettempdir(), 'channel_history.log')
+    if len(sys.argv) > 1 and sys.argv[1] == 'reset' and os.path.isfile(log):
+        os.remove(log)
+    asyncoro.Coro(client_proc, log).value()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+# program to measure cost of sending messages to remote subscribers of a
+# channel, e.g., 'python perf_channel_fanout.py 4 100 1000' to send 1000
+# messages to 100 subscribers at each of 4 peers (each peer runs in a separate
+# process). Messages are sent to each subscriber with 'send', sent to channel
+# (which sends each message once to each peer, so cost depends on number of
+# peers rather than number of subscribers) and delivered to channel (so each
+# message is delivered to all subscribers before next one is sent). Elapsed
+# time includes time spent by peers to send messages to their subscribers; CPU
+# time spent by sender is shown separately.
+
+import sys, os, time, subprocess
+import asyncoro.disasyncoro as asyncoro
+
+def subscriber_proc(n, collector, coro=None):
+    # after 'n' messages, inform collector; repeat
+    coro.set_daemon()
+    while True:
+        for i in range(n):
+            yield coro.receive()
+        collector.send(1)
+
+def peer_proc(location, subscribers, n, coro=None):
+    scheduler = asyncoro.AsynCoro.instance()
+    yield scheduler.peer(location)
+    channel = yield asyncoro.Channel.locate('fanout', location=location, timeout=5)
+    collector = yield asyncoro.Coro.locate('collector', location=location, timeout=5)
+    if not channel or not collector:
+        raise StopIteration
+    coros = [asyncoro.Coro(subscriber_proc, n, collector) for i in range(subscribers)]
+    for sub in coros:
+        yield channel.subscribe(sub)
+    collector.send(coros)
+
+def peer(port, location, subscribers, n):
+    asyncoro.AsynCoro(node='127.0.0.1', udp_port=port, discover_peers=False)
+    asyncoro.Coro(peer_proc, location, subscribers, n)
+    sys.stdin.readline()
+
+def collector_proc(peers, subscribers, n, coro=None):
+    coro.register('collector')
+    channel = asyncoro.Channel('fanout')
+    channel.register()
+    coros = []
+    while len(coros) < (peers * subscribers):
+        coros.extend((yield coro.receive()))
+    for kind in ('send', 'channel', 'deliver'):
+        start = time.time()
+        cpu = sum(os.times()[:2])
+        for i in range(n):
+            if kind == 'send':
+                for sub in coros:
+                    sub.send(i)
+            elif kind == 'channel':
+                channel.send(i)
+            else:
+                yield channel.deliver(i)
+        for sub in coros:
+            yield coro.receive()
+        elapsed = time.time() - start
+        cpu = sum(os.times()[:2]) - cpu
+        print('%s: %d messages to %d subscribers at %d peers in %.3f sec, sender cpu %.3f sec' %
+              (kind, n, len(coros), peers, elapsed, cpu))
+
+if __name__ == '__main__':
+    port = 51369
+    if len(sys.argv) > 4 and sys.argv[1] == 'peer':
+        peer(int(sys.argv[2]), asyncoro.Location('127.0.0.1', port), int(sys.argv[3]),
+             int(sys.argv[4]))
+        sys.exit(0)
+
+    peers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    subscribers = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    n = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+
+    asyncoro.AsynCoro(node='127.0.0.1', tcp_port=port, udp_port=port, discover_peers=False)
+    collector = asyncoro.Coro(collector_proc, peers, subscribers, n)
+    procs = [subprocess.Popen([sys.executable, __file__, 'peer', str(port + 1 + i),
+                               str(subscribers), str(n)], stdin=subprocess.PIPE)
+             for i in range(peers)]
+    collector.value()
+    for proc in procs:
+        proc.stdin.write(b'\n')
+        proc.stdin.close()
+    for proc in procs:
+        proc.wait()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# program to measure effect of compressing messages and files sent to a peer,
+# e.g., 'python perf_compress.py 200' to send a file with send_file and 200
+# messages (of text and of random data, about 100KB and 60KB) to a remote
+# coroutine, without compression and with 'zlib' compression. Bytes
+# saved and time spent compressing (see 'peer_stats') are shown for each; as
+# random data doesn't compress, compression is not used for most of those
+# messages. The receiver runs in a separate process.
+
+import sys, os, time, random, subprocess, tempfile
+import asyncoro.disasyncoro as asyncoro
+
+def counter_proc(coro=None):
+    # count messages received; after 'n' messages, reply to client
+    coro.set_daemon()
+    coro.register('counter')
+    while True:
+        client, n = yield coro.receive()
+        for i in range(n):
+            yield coro.receive()
+        client.send(n)
+
+def receiver(port, dest_path):
+    asyncoro.AsynCoro(node='127.0.0.1', tcp_port=port, udp_port=port, discover_peers=False,
+                      dest_path=dest_path)
+    asyncoro.Coro(counter_proc)
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    sys.stdin.readline()
+
+def sender_proc(location, n, path, coro=None):
+    scheduler = asyncoro.AsynCoro.instance()
+    scheduler.peer_status(coro)
+    yield scheduler.peer(location)
+    while True:
+        status = yield coro.receive()
+        if status.location == location and status.status == asyncoro.PeerStatus.Online:
+            break
+    scheduler.peer_status(None)
+    counter = yield asyncoro.Coro.locate('counter', location=location, timeout=5)
+    if not counter:
+        print('could not locate receiver')
+        raise StopIteration
+    words = ['coroutine', 'channel', 'peer', 'message', 'location', 'scheduler', 'socket']
+    text = ' '.join(random.choice(words) for i in range(12000))
+    # random data smaller than OOBBufferSize, so it is not sent out-of-band
+    data = os.urandom(60000)
+    threshold = asyncoro.CompressThreshold
+    for compress in (False, True):
+        # messages smaller than CompressThreshold are not compressed
+        asyncoro.CompressThreshold = threshold if compress else sys.maxsize
+        stats = scheduler.peer_stats(location)
+        start = time.time()
+        yield scheduler.del_file(location, os.path.basename(path))
+        ret = yield scheduler.send_file(location, path, overwrite=True)
+        if ret < 0:
+            print('send_file failed')
+        elapsed = time.time() - start
+        saved = scheduler.peer_stats(location)['bytes_saved'] - stats['bytes_saved']
+        cpu = scheduler.peer_stats(location)['compress_time'] - stats['compress_time']
+        print('compress %s, file: %.3f sec, %d bytes saved, %.3f sec compressing' %
+              (compress, elapsed, saved, cpu))
+        # file is changed so it is not found in receiver's cache
+        with open(path, 'ab') as fd:
+            fd.write(b'\n')
+        for kind, msg in (('text', text), ('random', data)):
+            stats = scheduler.peer_stats(location)
+            start = time.time()
+            counter.send((coro, n))
+            for i in range(n):
+                counter.send(msg)
+            yield coro.receive()
+            elapsed = time.time() - start
+            saved = scheduler.peer_stats(location)['bytes_saved'] - stats['bytes_saved']
+            cpu = scheduler.peer_stats(location)['compress_time'] - stats['compress_time']
+            print('compress %s, %s messages: %.3f sec, %d bytes saved, %.3f sec compressing' %
+                  (compress, kind, elapsed, saved, cpu))
+    asyncoro.CompressThreshold = threshold
+
+if __name__ == '__main__':
+    port = 51367
+    if len(sys.argv) > 2 and sys.argv[1] == 'receiver':
+        receiver(port, sys.argv[2])
+        sys.exit(0)
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'perf_compress.log')
+    with open(path, 'w') as fd:
+        for i in range(200000):
+            fd.write('%s coroutine %d received message %d from peer\n' % (time.ctime(), i % 97, i))
+    proc = subprocess.Popen([sys.executable, __file__, 'receiver', os.path.join(tmp_dir, 'dest')],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    # wait until receiver is ready (it also logs to stdout)
+    for line in iter(proc.stdout.readline, b''):
+        if line.strip() == b'ready':
+            break
+    else:
+        print('could not start receiver')
+        sys.exit(1)
+    asyncoro.AsynCoro(node='127.0.0.1', udp_port=port + 1, discover_peers=False,
+                      compressors=['zlib'])
+    asyncoro.Coro(sender_proc, asyncoro.Location('127.0.0.1', port), n, path).value()
+    proc.stdin.write(b'\n')
+    proc.stdin.close()
+    proc.wait()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+# program to measure throughput of sockets streaming data in both
+# directions at the same time: on each end of a connection, one coroutine
+# sends data while another receives data, so sockets are often readable
+# and writable in the same poll. Run with third argument 1 to use
+# scheduler's integrated loop, e.g., 'python perf_duplex.py 20000 4096 1'.
+
+import sys, socket, time
+import asyncoro
+
+def reader_proc(sock, n, coro=None):
+    received = 0
+    while received < n:
+        data = yield sock.recv(65536)
+        if not data:
+            break
+        received += len(data)
+    raise StopIteration(received)
+
+def writer_proc(sock, n, size, coro=None):
+    data = b'x' * size
+    for i in range(n):
+        yield sock.sendall(data)
+
+def duplex_proc(sock, n, size, coro=None):
+    reader = asyncoro.Coro(reader_proc, sock, n * size)
+    writer = asyncoro.Coro(writer_proc, sock, n, size)
+    yield writer.finish()
+    received = yield reader.finish()
+    sock.close()
+    raise StopIteration(received)
+
+def server_proc(server_sock, n, size, coro=None):
+    conn, addr = yield server_sock.accept()
+    received = yield duplex_proc(conn, n, size, coro=coro)
+    raise StopIteration(received)
+
+def client_proc(addr, n, size, coro=None):
+    sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    yield sock.connect(addr)
+    received = yield duplex_proc(sock, n, size, coro=coro)
+    raise StopIteration(received)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    integrated = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    asyncoro.AsynCoro(integrated_loop=bool(integrated))
+    server_sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    server_sock.bind(('127.0.0.1', 0))
+    server_sock.listen(1)
+
+    start = time.time()
+    server = asyncoro.Coro(server_proc, server_sock, n, size)
+    client = asyncoro.Coro(client_proc, server_sock.getsockname(), n, size)
+    received = server.value() + client.value()
+    elapsed = time.time() - start
+    print('%d bytes in %.3f sec, %.1f MB/sec' %
+          (received, elapsed, received / (elapsed * 1e6)))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# program to measure latency and throughput of socket I/O: clients send
+# requests to echo server (in same program) and wait for replies. Run
+# with third argument 1 to use scheduler's integrated loop (I/O events
+# processed in scheduler thread) instead of poller thread and fourth
+# argument 1 to use edge-triggered notifications, e.g.,
+# 'python perf_echo.py 10 10000 1 0'. Number of calls to update
+# registration of sockets with I/O notifier (e.g., epoll_ctl) is also shown.
+
+import sys, socket, time
+import asyncoro
+
+def echo_proc(conn, coro=None):
+    while True:
+        data = yield conn.recv(1024)
+        if not data:
+            break
+        yield conn.sendall(data)
+    conn.close()
+
+def server_proc(server_sock, coro=None):
+    coro.set_daemon()
+    while True:
+        conn, addr = yield server_sock.accept()
+        asyncoro.Coro(echo_proc, conn)
+
+def client_proc(addr, n, size, coro=None):
+    sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    yield sock.connect(addr)
+    request = b'x' * size
+    latency = 0
+    for i in range(n):
+        start = time.time()
+        yield sock.sendall(request)
+        yield sock.recvall(size)
+        latency += time.time() - start
+    sock.close()
+    raise StopIteration(latency)
+
+if __name__ == '__main__':
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    integrated = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    asyncoro.EdgeTriggered = bool(int(sys.argv[4])) if len(sys.argv) > 4 else False
+    size = 64
+
+    scheduler = asyncoro.AsynCoro(integrated_loop=bool(integrated))
+    server_sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    server_sock.bind(('127.0.0.1', 0))
+    server_sock.listen(128)
+    asyncoro.Coro(server_proc, server_sock)
+
+    ctl_calls = getattr(scheduler._notifier, 'ctl_calls', 0)
+    start = time.time()
+    coros = [asyncoro.Coro(client_proc, server_sock.getsockname(), n, size)
+             for i in range(clients)]
+    latency = sum(coro.value() for coro in coros)
+    elapsed = time.time() - start
+    ctl_calls = getattr(scheduler._notifier, 'ctl_calls', 0) - ctl_calls
+    print('%s: %d requests in %.3f sec, %.0f requests/sec, %.1f usec latency, '
+          '%.2f notifier updates per request' %
+          ('integrated loop' if integrated else 'poller thread', clients * n, elapsed,
+           clients * n / elapsed, 1e6 * latency / (clients * n), float(ctl_calls) / (clients * n)))
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+# program to measure cost of message passing between local coroutines; pairs
+# of coroutines exchange messages (ping-pong), so each message involves a
+# send (resume) and a receive (suspend) in scheduler.
+
+import sys, time
+import asyncoro
+
+def pong_proc(coro=None):
+    while True:
+        msg = yield coro.receive()
+        if msg is None:
+            break
+        msg.send(coro)
+
+def ping_proc(pong, n, coro=None):
+    for i in range(n):
+        pong.send(coro)
+        yield coro.receive()
+    pong.send(None)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    pairs = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    start = time.time()
+    pings = [asyncoro.Coro(ping_proc, asyncoro.Coro(pong_proc), n) for i in range(pairs)]
+    for ping in pings:
+        ping.value()
+    elapsed = time.time() - start
+    print('%d messages in %.3f sec, %.2f usec per message' %
+          (2 * n * pairs, elapsed, 1e6 * elapsed / (2 * n * pairs)))
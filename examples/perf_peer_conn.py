@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# program to measure cost of connecting to a peer for bursty traffic, e.g.,
+# 'python perf_peer_conn.py 200' to send 200 bursts of messages to a remote
+# coroutine, pausing briefly after each burst. Bursts are sent with
+# connection to peer closed as soon as it is idle (PeerIdleTimeout 0) and
+# kept open (default PeerIdleTimeout); number of connections made is shown
+# for each. The receiver runs in a separate process.
+
+import sys, time, subprocess
+import asyncoro.disasyncoro as asyncoro
+
+def counter_proc(coro=None):
+    # count messages received; after 'n' messages, reply to client
+    coro.set_daemon()
+    coro.register('counter')
+    while True:
+        client, n = yield coro.receive()
+        for i in range(n):
+            yield coro.receive()
+        client.send(n)
+
+def receiver(port):
+    asyncoro.AsynCoro(node='127.0.0.1', tcp_port=port, udp_port=port, discover_peers=False)
+    asyncoro.Coro(counter_proc)
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    sys.stdin.readline()
+
+def sender_proc(location, bursts, coro=None):
+    scheduler = asyncoro.AsynCoro.instance()
+    scheduler.peer_status(coro)
+    yield scheduler.peer(location)
+    while True:
+        status = yield coro.receive()
+        if status.location == location and status.status == asyncoro.PeerStatus.Online:
+            break
+    scheduler.peer_status(None)
+    counter = yield asyncoro.Coro.locate('counter', location=location, timeout=5)
+    if not counter:
+        print('could not locate receiver')
+        raise StopIteration
+    idle_timeout = asyncoro.PeerIdleTimeout
+    for timeout in (0, idle_timeout):
+        asyncoro.PeerIdleTimeout = timeout
+        connects = scheduler.peer_stats(location)['connects']
+        start = time.time()
+        for i in range(bursts):
+            counter.send((coro, 10))
+            for j in range(10):
+                counter.send(j)
+            yield coro.receive()
+            # let connection become idle
+            yield coro.sleep(0.01)
+        elapsed = time.time() - start
+        connects = scheduler.peer_stats(location)['connects'] - connects
+        print('idle timeout %s: %d bursts in %.3f sec, %d connections' %
+              (timeout, bursts, elapsed, connects))
+    asyncoro.PeerIdleTimeout = idle_timeout
+
+if __name__ == '__main__':
+    port = 51361
+    if len(sys.argv) > 1 and sys.argv[1] == 'receiver':
+        receiver(port)
+        sys.exit(0)
+
+    bursts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    proc = subprocess.Popen([sys.executable, __file__, 'receiver'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    # wait until receiver is ready (it also logs to stdout)
+    for line in iter(proc.stdout.readline, b''):
+        if line.strip() == b'ready':
+            break
+    else:
+        print('could not start receiver')
+        sys.exit(1)
+    asyncoro.AsynCoro(node='127.0.0.1', udp_port=port + 1, discover_peers=False)
+    asyncoro.Coro(sender_proc, asyncoro.Location('127.0.0.1', port), bursts).value()
+    proc.stdin.write(b'\n')
+    proc.stdin.close()
+    proc.wait()
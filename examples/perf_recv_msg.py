@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+# program to measure cost of receiving (small) messages with recv_msg: sender
+# sends messages (length prefixed, as with send_msg) in batches, as when
+# requests are pipelined, and receiver receives them one at a time with
+# recv_msg, e.g., 'python perf_recv_msg.py 100000 64 100'.
+
+import sys, socket, struct, time
+import asyncoro
+
+def sender_proc(conn, n, size, batch, coro=None):
+    msg = struct.pack('>L', size) + b'x' * size
+    for i in range(0, n, batch):
+        yield conn.sendall(msg * min(batch, n - i))
+    conn.close()
+
+def server_proc(server_sock, n, size, batch, coro=None):
+    conn, addr = yield server_sock.accept()
+    yield sender_proc(conn, n, size, batch, coro=coro)
+
+def receiver_proc(addr, coro=None):
+    sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    yield sock.connect(addr)
+    n = 0
+    while True:
+        msg = yield sock.recv_msg()
+        if not msg:
+            break
+        n += 1
+    sock.close()
+    raise StopIteration(n)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    batch = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+    server_sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    server_sock.bind(('127.0.0.1', 0))
+    server_sock.listen(1)
+    asyncoro.Coro(server_proc, server_sock, n, size, batch)
+
+    start = time.time()
+    receiver = asyncoro.Coro(receiver_proc, server_sock.getsockname())
+    received = receiver.value()
+    elapsed = time.time() - start
+    print('%d messages in %.3f sec, %.2f usec per message' %
+          (received, elapsed, 1e6 * elapsed / received))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# program to measure throughput of sending messages to a remote coroutine
+# with 'send', e.g., 'python perf_remote_send.py 20000' to send 20000
+# messages. Messages are sent with one request outstanding (i.e., waiting
+# for reply to a request before sending next one) and with (default)
+# MaxPendingRequests requests outstanding on the connection to peer,
+# first with each message in its own request and then with (default)
+# batches of up to MaxBatchSize messages. The receiver runs in a
+# separate process.
+
+import sys, time, subprocess
+import asyncoro.disasyncoro as asyncoro
+
+def counter_proc(coro=None):
+    # count messages received; after 'n' messages, reply to client
+    coro.set_daemon()
+    coro.register('counter')
+    while True:
+        client, n = yield coro.receive()
+        for i in range(n):
+            yield coro.receive()
+        client.send(n)
+
+def receiver(port):
+    asyncoro.AsynCoro(node='127.0.0.1', tcp_port=port, udp_port=port, discover_peers=False)
+    asyncoro.Coro(counter_proc)
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    sys.stdin.readline()
+
+def sender_proc(location, n, coro=None):
+    scheduler = asyncoro.AsynCoro.instance()
+    scheduler.peer_status(coro)
+    yield scheduler.peer(location)
+    while True:
+        status = yield coro.receive()
+        if status.location == location and status.status == asyncoro.PeerStatus.Online:
+            break
+    scheduler.peer_status(None)
+    counter = yield asyncoro.Coro.locate('counter', location=location, timeout=5)
+    if not counter:
+        print('could not locate receiver')
+        raise StopIteration
+    max_pending, max_batch = asyncoro.MaxPendingRequests, asyncoro.MaxBatchSize
+    for pending, batch in ((1, 1), (max_pending, 1), (max_pending, max_batch)):
+        asyncoro.MaxPendingRequests, asyncoro.MaxBatchSize = pending, batch
+        counter.send((coro, n))
+        start = time.time()
+        for i in range(n):
+            counter.send(i)
+        yield coro.receive()
+        elapsed = time.time() - start
+        print('pending %d, batch %d: %d messages in %.3f sec, %.1f messages/sec' %
+              (pending, batch, n, elapsed, n / elapsed))
+    asyncoro.MaxPendingRequests, asyncoro.MaxBatchSize = max_pending, max_batch
+
+if __name__ == '__main__':
+    port = 51359
+    if len(sys.argv) > 1 and sys.argv[1] == 'receiver':
+        receiver(port)
+        sys.exit(0)
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    proc = subprocess.Popen([sys.executable, __file__, 'receiver'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    # wait until receiver is ready (it also logs to stdout)
+    for line in iter(proc.stdout.readline, b''):
+        if line.strip() == b'ready':
+            break
+    else:
+        print('could not start receiver')
+        sys.exit(1)
+    asyncoro.AsynCoro(node='127.0.0.1', udp_port=port + 1, discover_peers=False)
+    asyncoro.Coro(sender_proc, asyncoro.Location('127.0.0.1', port), n).value()
+    proc.stdin.write(b'\n')
+    proc.stdin.close()
+    proc.wait()
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+
+# program to measure cost of scheduling (stepping) coroutines as the
+# number of runnable coroutines grows; the cost per step should stay
+# (nearly) flat irrespective of number of coroutines.
+
+import sys, time
+import asyncoro
+
+def runner(steps, coro=None):
+    # 'yield' without suspending keeps coroutine runnable, so each
+    # iteration costs one scheduler step
+    for i in range(steps):
+        yield i
+
+if __name__ == '__main__':
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for n in (1000, 5000, 10000, 50000, 100000):
+        start = time.time()
+        coros = [asyncoro.Coro(runner, steps) for i in range(n)]
+        for coro in coros:
+            coro.value()
+        elapsed = time.time() - start
+        print('%7d coroutines: %.3f sec, %.2f usec per step' %
+              (n, elapsed, 1e6 * elapsed / (n * (steps + 1))))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# program to measure throughput of sending large buffers (bytearray) as
+# messages to a remote coroutine, e.g., 'python perf_send_buffer.py 100 20'
+# to send 20 messages of 100MB each. Messages are sent with buffers copied
+# into pickled data and, if pickle protocol 5 is available (with Python
+# 3.8+ or 'pickle5' module), as out-of-band buffers that are not copied.
+# The receiver runs in a separate process.
+
+import sys, time, subprocess
+import asyncoro
+import asyncoro.disasyncoro as disasyncoro
+
+def receiver_proc(coro=None):
+    # after 'n' messages, reply to client with total size received
+    coro.set_daemon()
+    coro.register('receiver')
+    while True:
+        client, n = yield coro.receive()
+        size = 0
+        for i in range(n):
+            msg = yield coro.receive()
+            size += len(msg)
+        client.send(size)
+
+def receiver(port):
+    disasyncoro.AsynCoro(node='127.0.0.1', tcp_port=port, udp_port=port, discover_peers=False)
+    disasyncoro.Coro(receiver_proc)
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    sys.stdin.readline()
+
+def sender_proc(location, size, n, coro=None):
+    scheduler = disasyncoro.AsynCoro.instance()
+    scheduler.peer_status(coro)
+    yield scheduler.peer(location)
+    while True:
+        status = yield coro.receive()
+        if status.location == location and status.status == disasyncoro.PeerStatus.Online:
+            break
+    scheduler.peer_status(None)
+    rcoro = yield disasyncoro.Coro.locate('receiver', location=location, timeout=5)
+    if not rcoro:
+        print('could not locate receiver')
+        raise StopIteration
+    msg = bytearray(size * 1024 * 1024)
+    # out-of-band buffers are not available with Python 2
+    oob_buffer_size = getattr(asyncoro, 'OOBBufferSize', None)
+    for oob in (False, True):
+        if oob:
+            if not getattr(asyncoro, '_pickle5', None):
+                print('pickle protocol 5 is not available')
+                break
+            asyncoro.OOBBufferSize = oob_buffer_size
+        elif oob_buffer_size:
+            asyncoro.OOBBufferSize = len(msg) + 1
+        rcoro.send((coro, n))
+        start = time.time()
+        for i in range(n):
+            rcoro.send(msg)
+        yield coro.receive()
+        elapsed = time.time() - start
+        print('out-of-band %s: %d messages of %d MB in %.3f sec, %.1f MB/sec' %
+              (oob, n, size, elapsed, n * size / elapsed))
+    if oob_buffer_size:
+        asyncoro.OOBBufferSize = oob_buffer_size
+
+if __name__ == '__main__':
+    port = 51365
+    if len(sys.argv) > 1 and sys.argv[1] == 'receiver':
+        receiver(port)
+        sys.exit(0)
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    proc = subprocess.Popen([sys.executable, __file__, 'receiver'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    # wait until receiver is ready (it also logs to stdout)
+    for line in iter(proc.stdout.readline, b''):
+        if line.strip() == b'ready':
+            break
+    else:
+        print('could not start receiver')
+        sys.exit(1)
+    disasyncoro.AsynCoro(node='127.0.0.1', udp_port=port + 1, discover_peers=False)
+    disasyncoro.Coro(sender_proc, disasyncoro.Location('127.0.0.1', port), size, n).value()
+    proc.stdin.write(b'\n')
+    proc.stdin.close()
+    proc.wait()
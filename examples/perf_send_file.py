@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# program to measure throughput of send_file over a link with latency,
+# with stop-and-wait (window of 1 chunk) and with default window, e.g.,
+# 'python perf_send_file.py 100 10' to send a 100MB file with 10ms delay
+# (each way). The receiver runs in a separate process; it uses
+# 'ext_ip_addr' to advertise a proxy (at 127.0.0.2) that delays data
+# forwarded (in both directions) to and from receiver.
+
+import sys, os, socket, time, tempfile, shutil, subprocess
+import asyncoro.disasyncoro as asyncoro
+
+def delay_proc(src, dst, delay, coro=None):
+    # forward data received from 'src' to 'dst' 'delay' seconds later
+    def send_proc(coro=None):
+        coro.set_daemon()
+        # close 'dst' even if terminated (when receiver quits), so
+        # asyncoro doesn't wait for (half-open) connections to finish
+        try:
+            while True:
+                item = yield coro.receive()
+                if item is None:
+                    break
+                due, data = item
+                if due > time.time():
+                    yield coro.sleep(due - time.time())
+                yield dst.sendall(data)
+        finally:
+            dst.close()
+
+    coro.set_daemon()
+    sender = asyncoro.Coro(send_proc)
+    while True:
+        data = yield src.recv(1024000)
+        if not data:
+            break
+        sender.send((time.time() + delay, data))
+    sender.send(None)
+
+def proxy_proc(proxy_sock, addr, delay, coro=None):
+    coro.set_daemon()
+    while True:
+        conn, caddr = yield proxy_sock.accept()
+        sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+        yield sock.connect(addr)
+        asyncoro.Coro(delay_proc, conn, sock, delay)
+        asyncoro.Coro(delay_proc, sock, conn, delay)
+
+def receiver(port, delay):
+    dest_path = tempfile.mkdtemp()
+    asyncoro.AsynCoro(node='127.0.0.1', tcp_port=port, udp_port=port, ext_ip_addr='127.0.0.2',
+                      discover_peers=False, dest_path=dest_path)
+    proxy_sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    proxy_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    proxy_sock.bind(('127.0.0.2', port))
+    proxy_sock.listen(32)
+    asyncoro.Coro(proxy_proc, proxy_sock, ('127.0.0.1', port), delay)
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    sys.stdin.readline()
+    proxy_sock.close()
+    shutil.rmtree(dest_path, ignore_errors=True)
+
+def sender_proc(path, location, coro=None):
+    scheduler = asyncoro.AsynCoro.instance()
+    scheduler.peer_status(coro)
+    yield scheduler.peer(location)
+    while True:
+        status = yield coro.receive()
+        if status.location == location and status.status == asyncoro.PeerStatus.Online:
+            break
+    size = os.path.getsize(path)
+    for window in (1, asyncoro.FileWindow):
+        start = time.time()
+        status = yield scheduler.send_file(location, path, window=window)
+        elapsed = time.time() - start
+        if status:
+            print('send_file failed with window %d' % window)
+            break
+        print('window %d: %d bytes in %.3f sec, %.1f MB/sec' %
+              (window, size, elapsed, size / (elapsed * 1e6)))
+        yield scheduler.del_file(location, os.path.basename(path))
+
+if __name__ == '__main__':
+    port = 51357
+    if len(sys.argv) > 1 and sys.argv[1] == 'receiver':
+        receiver(port, float(sys.argv[2]))
+        sys.exit(0)
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    delay = float(sys.argv[2]) / 1000.0 if len(sys.argv) > 2 else 0.01
+
+    fd, path = tempfile.mkstemp()
+    data = os.urandom(1024 * 1024)
+    for i in range(size):
+        os.write(fd, data)
+    os.close(fd)
+
+    proc = subprocess.Popen([sys.executable, __file__, 'receiver', str(delay)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    # wait until receiver is ready (it also logs to stdout)
+    for line in iter(proc.stdout.readline, b''):
+        if line.strip() == b'ready':
+            break
+    else:
+        print('could not start receiver')
+        sys.exit(1)
+    asyncoro.AsynCoro(node='127.0.0.1', udp_port=port + 1, discover_peers=False)
+    asyncoro.Coro(sender_proc, path, asyncoro.Location('127.0.0.2', port)).value()
+    proc.stdin.write(b'\n')
+    proc.stdin.close()
+    proc.wait()
+    os.remove(path)
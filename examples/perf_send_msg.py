@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+# program to measure cost of sending messages with send_msg for given
+# message size: with large messages (e.g., 'python perf_send_msg.py 100 10000000'),
+# time to prepare messages (e.g., copying data) is significant.
+
+import sys, socket, time
+import asyncoro
+
+def sender_proc(addr, n, size, coro=None):
+    sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    yield sock.connect(addr)
+    msg = b'x' * size
+    for i in range(n):
+        yield sock.send_msg(msg)
+    sock.close()
+
+def receiver_proc(server_sock, coro=None):
+    conn, addr = yield server_sock.accept()
+    n = 0
+    while True:
+        msg = yield conn.recv_msg()
+        if not msg:
+            break
+        n += 1
+    conn.close()
+    raise StopIteration(n)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 10000000
+
+    server_sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    server_sock.bind(('127.0.0.1', 0))
+    server_sock.listen(1)
+
+    start = time.time()
+    receiver = asyncoro.Coro(receiver_proc, server_sock)
+    asyncoro.Coro(sender_proc, server_sock.getsockname(), n, size)
+    received = receiver.value()
+    elapsed = time.time() - start
+    print('%d messages of %d bytes in %.3f sec, %.1f MB/sec' %
+          (received, size, elapsed, received * size / (elapsed * 1e6)))
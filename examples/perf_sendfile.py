@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# program to measure throughput of sending a file with sendfile (which
+# uses 'os.sendfile' where possible) compared to reading file in chunks
+# and sending them with sendall, e.g., 'python perf_sendfile.py 500' to
+# send a 500MB file each way.
+
+import sys, os, socket, time, tempfile
+import asyncoro
+
+def sender_proc(conn, path, use_sendfile, coro=None):
+    with open(path, 'rb') as fd:
+        if use_sendfile:
+            yield conn.sendfile(fd)
+        else:
+            while True:
+                data = fd.read(1024000)
+                if not data:
+                    break
+                yield conn.sendall(data)
+    conn.close()
+
+def server_proc(server_sock, path, use_sendfile, coro=None):
+    conn, addr = yield server_sock.accept()
+    yield sender_proc(conn, path, use_sendfile, coro=coro)
+
+def receiver_proc(addr, coro=None):
+    sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+    yield sock.connect(addr)
+    buf = bytearray(1024000)
+    received = 0
+    while True:
+        n = yield sock.recv_into(buf)
+        if not n:
+            break
+        received += n
+    sock.close()
+    raise StopIteration(received)
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    fd, path = tempfile.mkstemp()
+    data = os.urandom(1024 * 1024)
+    for i in range(size):
+        os.write(fd, data)
+    os.close(fd)
+
+    for use_sendfile in (False, True):
+        server_sock = asyncoro.AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
+        server_sock.bind(('127.0.0.1', 0))
+        server_sock.listen(1)
+        asyncoro.Coro(server_proc, server_sock, path, use_sendfile)
+
+        start = time.time()
+        receiver = asyncoro.Coro(receiver_proc, server_sock.getsockname())
+        received = receiver.value()
+        elapsed = time.time() - start
+        server_sock.close()
+        print('%s: %d bytes in %.3f sec, %.1f MB/sec' %
+              ('sendfile' if use_sendfile else 'sendall', received, elapsed,
+               received / (elapsed * 1e6)))
+    os.remove(path)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# program to measure cost (time and size) of serializing requests and
+# replies exchanged with peers, with pickle and with 'compact' serializer,
+# e.g., 'python perf_serialize.py 20000' to serialize and unserialize each
+# type of message 20000 times. It first checks that a coroutine in a reply
+# (encoded by serializer) and in a message payload (pickled) unserializes
+# to equal objects with either serializer, both here and (as a remote
+# coroutine) at another peer.
+
+import sys, time
+import asyncoro.disasyncoro as asyncoro
+from asyncoro.disasyncoro import _NetRequest
+
+def idle_proc(coro=None):
+    coro.set_daemon()
+    yield coro.receive()
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    scheduler = asyncoro.AsynCoro(node='127.0.0.1', udp_port=51363, discover_peers=False)
+    coro = asyncoro.Coro(idle_proc)
+    channel = asyncoro.Channel('channel')
+    peer = asyncoro.Location('127.0.0.1', 51364)
+    auth = '0123456789abcdef0123456789abcdef01234567'
+
+    send = _NetRequest('send', kwargs={'message': 'message %s' % 42, 'name': coro._name,
+                                       'coro': coro._id},
+                       dst=peer, auth=auth, timeout=asyncoro.MsgTimeout)
+    send.id = 42
+    msgs = [asyncoro.serialize(send.kwargs, 'compact') for i in range(100)]
+    send_batch = _NetRequest('send_batch', kwargs={'msgs': msgs}, dst=peer, auth=auth,
+                             timeout=asyncoro.MsgTimeout)
+    send_batch.id = 43
+    deliver = _NetRequest('deliver', kwargs={'message': ('result', 42, 3.14), 'n': 1,
+                                             'channel': channel._name},
+                          dst=peer, auth=auth, timeout=asyncoro.MsgTimeout)
+    deliver.id = 44
+    locate = _NetRequest('locate_coro', kwargs={'name': 'server'}, dst=peer, auth=auth,
+                         timeout=asyncoro.MsgTimeout)
+    locate.id = 45
+    messages = [('send', send), ('send_batch', send_batch), ('deliver', deliver),
+                ('locate_coro', locate), ('reply', (42, 0)), ('coro reply', (45, coro)),
+                ('list payload', (46, list(range(1000))))]
+
+    location = scheduler._location
+    for at_peer in (False, True):
+        decoded = []
+        for serializer in (None, 'compact'):
+            for msg in ((47, coro), (48, ('payload', coro))):
+                data = asyncoro.serialize(msg, serializer)
+                if at_peer:
+                    # unserialize as if received at peer
+                    scheduler._location = peer
+                msg = asyncoro.unserialize(data)
+                scheduler._location = location
+                decoded.append(msg[1] if isinstance(msg[1], asyncoro.Coro) else msg[1][1])
+        if not all(obj == decoded[0] for obj in decoded) or len(set(decoded)) != 1 or \
+           (not at_peer and not decoded[0] == coro):
+            print('coroutine %s is not same after serializing%s: %s' %
+                  (coro, ' at peer' if at_peer else '', [(obj, type(obj._id)) for obj in decoded]))
+            sys.exit(1)
+
+    for name, msg in messages:
+        for serializer in (None, 'compact'):
+            start = time.time()
+            for i in range(n):
+                data = asyncoro.serialize(msg, serializer)
+            dumps = time.time() - start
+            start = time.time()
+            for i in range(n):
+                asyncoro.unserialize(data)
+            loads = time.time() - start
+            print('%-12s %-7s: %6d bytes, serialize %6.2f usec, unserialize %6.2f usec' %
+                  (name, serializer or 'pickle', len(data), 1e6 * dumps / n, 1e6 * loads / n))
+    scheduler.finish()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+# program to measure cost of timeouts: receivers wait for messages with
+# timeout, but messages arrive before timeouts expire, so each receive adds
+# a timer and cancels it.
+
+import sys, time
+import asyncoro
+
+def receiver_proc(timeout, coro=None):
+    n = 0
+    while True:
+        msg = yield coro.receive(timeout=timeout)
+        if msg is None:
+            break
+        n += 1
+    raise StopIteration(n)
+
+def sender_proc(receivers, n, coro=None):
+    for i in range(n):
+        receivers[i % len(receivers)].send(i)
+        if (i % len(receivers)) == 0:
+            # let receivers run
+            yield None
+    for receiver in receivers:
+        receiver.send(None)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    m = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    timeout = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+
+    start = time.time()
+    receivers = [asyncoro.Coro(receiver_proc, timeout) for i in range(m)]
+    asyncoro.Coro(sender_proc, receivers, n)
+    total = sum(receiver.value() for receiver in receivers)
+    elapsed = time.time() - start
+    print('%d timed receives in %.3f sec, %.2f usec per receive' %
+          (total, elapsed, 1e6 * elapsed / total))
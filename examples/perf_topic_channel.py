@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+# program to measure cost of routing messages with TopicChannel as number of
+# subscriptions grows, e.g., 'python perf_topic_channel.py 100000' to send
+# 100000 messages on topics of form 'region.N.sensor.M.temp' with 10, 100,
+# 1000 and 10000 subscriptions (each to 'region.N.sensor.M.*' for one topic,
+# and a few with wildcards for all topics). As subscriptions are indexed on
+# words in topic, cost doesn't depend on number of subscriptions.
+
+import sys, time, random
+import asyncoro
+
+def subscriber_proc(coro=None):
+    coro.set_daemon()
+    while True:
+        yield coro.receive()
+
+def sender_proc(n, coro=None):
+    for subscriptions in (10, 100, 1000, 10000):
+        channel = asyncoro.TopicChannel('events')
+        sub = asyncoro.Coro(subscriber_proc)
+        for i in range(subscriptions):
+            yield channel.subscribe(sub, 'region.%d.sensor.%d.*' % (i % 10, i))
+        # these match all topics
+        yield channel.subscribe(sub, 'region.*.sensor.#')
+        yield channel.subscribe(sub, '#')
+        topics = ['region.%d.sensor.%d.temp' % (i % 10, i) for i in range(subscriptions)]
+        start = time.time()
+        for i in range(n):
+            channel.send(random.choice(topics), i)
+        elapsed = time.time() - start
+        print('%d subscriptions: %d messages in %.3f sec, %.1f messages/sec' %
+              (subscriptions + 2, n, elapsed, n / elapsed))
+        channel.close()
+        sub.terminate()
+        yield coro.sleep(0.1)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    asyncoro.Coro(sender_proc, n).value()
@@ -9,16 +9,28 @@ import inspect
 import traceback
 import os
 import stat
+import time
 import hashlib
+import hmac
+import cPickle as pickle
 import collections
 import copy
 import tempfile
 import threading
 import atexit
+import zlib
 try:
     import netifaces
 except ImportError:
     netifaces = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 import asyncoro
 from asyncoro import *
@@ -35,13 +47,52 @@ __all__ = asyncoro.__all__ + ['RCI']
 # MaxConnectionErrors times, peer is assumed dead and removed
 MaxConnectionErrors = 10
 MsgTimeout = asyncoro.MsgTimeout
+# requests to a peer are sent without waiting for replies to earlier
+# requests, as long as there are at most MaxPendingRequests requests
+# without replies
+MaxPendingRequests = 64
+# messages sent with 'send' to (coroutines and channels at) a peer that
+# are queued together are sent in one request, with up to MaxBatchSize
+# messages, or until the messages add up to at least MaxBatchBytes
+# bytes; if BatchLinger is not 0, a batch that is not full is sent
+# after waiting BatchLinger seconds for more messages. Requests queued to a
+# peer are also sent together (with one 'sendall') until they add up to at
+# least MaxBatchBytes bytes
+MaxBatchSize = 256
+MaxBatchBytes = 1024 * 1024
+BatchLinger = 0
+# connection to a (non-stream) peer is kept open for PeerIdleTimeout
+# seconds after last request is sent and replies to all requests are
+# received, so requests sent in that time reuse it; if it is 0,
+# connection is closed as soon as it is idle. Open connections are
+# probed with TCP keepalive after PeerKeepAlive seconds of inactivity
+# so broken connections are detected (and requests use new connection)
+PeerIdleTimeout = 30
+PeerKeepAlive = 10
+# send_file sends files in chunks of FileChunkSize bytes; receiver
+# acknowledges each chunk and sender can have up to FileWindow chunks
+# not acknowledged yet
+FileChunkSize = 1024000
+FileWindow = 16
+# files received are copied (as read-only files) to cache, indexed by hash
+# of their contents, so same files sent again are not transferred; total
+# size of files in cache is limited to FileCacheSize bytes by default
+FileCacheSize = 1024 * 1024 * 1024
+# if compression is enabled (with 'compressors' of AsynCoro), requests
+# and replies of at least CompressThreshold bytes, and chunks of files
+# sent with send_file, are compressed; if data doesn't compress to at
+# most CompressMaxRatio of its size, next CompressRetry messages to that
+# peer are not compressed
+CompressThreshold = 4096
+CompressMaxRatio = 0.9
+CompressRetry = 64
 
 
 class _NetRequest(object):
     """Internal use only.
     """
 
-    __slots__ = ('name', 'kwargs', 'dst', 'auth', 'event', 'reply', 'timeout')
+    __slots__ = ('name', 'kwargs', 'dst', 'auth', 'event', 'reply', 'timeout', 'id')
 
     def __init__(self, name, kwargs={}, dst=None, auth=None, timeout=None):
         self.name = name
@@ -51,10 +102,12 @@ class _NetRequest(object):
         self.event = None
         self.reply = None
         self.timeout = timeout
+        self.id = None
 
     def __getstate__(self):
         state = {'name': self.name, 'kwargs': self.kwargs, 'dst': self.dst,
-                 'auth': self.auth, 'reply': self.reply, 'timeout': self.timeout}
+                 'auth': self.auth, 'reply': self.reply, 'timeout': self.timeout,
+                 'id': self.id}
         return state
 
     def __setstate__(self, state):
@@ -62,6 +115,173 @@ class _NetRequest(object):
             setattr(self, k, v)
 
 
+# 'compact' serializer sends requests and replies exchanged with peers as
+# tuples of built-in types (with index of request name and location as
+# address and port), so pickled data doesn't include names of classes
+# and attributes; message payloads in them are pickled as usual
+_CompactReqNames = ('send', 'send_batch', 'deliver', 'run_rci', 'locate_coro',
+                    'locate_channel', 'locate_rci', 'locate_peer', 'monitor', 'subscribe',
+                    'unsubscribe', 'terminate_coro', 'send_file', 'del_file', 'peer_closed',
+                    'ping', 'pong')
+_CompactReqIndex = dict((name, i) for i, name in enumerate(_CompactReqNames))
+
+
+def _compact_enc(obj):
+    """Internal use only. Returns kind of 'obj' and tuple of built-in types
+    for it if it is Location, Coro or Channel; otherwise, 0 and 'obj'.
+    """
+    t = type(obj)
+    if t is Location:
+        return 1, (obj.addr, obj.port)
+    elif t is Coro:
+        # id is sent as string, as with pickle (see '__getstate__' of
+        # Coro), so remote coroutines unserialized either way are equal
+        if obj._location:
+            return 2, (obj._name, str(obj._id), obj._location.addr, obj._location.port)
+        return 2, (obj._name, str(obj._id))
+    elif t is Channel:
+        if obj._location:
+            return 3, (obj._name, obj._location.addr, obj._location.port)
+        return 3, (obj._name,)
+    return 0, obj
+
+
+def _compact_dec(kind, obj):
+    """Internal use only. Reverse of _compact_enc.
+    """
+    if kind == 0:
+        return obj
+    elif kind == 1:
+        loc = Location.__new__(Location)
+        loc.addr, loc.port = obj
+        return loc
+    if len(obj) > 2 or (kind == 3 and len(obj) > 1):
+        loc = Location.__new__(Location)
+        loc.addr, loc.port = obj[-2:]
+    else:
+        loc = None
+    if kind == 2:
+        coro = Coro.__new__(Coro)
+        coro.__setstate__({'name': obj[0], 'id': obj[1], 'location': loc})
+        return coro
+    elif kind == 3:
+        channel = Channel.__new__(Channel)
+        channel.__setstate__({'name': obj[0], 'location': loc})
+        return channel
+    raise ValueError('invalid compact serializer kind %s' % kind)
+
+
+def _compact_dumps(obj, buffers=None):
+    if type(obj) is _NetRequest:
+        name = _CompactReqIndex.get(obj.name, obj.name)
+        if type(obj.kwargs) is dict:
+            kwargs = []
+            for key, value in obj.kwargs.items():
+                kwargs.append(key)
+                kwargs.extend(_compact_enc(value))
+        else:
+            kwargs = None
+        dst = obj.dst
+        if type(dst) is Location:
+            dst = (dst.addr, dst.port)
+        obj = (0, name, obj.id, obj.auth, obj.timeout, dst, _compact_enc(obj.reply), kwargs,
+               obj.kwargs if kwargs is None else None)
+    elif type(obj) is tuple and len(obj) == 2:
+        # reply: (request id, value); it is sent as is (as only tuple of
+        # length 2) unless value is Location, Coro or Channel
+        kind, value = _compact_enc(obj[1])
+        if kind:
+            obj = (1, obj[0], kind, value)
+    elif type(obj) is dict:
+        # message in 'send_batch'
+        kwargs = []
+        for key, value in obj.items():
+            kwargs.append(key)
+            kwargs.extend(_compact_enc(value))
+        obj = (2, kwargs, None)
+    else:
+        obj = (3,) + _compact_enc(obj)
+    return b'\x01' + pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+
+def _compact_loads(data, buffers=None):
+    obj = pickle.loads(data[1:])
+    if len(obj) == 2:
+        return obj
+    kind = obj[0]
+    if kind == 0:
+        req = _NetRequest.__new__(_NetRequest)
+        req.name = obj[1] if type(obj[1]) is not int else _CompactReqNames[obj[1]]
+        req.id = obj[2]
+        req.auth = obj[3]
+        req.timeout = obj[4]
+        if obj[5] is None:
+            req.dst = None
+        else:
+            req.dst = _compact_dec(1, obj[5])
+        req.reply = _compact_dec(*obj[6])
+        kwargs = obj[7]
+        if kwargs is None:
+            req.kwargs = obj[8]
+        else:
+            req.kwargs = dict((kwargs[i], _compact_dec(kwargs[i + 1], kwargs[i + 2]))
+                              for i in range(0, len(kwargs), 3))
+        req.event = None
+        return req
+    elif kind == 1:
+        return (obj[1], _compact_dec(obj[2], obj[3]))
+    elif kind == 2:
+        kwargs = obj[1]
+        return dict((kwargs[i], _compact_dec(kwargs[i + 1], kwargs[i + 2]))
+                    for i in range(0, len(kwargs), 3))
+    elif kind == 3:
+        return _compact_dec(obj[1], obj[2])
+    raise ValueError('invalid compact serializer data')
+
+
+register_serializer('compact', b'\x01', _compact_dumps, _compact_loads)
+
+
+# compressors available, indexed by name, with prefix (of 4 bytes) of
+# messages compressed with them; peers advertise compressors they have
+# (i.e., can decompress with) and messages are compressed only with
+# compressor chosen for that peer
+_compressors = {'zlib': (b'zlb:', lambda data: zlib.compress(data, 1), zlib.decompress)}
+if lz4:
+    _compressors['lz4'] = (b'lz4:', lz4.frame.compress, lz4.frame.decompress)
+if zstandard:
+    _compressors['zstd'] = (b'zst:', lambda data: zstandard.ZstdCompressor(level=1).compress(data),
+                            lambda data: zstandard.ZstdDecompressor().decompress(data))
+_decompressors = dict((prefix, (name, decompress))
+                      for name, (prefix, compress, decompress) in _compressors.items())
+
+
+def _compress(data, compressor):
+    """Internal use only. Returns message (list of prefix and compressed
+    data) for 'data' compressed with 'compressor', or 'data' if compressor
+    is None, 'data' is smaller than CompressThreshold or it doesn't compress
+    to at most CompressMaxRatio of its size.
+    """
+    if not compressor or len(data) < CompressThreshold:
+        return data
+    prefix, compress, decompress = _compressors[compressor]
+    zdata = compress(data)
+    if (len(zdata) + len(prefix)) > (CompressMaxRatio * len(data)):
+        return data
+    return [prefix, zdata]
+
+
+def _decompress(msg):
+    """Internal use only. Returns tuple of name of compressor used for
+    message 'msg' (or None if it is not compressed) and data in it. Raises
+    exception if it can't be decompressed.
+    """
+    entry = _decompressors.get(bytes(msg[:4]), None)
+    if entry:
+        return entry[0], entry[1](msg[4:])
+    return None, msg
+
+
 class PeerStatus(object):
     """'peer_status' method of AsynCoro can be used to be notified of
     status of peers (other AsynCoro's to communicate for distributed
@@ -83,7 +303,9 @@ class _Peer(object):
     """
 
     __slots__ = ('name', 'location', 'auth', 'keyfile', 'certfile', 'stream', 'conn',
-                 'reqs', 'waiting', 'req_coro')
+                 'reqs', 'waiting', 'req_coro', 'long_msgs', 'replies', 'req_id',
+                 'connects', 'handshakes', 'serializer', 'compressor', 'compress_skip',
+                 'compress_saved', 'compress_time', 'auth_conns')
 
     peers = {}
     status_coro = None
@@ -100,6 +322,27 @@ class _Peer(object):
         self.conn = None
         self.reqs = collections.deque()
         self.waiting = False
+        self.long_msgs = False
+        # name of serializer (negotiated with peer) for requests to it;
+        # if None, requests are pickled
+        self.serializer = None
+        # peer authenticates connections (see req_proc), so requests sent
+        # to it don't include auth code
+        self.auth_conns = False
+        # name of compressor (negotiated with peer) for requests and file
+        # chunks to it; if None, they are not compressed
+        self.compressor = None
+        # number of messages not to compress (after compression was not
+        # effective), bytes saved with compression and seconds spent
+        self.compress_skip = 0
+        self.compress_saved = 0
+        self.compress_time = 0.0
+        # requests sent on current connection and waiting for replies
+        self.replies = {}
+        self.req_id = 0
+        # number of connections (and SSL handshakes) made to peer
+        self.connects = 0
+        self.handshakes = 0
         _Peer._lock.acquire()
         _Peer.peers[(location.addr, location.port)] = self
         _Peer._lock.release()
@@ -121,6 +364,61 @@ class _Peer(object):
         _Peer._lock.release()
         return peer
 
+    @staticmethod
+    def get_stats(location):
+        _Peer._lock.acquire()
+        peer = _Peer.peers.get((location.addr, location.port), None)
+        if peer:
+            stats = {'connects': peer.connects, 'handshakes': peer.handshakes,
+                     'connected': peer.conn is not None, 'compressor': peer.compressor,
+                     'bytes_saved': peer.compress_saved, 'compress_time': peer.compress_time}
+        else:
+            stats = None
+        _Peer._lock.release()
+        return stats
+
+    def compress(self, data):
+        """Internal use only. Returns message for 'data' (see '_compress')
+        to send to peer. If compression is not effective, next CompressRetry
+        messages are not compressed.
+        """
+        if not self.compressor or len(data) < CompressThreshold:
+            return data
+        if self.compress_skip:
+            self.compress_skip -= 1
+            return data
+        start = time.time()
+        msg = _compress(data, self.compressor)
+        _Peer._lock.acquire()
+        self.compress_time += time.time() - start
+        if msg is data:
+            self.compress_skip = CompressRetry
+        else:
+            self.compress_saved += len(data) - len(msg[0]) - len(msg[1])
+        _Peer._lock.release()
+        return msg
+
+    def compress(self, data):
+        """Internal use only. Returns message for 'data' (see '_compress')
+        to send to peer. If compression is not effective, next CompressRetry
+        messages are not compressed.
+        """
+        if not self.compressor or len(data) < CompressThreshold:
+            return data
+        if self.compress_skip:
+            self.compress_skip -= 1
+            return data
+        start = time.time()
+        msg = _compress(data, self.compressor)
+        _Peer._lock.acquire()
+        self.compress_time += time.time() - start
+        if msg is data:
+            self.compress_skip = CompressRetry
+        else:
+            self.compress_saved += len(data) - len(msg[0]) - len(msg[1])
+        _Peer._lock.release()
+        return msg
+
     @staticmethod
     def send_req(req):
         _Peer._lock.acquire()
@@ -175,48 +473,81 @@ class _Peer(object):
         coro.set_daemon()
         conn_errors = 0
         req = None
+        # request sent again (on new connection) after it couldn't be sent
+        # on connection kept open
+        resent = None
         while 1:
             _Peer._lock.acquire()
-            if not self.reqs:
-                if not self.stream and self.conn:
-                    self.conn.shutdown(socket.SHUT_WR)
-                    self.conn.close()
+            if not self.reqs or len(self.replies) >= MaxPendingRequests:
+                idle = not self.reqs and not self.replies and not self.stream and self.conn
+                if idle and not PeerIdleTimeout:
+                    # reply_proc closes connection when it is shutdown
+                    try:
+                        self.conn.shutdown(socket.SHUT_RDWR)
+                    except:
+                        pass
                     self.conn = None
+                    idle = False
                 self.waiting = True
                 _Peer._lock.release()
                 try:
-                    yield coro.receive()
+                    if idle:
+                        msg = yield coro.receive(timeout=PeerIdleTimeout)
+                    else:
+                        msg = yield coro.receive()
                 except GeneratorExit:
                     break
                 _Peer._lock.acquire()
                 self.waiting = False
-            if self.reqs:
-                req = self.reqs.popleft()
-                _Peer._lock.release()
-            else:
+                if msg is None and not self.reqs and not self.replies and not self.stream and \
+                   self.conn:
+                    # no requests in PeerIdleTimeout seconds
+                    try:
+                        self.conn.shutdown(socket.SHUT_RDWR)
+                    except:
+                        pass
+                    self.conn = None
                 _Peer._lock.release()
                 continue
+            req = self.reqs.popleft()
+            _Peer._lock.release()
+            reused = self.conn is not None
             if not self.conn:
-                self.conn = AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM),
-                                        keyfile=self.keyfile, certfile=self.certfile)
+                conn = AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM),
+                                   keyfile=self.keyfile, certfile=self.certfile)
+                # requests are sent without waiting for replies to (and
+                # acknowledgements of) earlier requests, so disable Nagle
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                if hasattr(socket, 'TCP_KEEPIDLE'):
+                    try:
+                        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, PeerKeepAlive)
+                        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, PeerKeepAlive)
+                        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+                    except:
+                        pass
                 if req.timeout:
-                    self.conn.settimeout(req.timeout)
+                    conn.settimeout(req.timeout)
                 try:
-                    yield self.conn.connect((self.location.addr, self.location.port))
+                    yield conn.connect((self.location.addr, self.location.port))
+                    if self.auth and self.auth_conns:
+                        # connection is authenticated once, by replying to
+                        # peer's challenge with its HMAC (with auth code as
+                        # key), so requests sent on it don't include auth
+                        # code; requests are sent without waiting for
+                        # peer to verify it, as peer closes connection if
+                        # it fails
+                        yield conn.send_msg(b'auth:')
+                        challenge = yield conn.recv_msg()
+                        if not challenge:
+                            raise socket.error('hangup')
+                        yield conn.send_msg(hmac.new(self.auth.encode(), challenge,
+                                                     hashlib.sha1).digest())
                 except GeneratorExit:
-                    if self.conn:
-                        try:
-                            self.conn.shutdown(socket.SHUT_WR)
-                            self.conn.close()
-                        except:
-                            pass
-                        self.conn = None
+                    conn.close()
                     break
                 except:
-                    if self.conn:
-                        # self.conn.shutdown(socket.SHUT_WR)
-                        self.conn.close()
-                        self.conn = None
+                    conn.close()
                     req.reply = None
                     if req.event:
                         req.event.set()
@@ -229,63 +560,85 @@ class _Peer(object):
                 else:
                     if conn_errors:
                         conn_errors = 0
-            else:
-                self.conn.settimeout(req.timeout)
+                self.connects += 1
+                if self.certfile:
+                    self.handshakes += 1
+                # if no data is received for MsgTimeout seconds,
+                # reply_proc checks if replies to requests are late
+                conn.settimeout(MsgTimeout)
+                self.conn = conn
+                self.replies = {}
+                SysCoro(self.reply_proc, conn, self.replies)
 
-            req.auth = self.auth
+            if req.name == 'send':
+                try:
+                    req = yield self.batch_req(req, coro)
+                except GeneratorExit:
+                    break
+            msg = self.prepare_req(req)
+            if msg is None:
+                continue
+            conn = self.conn
+            reqs = [req]
             try:
-                yield self.conn.send_msg(serialize(req))
-                reply = yield self.conn.recv_msg()
-                reply = unserialize(reply)
-                if req.event:
-                    if reply is not None or req.dst == self.location:
-                        req.reply = reply
-                        req.event.set()
-                else:
-                    req.reply = reply
-            except socket.error as exc:
-                logger.debug('%s: Could not send "%s" to %s', _Peer._asyncoro._location, req.name,
-                             self.location)
-                # logger.debug(traceback.format_exc())
-                if len(exc.args) == 1 and exc.args[0] == 'hangup':
+                # requests queued after this one (that can be sent without
+                # waiting for replies) are sent along with it, with one
+                # 'sendall', until they add up to at least MaxBatchBytes
+                # bytes
+                msgs = [self.compress(msg)]
+                size = len(msg)
+                while size < MaxBatchBytes:
+                    _Peer._lock.acquire()
+                    if self.reqs and len(self.replies) < MaxPendingRequests:
+                        req = self.reqs.popleft()
+                    else:
+                        req = None
+                    _Peer._lock.release()
+                    if not req:
+                        break
+                    if req.name == 'send':
+                        req = yield self.batch_req(req, coro)
+                    msg = self.prepare_req(req)
+                    if msg is None:
+                        continue
+                    reqs.append(req)
+                    msgs.append(self.compress(msg))
+                    size += len(msg)
+                yield conn.sendall(AsyncSocket._msgs_buffers(msgs))
+            except GeneratorExit:
+                break
+            except Exception as exc:
+                if reused and resent != reqs[0]:
+                    # connection kept open may have been closed by peer
+                    # (or broken) while idle; send requests again on new
+                    # connection
+                    resent = reqs[0]
+                    _Peer._lock.acquire()
+                    for req in reqs:
+                        self.replies.pop(req.id, None)
+                    self.reqs.extendleft(reversed(reqs))
+                    _Peer._lock.release()
+                # reply_proc drops requests waiting for replies when
+                # connection is closed
+                logger.debug('%s: Could not send "%s" to %s', _Peer._asyncoro._location,
+                             reqs[0].name, self.location)
+                if isinstance(exc, socket.error) and len(exc.args) == 1 and \
+                   exc.args[0] == 'hangup':
                     logger.warning('peer "%s" not reachable', self.location)
                     # TODO: remove peer?
                 try:
-                    self.conn.shutdown(socket.SHUT_WR)
-                    self.conn.close()
-                except:
-                    pass
-                self.conn = None
-                req.reply = None
-            except socket.timeout:
-                # logger.debug(traceback.format_exc())
-                try:
-                    self.conn.shutdown(socket.SHUT_WR)
-                    self.conn.close()
+                    conn.shutdown(socket.SHUT_RDWR)
                 except:
                     pass
-                self.conn = None
-                req.reply = None
-            except GeneratorExit:
-                if self.conn:
-                    try:
-                        self.conn.shutdown(socket.SHUT_WR)
-                        self.conn.close()
-                    except:
-                        pass
+                if self.conn == conn:
                     self.conn = None
-                break
-            except:
-                # logger.debug(traceback.format_exc())
-                if self.conn:
-                    try:
-                        self.conn.shutdown(socket.SHUT_WR)
-                        self.conn.close()
-                    except:
-                        pass
-                    self.conn = None
-                req.reply = None
 
+        if self.conn:
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
+            self.conn = None
         if req and req.name == 'peer_closed' and isinstance(req.event, Event):
             req.event.set()
         else:
@@ -299,6 +652,126 @@ class _Peer(object):
         _Peer.remove(self.location)
         raise StopIteration(None)
 
+    def prepare_req(self, req):
+        """Internal use only. Returns serialized request 'req' to send to
+        peer, after adding it to requests waiting for replies. If request
+        is too big for peer, its reply is set to None and None is
+        returned.
+        """
+        if self.auth_conns:
+            req.auth = None
+        else:
+            req.auth = self.auth
+        self.req_id += 1
+        req.id = self.req_id
+        msg = serialize(req, self.serializer)
+        if len(msg) >= AsyncSocket._LongMsgLength and not self.long_msgs:
+            logger.warning('request "%s" of %s bytes is too big for peer %s',
+                           req.name, len(msg), self.location)
+            req.reply = None
+            if req.event:
+                req.event.set()
+            return None
+        _Peer._lock.acquire()
+        if req.timeout:
+            self.replies[req.id] = (req, time.time() + req.timeout)
+        else:
+            self.replies[req.id] = (req, None)
+        _Peer._lock.release()
+        return msg
+
+    def batch_req(self, req, coro):
+        """Internal use only. Returns request with messages in 'send'
+        request 'req' and 'send' requests queued after it, or 'req' if
+        there are no such requests.
+        """
+        first = req
+        msgs = []
+        n = 1
+        size = 0
+        lingered = False
+        while n < MaxBatchSize and size < MaxBatchBytes:
+            _Peer._lock.acquire()
+            if self.reqs and self.reqs[0].name == 'send':
+                req = self.reqs.popleft()
+            else:
+                req = None
+            _Peer._lock.release()
+            if req:
+                if not msgs:
+                    msgs.append(serialize(first.kwargs, self.serializer))
+                    size = len(msgs[0])
+                msg = serialize(req.kwargs, self.serializer)
+                msgs.append(msg)
+                size += len(msg)
+                n += 1
+            elif BatchLinger and not lingered:
+                lingered = True
+                yield coro.sleep(BatchLinger)
+            else:
+                break
+        if not msgs:
+            raise StopIteration(first)
+        raise StopIteration(_NetRequest('send_batch', kwargs={'msgs': msgs}, dst=self.location,
+                                        timeout=MsgTimeout))
+
+    def reply_proc(self, conn, replies, coro=None):
+        coro.set_daemon()
+        while 1:
+            try:
+                msg = yield conn.recv_msg()
+            except socket.timeout:
+                # close connection if replies to requests are not
+                # received in time
+                now = time.time()
+                _Peer._lock.acquire()
+                expired = any(expires and expires < now for req, expires in replies.values())
+                _Peer._lock.release()
+                if expired:
+                    break
+                continue
+            except:
+                break
+            if not msg:
+                break
+            try:
+                req_id, reply = unserialize(_decompress(msg)[1])
+            except:
+                break
+            _Peer._lock.acquire()
+            req, expires = replies.pop(req_id, (None, None))
+            if self.waiting and self.conn == conn:
+                if self.reqs:
+                    if len(replies) == (MaxPendingRequests - 1):
+                        self.req_coro.send(1)
+                elif not replies and not self.stream:
+                    # req_proc is waiting for requests; it closes
+                    # connection if it stays idle for PeerIdleTimeout
+                    self.req_coro.send(1)
+            _Peer._lock.release()
+            if req:
+                if req.event:
+                    if reply is not None or req.dst == self.location:
+                        req.reply = reply
+                        req.event.set()
+                else:
+                    req.reply = reply
+
+        _Peer._lock.acquire()
+        if self.conn == conn:
+            self.conn = None
+        for req, expires in replies.values():
+            req.reply = None
+        replies.clear()
+        if self.waiting and self.reqs and self.req_coro:
+            self.req_coro.send(1)
+        _Peer._lock.release()
+        try:
+            conn.shutdown(socket.SHUT_WR)
+        except:
+            pass
+        conn.close()
+
     @staticmethod
     def remove(location):
         _Peer._lock.acquire()
@@ -495,6 +968,37 @@ class AsynCoro(asyncoro.AsynCoro):
     'max_file_size' is maximum length of file in bytes allowed for
     transferred files. If it is 0 or None (default), there is no
     limit.
+
+    'file_cache_size' is maximum total size in bytes of files kept in
+    cache (in directory '.file_cache' under 'dest_path') so files with
+    same contents sent again (e.g., to different directories) are not
+    transferred. Cached files are (read-only) copies of files
+    received, and their contents are checked when they are used, so
+    files received can be modified. If it is 0, files are not cached.
+
+    'serializers' is list of names of serializers (registered with
+    'register_serializer'), in order of preference, that can be used for
+    requests sent to (and replies from) peers. The first one that is
+    also supported by a peer is used with that peer; if there is none,
+    requests are pickled. The default 'compact' serializer encodes
+    requests and replies in fewer bytes than pickle.
+
+    'compressors' is list of names of compressors ('zlib' and, if
+    modules 'lz4' and 'zstandard' are available, 'lz4' and 'zstd'), in
+    order of preference, that can be used to compress requests sent to
+    peers (and replies to them) and files sent with 'send_file'. The
+    first one that is also available at a peer is used with that
+    peer. Only messages of at least CompressThreshold bytes are
+    compressed, and if compression is not effective, it is not used for
+    next messages (see 'peer_stats'). If it is None (default), data
+    sent is not compressed.
+
+    'integrated_loop' is same as in asyncoro.AsynCoro. I/O events are
+    processed by one (process-wide) notifier, so in this case I/O of all
+    sockets, including connections with peers used by the system
+    scheduler, is processed in this scheduler's thread (where user
+    coroutines run); coroutines that compute for long without yielding
+    delay communication with peers as well.
     """
 
     __metaclass__ = Singleton
@@ -505,7 +1009,8 @@ class AsynCoro(asyncoro.AsynCoro):
     def __init__(self, *args, **kwargs):
         AsynCoro._instance = self
         atexit.register(self.finish)
-        super(self.__class__, self).__init__()
+        integrated_loop = kwargs.pop('integrated_loop', False)
+        super(self.__class__, self).__init__(integrated_loop=integrated_loop)
         RCI._asyncoro = _SysAsynCoro_._asyncoro = self
         self._sys_asyncoro = _SysAsynCoro_(*args, **kwargs)
         self.__class__._sys_asyncoro = self._sys_asyncoro
@@ -514,6 +1019,10 @@ class AsynCoro(asyncoro.AsynCoro):
         self._certfile = self._sys_asyncoro._certfile
         self._keyfile = self._sys_asyncoro._keyfile
         self.__dest_path_prefix = self.__dest_path = self._sys_asyncoro.dest_path
+        # hashes of files sent, so files not changed are not read again
+        self._file_hashes = {}
+        # thread to compute hashes of (and compress chunks of) files sent
+        self._file_pool = None
 
     @classmethod
     def instance(cls, *args, **kwargs):
@@ -626,6 +1135,22 @@ class AsynCoro(asyncoro.AsynCoro):
         """
         return _Peer.get_peers()
 
+    def peer_stats(self, location):
+        """Returns dictionary with number of connections ('connects') and
+        SSL handshakes ('handshakes') made to peer at 'location' and
+        whether connection to it is open now ('connected'), or None if
+        there is no such peer. Connections are kept open (for
+        PeerIdleTimeout seconds after they are idle) and reused.
+
+        If compression is used with peer, 'compressor' is its name (it is
+        None otherwise), 'bytes_saved' is number of bytes saved by
+        compressing requests and files sent to it, and 'compress_time' is
+        seconds spent compressing them.
+        """
+        if not isinstance(location, Location):
+            return None
+        return _Peer.get_stats(location)
+
     def close_peer(self, location, timeout=MsgTimeout):
         """Close peer at 'location'.
         """
@@ -646,7 +1171,8 @@ class AsynCoro(asyncoro.AsynCoro):
             return
         SysCoro(self._sys_asyncoro.discover_peers, port=port)
 
-    def send_file(self, location, file, dir=None, overwrite=False, timeout=MsgTimeout):
+    def send_file(self, location, file, dir=None, overwrite=False, timeout=MsgTimeout,
+                  chunk_size=FileChunkSize, window=FileWindow):
         """Must be used with 'yield' as
         'val = yield scheduler.send_file(location, "file1")'.
 
@@ -659,6 +1185,13 @@ class AsynCoro(asyncoro.AsynCoro):
         size/timestamp/permissions, but 'overwrite' is False. 'timeout' is max
         seconds to transfer 1MB of data. If return value is 0, the sender may
         want to delete file with 'del_file' later.
+
+        File is sent in chunks of 'chunk_size' bytes, without waiting for
+        acknowledgements as long as no more than 'window' chunks are not
+        acknowledged yet. If connection is lost, transfer is resumed (with a
+        new connection) from the data acknowledged. If compression is
+        enabled with peer (see 'compressors' of AsynCoro), chunks are
+        compressed (in a thread).
         """
         try:
             stat_buf = os.stat(file)
@@ -678,47 +1211,131 @@ class AsynCoro(asyncoro.AsynCoro):
         if peer is None:
             logger.debug('%s is not a valid peer', location)
             raise StopIteration(-1)
+        size = stat_buf.st_size
+        window *= chunk_size
+        # receiver uses hash of file to find file with same contents in
+        # its cache, in which case file is not transferred
+        digest = yield self._file_hash(file, stat_buf)
         kwargs = {'file': os.path.basename(file), 'stat_buf': stat_buf,
-                  'overwrite': overwrite is True, 'dir': dir}
+                  'overwrite': overwrite is True, 'dir': dir, 'chunk_size': chunk_size,
+                  'offset': 0, 'hash': digest}
+        if peer.compressor:
+            kwargs['compressor'] = peer.compressor
+            if not self._file_pool:
+                self._file_pool = AsyncThreadPool(1)
         req = _NetRequest('send_file', kwargs=kwargs, dst=location, timeout=timeout)
-        sock = AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM),
-                           keyfile=self._keyfile, certfile=self._certfile)
-        if timeout:
-            sock.settimeout(timeout)
         fd = open(file, 'rb')
-        try:
-            yield sock.connect((location.addr, location.port))
-            req.auth = peer.auth
-            yield sock.send_msg(serialize(req))
-            recvd = yield sock.recv_msg()
-            recvd = unserialize(recvd)
-            sent = 0
-            while sent == recvd:
-                data = fd.read(1024000)
-                if not data:
-                    break
-                yield sock.sendall(data)
-                sent += len(data)
+        conn_errors = 0
+        while True:
+            sock = AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM),
+                               keyfile=self._keyfile, certfile=self._certfile)
+            if timeout:
+                sock.settimeout(timeout)
+            try:
+                yield sock.connect((location.addr, location.port))
+                req.auth = peer.auth
+                yield sock.send_msg(serialize(req))
+                # receiver replies with offset to send from (or with
+                # result if file is not sent), then acknowledges each
+                # chunk received, until it replies with result
                 recvd = yield sock.recv_msg()
+                if not recvd:
+                    raise socket.error('hangup')
                 recvd = unserialize(recvd)
-            if recvd == stat_buf.st_size:
-                reply = 0
-            else:
+                sent = recvd
+                while 0 <= recvd < size:
+                    if recvd > kwargs['offset']:
+                        kwargs['offset'] = recvd
+                        conn_errors = 0
+                    if sent < size and (sent - recvd) < window:
+                        if peer.compressor:
+                            n = min(chunk_size, size - sent)
+                            msg = yield self._file_pool.async_task(self._file_chunk, fd, sent, n,
+                                                                   peer)
+                            if not msg:
+                                raise Exception('file "%s" changed' % file)
+                            yield sock.send_msg(msg)
+                        else:
+                            n = yield sock.sendfile(fd, sent, min(chunk_size, size - sent))
+                            if not n:
+                                raise Exception('file "%s" changed' % file)
+                        sent += n
+                    else:
+                        recvd = yield sock.recv_msg()
+                        if not recvd:
+                            raise socket.error('hangup')
+                        recvd = unserialize(recvd)
+                if recvd == size:
+                    reply = 0
+                else:
+                    reply = -1
+            except socket.error as exc:
+                reply = -1
+                conn_errors += 1
+                if kwargs['offset'] and conn_errors < MaxConnectionErrors:
+                    # resume from data acknowledged
+                    logger.debug('resuming send_file of "%s" to %s at %s',
+                                 file, location, kwargs['offset'])
+                    sock.close()
+                    continue
+                logger.debug('could not send "%s" to %s', req.name, location)
+                if len(exc.args) == 1 and exc.args[0] == 'hangup':
+                    logger.warning('peer "%s" not reachable', location)
+                    # TODO: remove peer?
+            except:
+                logger.warning('send_file: Could not send "%s" to %s', file, location)
                 reply = -1
-        except socket.error as exc:
-            reply = -1
-            logger.debug('could not send "%s" to %s', req.name, location)
-            if len(exc.args) == 1 and exc.args[0] == 'hangup':
-                logger.warning('peer "%s" not reachable', location)
-                # TODO: remove peer?
-        except:
-            logger.warning('send_file: Could not send "%s" to %s', file, location)
-            reply = -1
-        finally:
             sock.close()
-            fd.close()
+            break
+        fd.close()
         raise StopIteration(reply)
 
+    def _file_hash(self, file, stat_buf):
+        """Internal use only.
+        """
+        path = os.path.abspath(file)
+        entry = self._file_hashes.get(path, None)
+        if entry and entry[:2] == (stat_buf.st_size, stat_buf.st_mtime):
+            raise StopIteration(entry[2])
+        # file is read in a thread so scheduler is not blocked
+        if not self._file_pool:
+            self._file_pool = AsyncThreadPool(1)
+        try:
+            digest = yield self._file_pool.async_task(self._hash_file, path)
+        except:
+            logger.debug('could not compute hash of "%s"', file)
+            raise StopIteration(None)
+        self._file_hashes[path] = (stat_buf.st_size, stat_buf.st_mtime, digest)
+        raise StopIteration(digest)
+
+    @staticmethod
+    def _file_chunk(fd, offset, size, peer):
+        """Internal use only. Returns message with 'size' bytes at 'offset'
+        in file 'fd', compressed for 'peer' (or prefixed with 'raw:' if
+        compression is not effective), or None if file is shorter.
+        """
+        fd.seek(offset)
+        data = fd.read(size)
+        if len(data) != size:
+            return None
+        msg = peer.compress(data)
+        if msg is data:
+            return [b'raw:', data]
+        return msg
+
+    @staticmethod
+    def _hash_file(path):
+        """Internal use only.
+        """
+        digest = hashlib.sha1()
+        with open(path, 'rb') as fd:
+            while True:
+                data = fd.read(1024000)
+                if not data:
+                    break
+                digest.update(data)
+        return digest.hexdigest()
+
     def del_file(self, location, file, dir=None, timeout=None):
         """Must be used with 'yield' as
         'loc = yield scheduler.del_file(location, "file1")'.
@@ -763,9 +1380,68 @@ class SysCoro(asyncoro.Coro):
         if not SysCoro._asyncoro:
             AsynCoro.instance()
         self._scheduler = SysCoro._asyncoro
+        if getattr(self, '_priority', None) is None:
+            self._priority = Coro.HighPriority
         super(SysCoro, self).__init__(*args, **kwargs)
 
 
+class _ReplyQueue(object):
+    """Internal use only. Replies to requests received on a connection
+    (see '_tcp_task' of _SysAsynCoro_) are queued and sent by a
+    coroutine, so processing requests doesn't wait for replies to be
+    sent; replies queued while earlier replies are being sent are sent
+    together, with one 'sendall'.
+    """
+
+    __slots__ = ('conn', 'msgs', 'waiting', 'closed', 'coro')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.msgs = collections.deque()
+        self.waiting = False
+        self.closed = False
+        self.coro = SysCoro(self.send_proc)
+
+    def put(self, msg):
+        if self.closed or self.msgs is None:
+            return
+        self.msgs.append(msg)
+        if self.waiting:
+            self.waiting = False
+            self.coro.send(1)
+
+    def close(self):
+        """Connection is closed after queued replies are sent.
+        """
+        self.closed = True
+        if self.waiting:
+            self.waiting = False
+            self.coro.send(1)
+
+    def send_proc(self, coro=None):
+        coro.set_daemon()
+        while 1:
+            if not self.msgs:
+                if self.closed:
+                    break
+                self.waiting = True
+                yield coro.receive()
+                continue
+            msgs = list(self.msgs)
+            self.msgs.clear()
+            try:
+                yield self.conn.sendall(AsyncSocket._msgs_buffers(msgs))
+            except:
+                # replies can't be sent anymore; reading requests from
+                # connection fails, so it is closed
+                self.msgs = None
+                try:
+                    self.conn.shutdown(socket.SHUT_RDWR)
+                except:
+                    pass
+        self.conn.close()
+
+
 class _SysAsynCoro_(asyncoro.AsynCoro):
     """Internal use only.
     """
@@ -778,7 +1454,8 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
     def __init__(self, udp_port=0, tcp_port=0, node=None, ext_ip_addr=None,
                  name=None, discover_peers=True,
                  secret='', certfile=None, keyfile=None, notifier=None,
-                 dest_path=None, max_file_size=None):
+                 dest_path=None, max_file_size=None, file_cache_size=FileCacheSize,
+                 serializers=('compact',), compressors=None):
         super(self.__class__, self).__init__()
         SysCoro._asyncoro = _Peer._asyncoro = self
         if node:
@@ -811,6 +1488,26 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
                     logger.warning('failed to create "%s"', self.__dest_path)
                     logger.debug(traceback.format_exc())
         self.max_file_size = max_file_size
+        # hashes of files in cache, least recently used first
+        self.__file_cache_path = os.path.join(self.__dest_path, '.file_cache')
+        self.__file_cache = collections.OrderedDict()
+        self.__file_cache_used = 0
+        self.file_cache_size = file_cache_size
+        # files are copied to and from cache (in a thread)
+        self._file_pool = None
+        if file_cache_size and os.path.isdir(self.__file_cache_path):
+            # modification time is updated when file is used
+            entries = []
+            for digest in os.listdir(self.__file_cache_path):
+                try:
+                    sbuf = os.stat(os.path.join(self.__file_cache_path, digest))
+                except:
+                    continue
+                entries.append((sbuf.st_mtime, digest, sbuf.st_size))
+            for mtime, digest, size in sorted(entries):
+                self.__file_cache[digest] = size
+                self.__file_cache_used += size
+            self._evict_files()
         self._certfile = certfile
         self._keyfile = keyfile
         self._udp_sock = AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
@@ -849,7 +1546,28 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
         else:
             self._signature = os.urandom(20).encode('hex')
             self._auth_code = hashlib.sha1(self._signature + secret).hexdigest()
+        # serializers (in order of preference) that can be used for
+        # requests to / from peers
+        self._serializers = []
+        for serializer in (serializers or ()):
+            if serializer in asyncoro._serializers:
+                self._serializers.append(serializer)
+            else:
+                logger.warning('invalid serializer "%s" ignored', serializer)
+        # compressors (in order of preference) that can be used for
+        # requests and files sent to peers
+        self._compressors = []
+        for compressor in (compressors or ()):
+            if compressor in _compressors:
+                self._compressors.append(compressor)
+            else:
+                logger.warning('compressor "%s" is not available', compressor)
 
+        # connections from peers waiting for next request; peers keep
+        # them open while idle, so they are closed when scheduler is
+        # terminated (see 'finish')
+        self._tcp_idle = set()
+        self._tcp_closing = False
         self._tcp_sock.listen(32)
         logger.info('network server %s@ %s, udp_port=%s', '"%s" ' % name if name else '',
                     self._location, self._udp_sock.getsockname()[1])
@@ -878,7 +1596,143 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
     def dest_path(self, path):
         self.__dest_path = path
 
+    def _peer_serializer(self, serializers):
+        """Internal use only. Returns name of first serializer (in order
+        of preference) that is also in peer's 'serializers', or None (for
+        pickle) if there is no such serializer.
+        """
+        if isinstance(serializers, (list, tuple)):
+            for serializer in self._serializers:
+                if serializer in serializers:
+                    return serializer
+        return None
+
+    def _peer_compressor(self, compressors):
+        """Internal use only. Returns name of first compressor (in order
+        of preference) that is also in peer's 'compressors', or None if
+        there is no such compressor (or compression is not enabled).
+        """
+        if isinstance(compressors, (list, tuple)):
+            for compressor in self._compressors:
+                if compressor in compressors:
+                    return compressor
+        return None
+
+    def _cached_file(self, digest, size):
+        """Internal use only.
+
+        Returns path of file in cache with hash 'digest', or None if it is
+        not in cache.
+        """
+        if not self.file_cache_size or self.__file_cache.get(digest, None) != size:
+            return None
+        path = os.path.join(self.__file_cache_path, digest)
+        try:
+            sbuf = os.stat(path)
+        except:
+            sbuf = None
+        if not sbuf or sbuf.st_size != size:
+            # removed or modified
+            self._uncache_file(digest)
+            return None
+        self.__file_cache.pop(digest)
+        self.__file_cache[digest] = size
+        try:
+            os.utime(path, None)
+        except:
+            pass
+        return path
+
+    def _cache_file(self, path, digest, size):
+        """Internal use only. Must be used with 'yield'.
+
+        Copies file at 'path' (with hash 'digest') to cache. Files in
+        cache are (read-only) copies, so files received (which may be
+        modified) don't share data with them.
+        """
+        if not self.file_cache_size or size > self.file_cache_size or \
+           digest in self.__file_cache:
+            raise StopIteration
+        cached = os.path.join(self.__file_cache_path, digest)
+        try:
+            if not os.path.isdir(self.__file_cache_path):
+                os.makedirs(self.__file_cache_path)
+            if not self._file_pool:
+                self._file_pool = AsyncThreadPool(1)
+            copied = yield self._file_pool.async_task(self._copy_file, path, cached + '.part',
+                                                       digest)
+            if not copied:
+                # file was modified after it was received
+                raise StopIteration
+            os.chmod(cached + '.part', stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            if os.path.isfile(cached):
+                os.chmod(cached, stat.S_IRUSR | stat.S_IWUSR)
+                os.remove(cached)
+            os.rename(cached + '.part', cached)
+        except StopIteration:
+            raise
+        except:
+            logger.debug('could not cache "%s": %s', path, traceback.format_exc())
+            raise StopIteration
+        self.__file_cache[digest] = size
+        self.__file_cache_used += size
+        self._evict_files()
+
+    def _uncache_file(self, digest):
+        """Internal use only. Removes file with hash 'digest' from cache.
+        """
+        size = self.__file_cache.pop(digest, None)
+        if size is not None:
+            self.__file_cache_used -= size
+        path = os.path.join(self.__file_cache_path, digest)
+        try:
+            if os.path.isfile(path):
+                # cached files are read-only
+                os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+                os.remove(path)
+        except:
+            logger.debug('could not remove cached file %s', digest)
+
+    def _evict_files(self):
+        """Internal use only.
+        """
+        while self.__file_cache_used > self.file_cache_size and self.__file_cache:
+            self._uncache_file(next(iter(self.__file_cache)))
+
+    @staticmethod
+    def _copy_file(src, dst, digest):
+        """Internal use only. Copies file 'src' to 'dst' and returns True
+        if hash of data copied is 'digest'; otherwise, 'dst' is removed
+        and False is returned.
+        """
+        sha1 = hashlib.sha1()
+        try:
+            with open(src, 'rb') as src_fd:
+                with open(dst, 'wb') as dst_fd:
+                    while True:
+                        data = src_fd.read(1024000)
+                        if not data:
+                            break
+                        sha1.update(data)
+                        dst_fd.write(data)
+            if sha1.hexdigest() == digest:
+                return True
+        except:
+            if not os.path.isfile(dst):
+                raise
+        os.remove(dst)
+        return False
+
     def finish(self):
+        # scheduler waits for (non-daemon) coroutines serving connections,
+        # so connections waiting for requests are shut down; connections
+        # processing requests are closed after replying
+        self._tcp_closing = True
+        for conn in list(self._tcp_idle):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except:
+                pass
         super(self.__class__, self).finish()
         if self._tcp_sock:
             self._tcp_sock.close()
@@ -926,7 +1780,10 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
             if loc.port:
                 req = _NetRequest('ping',
                                   kwargs={'location': self._location, 'signature': self._signature,
-                                          'name': self._name, 'version': __version__}, dst=loc)
+                                          'name': self._name, 'version': __version__,
+                                          'long_msgs': True, 'serializers': self._serializers,
+                                          'compressors': list(_compressors), 'auth_conns': True},
+                                  dst=loc)
                 sock = AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM))
                 sock.settimeout(2)
                 try:
@@ -976,7 +1833,9 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
         def send_ping_req(peer, auth, coro=None):
             req = _NetRequest('ping',
                               kwargs={'location': self._location, 'signature': self._signature,
-                                      'name': self._name, 'version': __version__},
+                                      'name': self._name, 'version': __version__,
+                                      'long_msgs': True, 'serializers': self._serializers,
+                                      'compressors': list(_compressors), 'auth_conns': True},
                               dst=peer, auth=auth)
             sock = AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM),
                                keyfile=self._keyfile, certfile=self._certfile)
@@ -1051,19 +1910,56 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
             SysCoro(self._tcp_task, conn, addr)
 
     def _tcp_task(self, conn, addr, coro=None):
+        # replies are sent with id of request, so requests that may take
+        # long to finish (e.g., 'deliver' to a channel) are processed
+        # concurrently and replies to them may be out of order
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # replies are sent by another coroutine, so next request is
+        # processed while reply to earlier one is being sent
+        replies = _ReplyQueue(conn)
+        # if connection is authenticated (see req_proc of _Peer), requests
+        # on it are not checked for auth code
+        authenticated = False
         while 1:
+            # peer may keep connection open (idle) for PeerIdleTimeout
+            # seconds; it is shut down by 'finish' if scheduler is
+            # terminated while waiting for next request
+            self._tcp_idle.add(conn)
             try:
+                if self._tcp_closing:
+                    break
                 msg = yield conn.recv_msg()
             except:
                 break
+            finally:
+                self._tcp_idle.discard(conn)
             if not msg:
                 break
+            if msg == b'auth:':
+                challenge = os.urandom(20)
+                try:
+                    yield conn.send_msg(challenge)
+                    digest = yield conn.recv_msg()
+                except:
+                    break
+                if not self._auth_code or not digest or \
+                   not hmac.compare_digest(digest, hmac.new(self._auth_code.encode(), challenge,
+                                                            hashlib.sha1).digest()):
+                    logger.warning('%s: authentication of connection from %s failed',
+                                   self._location, addr[0])
+                    break
+                authenticated = True
+                continue
             try:
+                # reply with same compressor as request
+                compressor, msg = _decompress(msg)
                 req = unserialize(msg)
             except:
                 logger.debug('%s ignoring invalid message', self._location)
                 break
-            if req.auth != self._auth_code and req.name != 'ping':
+            # reply with same serializer as request
+            serializer = asyncoro.serializer_name(msg)
+            if not authenticated and req.auth != self._auth_code and req.name != 'ping':
                 logger.warning('invalid request %s ignored: "%s", "%s"',
                                req.name, req.auth, self._auth_code)
                 break
@@ -1071,163 +1967,8 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
             #     logger.debug('invalid request "%s" to %s (%s)', req.name, req.dst, self._location)
             #     break
 
-            if req.name == 'send':
-                # synchronous message
-                reply = -1
-                if req.dst != self._location:
-                    logger.warning('ignoring invalid "send" (%s != %s)', req.dst, self._location)
-                else:
-                    coro = req.kwargs.get('coro', None)
-                    if coro:
-                        name = req.kwargs.get('name', ' ')
-                        if name[0] == '~':
-                            Coro._asyncoro._lock.acquire()
-                            coro = Coro._asyncoro._coros.get(int(coro), None)
-                            Coro._asyncoro._lock.release()
-                            if coro and coro._name == name:
-                                reply = coro.send(req.kwargs['message'])
-                            else:
-                                logger.warning('ignoring invalid recipient to "send"')
-                        elif name[0] == '!':
-                            coro = self._coros.get(int(coro))
-                            if coro and coro._name == name:
-                                reply = coro.send(req.kwargs['message'])
-                            else:
-                                logger.warning('ignoring invalid recipient to "send"')
-                        else:
-                            logger.warning('invalid "send" message ignored')
-                    else:
-                        channel = req.kwargs.get('channel', None)
-                        if channel[0] == '~':
-                            Channel._asyncoro._lock.acquire()
-                            channel = Channel._asyncoro._channels.get(channel)
-                            Channel._asyncoro._lock.release()
-                            if channel:
-                                reply = channel.send(req.kwargs['message'])
-                            else:
-                                logger.warning('ignoring invalid recipient to "send"')
-                        elif channel[0] == '!':
-                            channel = self._channels.get(channel)
-                            if isinstance(channel, Channel):
-                                reply = channel.send(req.kwargs['message'])
-                            else:
-                                logger.warning('invalid "send" message ignored')
-                        else:
-                            logger.warning('ignoring invalid recipient to "send"')
-                yield conn.send_msg(serialize(reply))
-            elif req.name == 'deliver':
-                # synchronous message
-                reply = -1
-                if req.dst != self._location:
-                    logger.warning('ignoring invalid "deliver" (%s != %s)', req.dst, self._location)
-                else:
-                    coro = req.kwargs.get('coro', None)
-                    if coro:
-                        name = req.kwargs.get('name', ' ')
-                        if name[0] == '~':
-                            Coro._asyncoro._lock.acquire()
-                            coro = Coro._asyncoro._coros.get(int(coro))
-                            Coro._asyncoro._lock.release()
-                            if coro and coro.send(req.kwargs['message']) == 0:
-                                reply = 1
-                        elif name[0] == '!':
-                            coro = self._coros.get(int(coro))
-                            if coro and coro.send(req.kwargs['message']) == 0:
-                                reply = 1
-                            else:
-                                logger.warning('invalid "deliver" message ignored')
-                    else:
-                        channel = req.kwargs.get('channel')
-                        if channel:
-                            if channel[0] == '~':
-                                Channel._asyncoro._lock.acquire()
-                                channel = Channel._asyncoro._channels.get(channel)
-                                Channel._asyncoro._lock.release()
-                                if channel:
-                                    reply = yield channel.deliver(
-                                        req.kwargs['message'], timeout=req.timeout,
-                                        n=req.kwargs['n'])
-                            elif channel[0] == '!':
-                                channel = self._channels.get(channel)
-                                if isinstance(channel, Channel):
-                                    reply = yield channel.deliver(
-                                        req.kwargs['message'], timeout=req.timeout,
-                                        n=req.kwargs['n'])
-                            else:
-                                logger.warning('invalid "deliver" message ignored')
-                        else:
-                            logger.warning('invalid "deliver" message ignored')
-                yield conn.send_msg(serialize(reply))
-            elif req.name == 'run_rci':
-                # synchronous message
-                if req.dst != self._location:
-                    reply = Exception('invalid RCI invocation')
-                else:
-                    RCI._asyncoro._lock.acquire()
-                    rci = RCI._asyncoro._rcis.get(req.kwargs['name'], None)
-                    RCI._asyncoro._lock.release()
-                    if rci:
-                        args = req.kwargs['args']
-                        kwargs = req.kwargs['kwargs']
-                        try:
-                            reply = Coro(rci._method, *args, **kwargs)
-                        except:
-                            reply = Exception(traceback.format_exc())
-                    else:
-                        reply = Exception('RCI "%s" is not registered' % req.kwargs['name'])
-                yield conn.send_msg(serialize(reply))
-            elif req.name == 'locate_coro':
-                Coro._asyncoro._lock.acquire()
-                coro = Coro._asyncoro._rcoros.get(req.kwargs['name'], None)
-                Coro._asyncoro._lock.release()
-                if not coro:
-                    coro = self._rcoros.get(req.kwargs['name'], None)
-                yield conn.send_msg(serialize(coro))
-            elif req.name == 'locate_channel':
-                Channel._asyncoro._lock.acquire()
-                channel = Channel._asyncoro._rchannels.get('~' + req.kwargs['name'], None)
-                Channel._asyncoro._lock.release()
-                if not channel:
-                    channel = self._rchannels.get('!' + req.kwargs['name'], None)
-                yield conn.send_msg(serialize(channel))
-            elif req.name == 'locate_rci':
-                RCI._asyncoro._lock.acquire()
-                rci = RCI._asyncoro._rcis.get(req.kwargs['name'], None)
-                RCI._asyncoro._lock.release()
-                yield conn.send_msg(serialize(rci))
-            elif req.name == 'monitor':
-                # synchronous message
-                assert req.dst == self._location
-                reply = -1
-                monitor = req.kwargs.get('monitor', None)
-                coro = req.kwargs.get('coro', None)
-                name = req.kwargs.get('name', None)
-                if coro and name:
-                    if name[0] == '~':
-                        Coro._asyncoro._lock.acquire()
-                        coro = Coro._asyncoro._coros.get(int(coro), None)
-                        if coro and coro._name == name:
-                            reply = Coro._asyncoro._monitor(monitor, coro)
-                        Coro._asyncoro._lock.release()
-                    elif name == '!':
-                        coro = self._coros.get(int(coro), None)
-                        if coro and coro._name == name:
-                            reply = self._monitor(monitor, coro)
-                yield conn.send_msg(serialize(reply))
-            elif req.name == 'terminate_coro':
-                reply = -1
-                coro = req.kwargs.get('coro', None)
-                name = req.kwargs.get('name', None)
-                if coro and name:
-                    if name[0] == '~':
-                        Coro._asyncoro._lock.acquire()
-                        coro = Coro._asyncoro._coros.get(int(coro), None)
-                        Coro._asyncoro._lock.release()
-                    elif name[0] == '!':
-                        coro = self._coros.get(int(coro), None)
-                if isinstance(coro, Coro):
-                    reply = coro.terminate()
-                yield conn.send_msg(serialize(reply))
+            if req.name == 'deliver':
+                SysCoro(self._tcp_reply, replies, req, serializer, compressor)
             elif req.name == 'ping':
                 peer_loc = req.kwargs.get('location', None)
                 if req.kwargs.get('version', None) != __version__:
@@ -1252,7 +1993,9 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
                     break
                 pong = _NetRequest('pong',
                                    kwargs={'location': self._location, 'signature': self._signature,
-                                           'name': self._name, 'version': __version__},
+                                           'name': self._name, 'version': __version__,
+                                           'long_msgs': True, 'serializers': self._serializers,
+                                           'compressors': list(_compressors), 'auth_conns': True},
                                    dst=peer_loc, auth=auth_code)
                 sock = AsyncSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM),
                                    keyfile=self._keyfile, certfile=self._certfile)
@@ -1276,6 +2019,11 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
                 logger.debug('%s: found asyncoro "%s" at %s',
                              self._location, req.kwargs['name'], peer_loc)
                 peer = _Peer(req.kwargs['name'], peer_loc, auth_code, self._keyfile, self._certfile)
+                # peer can receive messages of 4GB or more (with 64-bit length)
+                peer.long_msgs = bool(req.kwargs.get('long_msgs', False))
+                peer.serializer = self._peer_serializer(req.kwargs.get('serializers', None))
+                peer.compressor = self._peer_compressor(req.kwargs.get('compressors', None))
+                peer.auth_conns = bool(req.kwargs.get('auth_conns', False))
 
                 _SysAsynCoro_._asyncoro._lock.acquire()
                 if (peer_loc.addr, peer_loc.port) in _SysAsynCoro_._asyncoro._stream_peers or \
@@ -1330,6 +2078,11 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
                 logger.debug('%s: found asyncoro "%s" at %s',
                              self._location, req.kwargs['name'], peer_loc)
                 peer = _Peer(req.kwargs['name'], peer_loc, auth_code, self._keyfile, self._certfile)
+                # peer can receive messages of 4GB or more (with 64-bit length)
+                peer.long_msgs = bool(req.kwargs.get('long_msgs', False))
+                peer.serializer = self._peer_serializer(req.kwargs.get('serializers', None))
+                peer.compressor = self._peer_compressor(req.kwargs.get('compressors', None))
+                peer.auth_conns = bool(req.kwargs.get('auth_conns', False))
                 _SysAsynCoro_._asyncoro._lock.acquire()
                 if (peer_loc.addr, peer_loc.port) in _SysAsynCoro_._asyncoro._stream_peers or \
                    (peer_loc.addr, 0) in _SysAsynCoro_._asyncoro._stream_peers:
@@ -1343,64 +2096,6 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
                     else:
                         _Peer.send_req_to(pending_req, peer_loc)
                 _SysAsynCoro_._asyncoro._lock.release()
-            elif req.name == 'subscribe':
-                # synchronous message
-                assert req.dst == self._location
-                reply = -1
-                channel = req.kwargs.get('channel', ' ')
-                if channel[0] == '~':
-                    Channel._asyncoro._lock.acquire()
-                    channel = Channel._asyncoro._channels.get(channel, None)
-                    Channel._asyncoro._lock.release()
-                elif channel[0] == '!':
-                    channel = self._channels.get(channel, None)
-                if isinstance(channel, Channel) and channel._location == self._location:
-                    subscriber = req.kwargs.get('subscriber', None)
-                    if isinstance(subscriber, Coro):
-                        if subscriber._location == self._location:
-                            Coro._asyncoro._lock.acquire()
-                            subscriber = Coro._asyncoro._coros.get(int(subscriber._id), None)
-                            Coro._asyncoro._lock.release()
-                        reply = yield channel.subscribe(subscriber)
-                    elif isinstance(subsriber, Channel):
-                        if subscriber._location == self._location:
-                            Channel._asyncoro._lock.acquire()
-                            subscriber = self._channels.get(subscriber._name, None)
-                            Channel._asyncoro._lock.release()
-                        reply = yield channel.subscribe(subscriber)
-                yield conn.send_msg(serialize(reply))
-            elif req.name == 'unsubscribe':
-                # synchronous message
-                assert req.dst == self._location
-                reply = -1
-                channel = req.kwargs.get('channel', ' ')
-                if channel[0] == '~':
-                    Channel._asyncoro._lock.acquire()
-                    channel = Channel._asyncoro._channels.get(channel, None)
-                    Channel._asyncoro._lock.release()
-                elif channel[0] == '!':
-                    channel = self._channels.get(channel, None)
-                if isinstance(channel, Channel) and channel._location == self._location:
-                    subscriber = req.kwargs.get('subscriber', None)
-                    if isinstance(subscriber, Coro):
-                        if subscriber._location == self._location:
-                            Coro._asyncoro._lock.acquire()
-                            subscriber = Coro._asyncoro._coros.get(int(subscriber._id), None)
-                            Coro._asyncoro._lock.release()
-                        reply = yield channel.unsubscribe(subscriber)
-                    elif isinstance(subsriber, Channel):
-                        if subscriber._location == self._location:
-                            Channel._asyncoro._lock.acquire()
-                            subscriber = self._channels.get(subscriber._name, None)
-                            Channel._asyncoro._lock.release()
-                        reply = yield channel.unsubscribe(subscriber)
-                yield conn.send_msg(serialize(reply))
-            elif req.name == 'locate_peer':
-                if req.kwargs['name'] == self._name:
-                    loc = self._location
-                elif req.dst == self._location:
-                    loc = None
-                yield conn.send_msg(serialize(loc))
             elif req.name == 'send_file':
                 # synchronous message
                 assert req.dst == self._location
@@ -1415,7 +2110,8 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
                     logger.warning('file "%s" too big (%s) - must be smaller than %s',
                                    req.kwargs['file'], stat_buf.st_size, self.max_file_size)
                     resp = -1
-                elif not tgt.startswith(self.__dest_path):
+                elif not tgt.startswith(self.__dest_path) or \
+                     tgt.startswith(self.__file_cache_path):
                     resp = -1
                 elif os.path.isfile(tgt):
                     sbuf = os.stat(tgt)
@@ -1426,57 +2122,108 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
                     elif not req.kwargs['overwrite']:
                         resp = -1
 
+                digest = req.kwargs.get('hash', None)
+                if not (isinstance(digest, str) and len(digest) == 40 and digest.isalnum()):
+                    digest = None
+                transferred = False
+                if resp == 0 and digest:
+                    # if file with same contents is in cache, copy it
+                    # instead of transferring file; hash of data copied
+                    # is checked, in case cached file has been modified
+                    cached = self._cached_file(digest, stat_buf.st_size)
+                    if cached:
+                        part = tgt + '.part'
+                        try:
+                            if not os.path.isdir(os.path.dirname(tgt)):
+                                os.makedirs(os.path.dirname(tgt))
+                            if not self._file_pool:
+                                self._file_pool = AsyncThreadPool(1)
+                            copied = yield self._file_pool.async_task(self._copy_file, cached,
+                                                                       part, digest)
+                            if copied:
+                                os.utime(part, (stat_buf.st_atime, stat_buf.st_mtime))
+                                os.chmod(part, stat.S_IMODE(stat_buf.st_mode))
+                                if os.path.isfile(tgt):
+                                    os.remove(tgt)
+                                os.rename(part, tgt)
+                                resp = stat_buf.st_size
+                            else:
+                                self._uncache_file(digest)
+                        except:
+                            logger.debug('could not copy "%s": %s', tgt, traceback.format_exc())
                 if resp == 0:
+                    # data is saved in partial file, which is kept if
+                    # transfer fails, so sender can resume it
+                    part = tgt + '.part'
+                    recvd = req.kwargs.get('offset', 0)
                     try:
                         if not os.path.isdir(os.path.dirname(tgt)):
                             os.makedirs(os.path.dirname(tgt))
-                        fd = open(tgt, 'wb')
+                        if recvd and os.path.isfile(part) and os.path.getsize(part) >= recvd:
+                            fd = open(part, 'r+b')
+                            fd.seek(recvd)
+                            fd.truncate()
+                        else:
+                            recvd = 0
+                            fd = open(part, 'wb')
                     except:
                         logger.debug('failed to create "%s" : %s', tgt, traceback.format_exc())
                         resp = -1
                 if resp == 0:
-                    recvd = 0
+                    chunk_size = req.kwargs.get('chunk_size', FileChunkSize)
+                    # if compression is used, each chunk is sent as a
+                    # message, prefixed with compressor used (or 'raw:');
+                    # otherwise, data is received into (and written
+                    # from) same buffer
+                    compressed = req.kwargs.get('compressor', None) is not None
+                    if not compressed:
+                        buf = memoryview(bytearray(min(stat_buf.st_size - recvd, 1024000)))
                     try:
-                        while recvd < stat_buf.st_size:
+                        # offset to send from and then each chunk received
+                        # are acknowledged, without waiting for sender
+                        if recvd < stat_buf.st_size:
                             yield conn.send_msg(serialize(recvd))
-                            data = yield conn.recvall(min(stat_buf.st_size-recvd, 1024000))
-                            if not data:
+                        while recvd < stat_buf.st_size:
+                            end = min(stat_buf.st_size, recvd + chunk_size)
+                            if compressed:
+                                msg = yield conn.recv_msg()
+                                name, data = _decompress(msg)
+                                if not name:
+                                    if msg[:4] != b'raw:':
+                                        break
+                                    data = memoryview(msg)[4:]
+                                if len(data) != (end - recvd):
+                                    break
+                                fd.write(data)
+                                recvd = end
+                            while recvd < end:
+                                n = yield conn.recv_into(buf, min(end - recvd, len(buf)))
+                                if not n:
+                                    break
+                                fd.write(buf[:n])
+                                recvd += n
+                            if recvd < end:
                                 break
-                            fd.write(data)
-                            recvd += len(data)
+                            if recvd < stat_buf.st_size:
+                                yield conn.send_msg(serialize(recvd))
                     except:
                         logger.warning('copying file "%s" failed', tgt)
                     fd.close()
                     if recvd == stat_buf.st_size:
-                        os.utime(tgt, (stat_buf.st_atime, stat_buf.st_mtime))
-                        os.chmod(tgt, stat.S_IMODE(stat_buf.st_mode))
+                        os.utime(part, (stat_buf.st_atime, stat_buf.st_mtime))
+                        os.chmod(part, stat.S_IMODE(stat_buf.st_mode))
+                        if os.path.isfile(tgt):
+                            os.remove(tgt)
+                        os.rename(part, tgt)
                         resp = recvd
+                        transferred = True
                     else:
-                        os.remove(tgt)
                         resp = -1
                 yield conn.send_msg(serialize(resp))
-            elif req.name == 'del_file':
-                # synchronous message
-                assert req.dst == self._location
-                tgt = os.path.basename(req.kwargs['file'])
-                dir = req.kwargs['dir']
-                if isinstance(dir, str) and dir:
-                    tgt = os.path.join(dir, tgt)
-                tgt = os.path.join(self.__dest_path, tgt)
-                if tgt.startswith(self.__dest_path) and os.path.isfile(tgt):
-                    os.remove(tgt)
-                    d = os.path.dirname(tgt)
-                    try:
-                        while d > self.__dest_path and os.path.isdir(d):
-                            os.rmdir(d)
-                            d = os.path.dirname(d)
-                    except:
-                        # logger.debug(traceback.format_exc())
-                        pass
-                    reply = 0
-                else:
-                    reply = -1
-                yield conn.send_msg(serialize(reply))
+                if transferred and digest:
+                    # file is cached after replying, so sender doesn't
+                    # wait for it
+                    yield self._cache_file(tgt, digest, resp)
             elif req.name == 'peer_closed':
                 # synchronous message
                 peer_loc = req.kwargs.get('location', None)
@@ -1485,12 +2232,314 @@ class _SysAsynCoro_(asyncoro.AsynCoro):
                     # TODO: remove from _stream_peers?
                     # _SysAsynCoro_._asyncoro._stream_peers.pop((peer_loc.addr, peer_loc.port))
                     _Peer.remove(peer_loc)
-                    yield conn.send_msg(serialize('ack'))
+                    replies.put(serialize((req.id, 'ack'), serializer))
                 break
             else:
-                logger.warning('invalid request "%s" ignored', req.name)
+                reply = yield self._tcp_req(req)
+                replies.put(_compress(serialize((req.id, reply), serializer), compressor))
 
-        conn.close()
+        # connection is closed after pending replies are sent
+        replies.close()
+
+    def _tcp_reply(self, replies, req, serializer, compressor, coro=None):
+        coro.set_daemon()
+        reply = yield self._tcp_req(req)
+        replies.put(_compress(serialize((req.id, reply), serializer), compressor))
+
+    def _tcp_send(self, dst, kwargs):
+        """Internal use only. Sends message in "send" request to local
+        coroutine or channel.
+        """
+        reply = -1
+        if dst != self._location:
+            logger.warning('ignoring invalid "send" (%s != %s)', dst, self._location)
+        elif 'recipients' in kwargs:
+            # message sent to channel's subscribers at this peer (see
+            # 'send' in Channel); it is sent to each of them
+            message = kwargs['message']
+            reply = 0
+            for name, coro in kwargs['recipients']:
+                if coro is None:
+                    recipient = {'channel': name, 'message': message}
+                else:
+                    recipient = {'coro': coro, 'name': name, 'message': message}
+                if self._tcp_send(dst, recipient) != 0:
+                    reply = -1
+        else:
+            coro = kwargs.get('coro', None)
+            if coro:
+                name = kwargs.get('name', ' ')
+                if name[0] == '~':
+                    Coro._asyncoro._lock.acquire()
+                    coro = Coro._asyncoro._coros.get(int(coro), None)
+                    Coro._asyncoro._lock.release()
+                    if coro and coro._name == name:
+                        reply = coro.send(kwargs['message'])
+                    else:
+                        logger.warning('ignoring invalid recipient to "send"')
+                elif name[0] == '!':
+                    coro = self._coros.get(int(coro))
+                    if coro and coro._name == name:
+                        reply = coro.send(kwargs['message'])
+                    else:
+                        logger.warning('ignoring invalid recipient to "send"')
+                else:
+                    logger.warning('invalid "send" message ignored')
+            else:
+                channel = kwargs.get('channel', None)
+                if channel[0] == '~':
+                    Channel._asyncoro._lock.acquire()
+                    channel = Channel._asyncoro._channels.get(channel)
+                    Channel._asyncoro._lock.release()
+                elif channel[0] == '!':
+                    channel = self._channels.get(channel)
+                else:
+                    channel = None
+                if isinstance(channel, TopicChannel):
+                    reply = channel.send(kwargs.get('topic', None), kwargs['message'])
+                elif isinstance(channel, Channel):
+                    reply = channel.send(kwargs['message'])
+                else:
+                    logger.warning('ignoring invalid recipient to "send"')
+        return reply
+
+    def _tcp_req(self, req):
+        """Internal use only.
+        """
+        if req.name == 'send':
+            raise StopIteration(self._tcp_send(req.dst, req.kwargs))
+        elif req.name == 'send_batch':
+            # messages queued with 'send' at peer, in the order sent
+            reply = []
+            for msg in req.kwargs['msgs']:
+                try:
+                    kwargs = unserialize(msg)
+                except:
+                    logger.warning('invalid "send" message ignored')
+                    reply.append(-1)
+                else:
+                    reply.append(self._tcp_send(req.dst, kwargs))
+            raise StopIteration(reply)
+        elif req.name == 'deliver':
+            # synchronous message
+            reply = -1
+            if req.dst != self._location:
+                logger.warning('ignoring invalid "deliver" (%s != %s)', req.dst, self._location)
+            elif 'recipients' in req.kwargs:
+                # message delivered to channel's subscribers (coroutines) at
+                # this peer (see 'deliver' in Channel); reply is number of
+                # them delivered to and indices of invalid ones
+                message = req.kwargs['message']
+                delivered = 0
+                invalid = []
+                for i, (name, coro) in enumerate(req.kwargs['recipients']):
+                    if self._tcp_send(req.dst, {'coro': coro, 'name': name,
+                                                'message': message}) == 0:
+                        delivered += 1
+                    else:
+                        invalid.append(i)
+                reply = (delivered, invalid)
+            else:
+                coro = req.kwargs.get('coro', None)
+                if coro:
+                    name = req.kwargs.get('name', ' ')
+                    if name[0] == '~':
+                        Coro._asyncoro._lock.acquire()
+                        coro = Coro._asyncoro._coros.get(int(coro))
+                        Coro._asyncoro._lock.release()
+                        if coro and coro.send(req.kwargs['message']) == 0:
+                            reply = 1
+                    elif name[0] == '!':
+                        coro = self._coros.get(int(coro))
+                        if coro and coro.send(req.kwargs['message']) == 0:
+                            reply = 1
+                        else:
+                            logger.warning('invalid "deliver" message ignored')
+                else:
+                    channel = req.kwargs.get('channel')
+                    if channel:
+                        if channel[0] == '~':
+                            Channel._asyncoro._lock.acquire()
+                            channel = Channel._asyncoro._channels.get(channel)
+                            Channel._asyncoro._lock.release()
+                        elif channel[0] == '!':
+                            channel = self._channels.get(channel)
+                        else:
+                            channel = None
+                    if isinstance(channel, TopicChannel):
+                        reply = yield channel.deliver(
+                            req.kwargs.get('topic', None), req.kwargs['message'],
+                            timeout=req.timeout, n=req.kwargs['n'])
+                    elif isinstance(channel, Channel):
+                        reply = yield channel.deliver(
+                            req.kwargs['message'], timeout=req.timeout, n=req.kwargs['n'])
+                    else:
+                        logger.warning('invalid "deliver" message ignored')
+            raise StopIteration(reply)
+        elif req.name == 'run_rci':
+            # synchronous message
+            if req.dst != self._location:
+                reply = Exception('invalid RCI invocation')
+            else:
+                RCI._asyncoro._lock.acquire()
+                rci = RCI._asyncoro._rcis.get(req.kwargs['name'], None)
+                RCI._asyncoro._lock.release()
+                if rci:
+                    args = req.kwargs['args']
+                    kwargs = req.kwargs['kwargs']
+                    try:
+                        reply = Coro(rci._method, *args, **kwargs)
+                    except:
+                        reply = Exception(traceback.format_exc())
+                else:
+                    reply = Exception('RCI "%s" is not registered' % req.kwargs['name'])
+            raise StopIteration(reply)
+        elif req.name == 'locate_coro':
+            Coro._asyncoro._lock.acquire()
+            coro = Coro._asyncoro._rcoros.get(req.kwargs['name'], None)
+            Coro._asyncoro._lock.release()
+            if not coro:
+                coro = self._rcoros.get(req.kwargs['name'], None)
+            raise StopIteration(coro)
+        elif req.name == 'locate_channel':
+            Channel._asyncoro._lock.acquire()
+            channel = Channel._asyncoro._rchannels.get('~' + req.kwargs['name'], None)
+            Channel._asyncoro._lock.release()
+            if not channel:
+                channel = self._rchannels.get('!' + req.kwargs['name'], None)
+            raise StopIteration(channel)
+        elif req.name == 'locate_rci':
+            RCI._asyncoro._lock.acquire()
+            rci = RCI._asyncoro._rcis.get(req.kwargs['name'], None)
+            RCI._asyncoro._lock.release()
+            raise StopIteration(rci)
+        elif req.name == 'monitor':
+            # synchronous message
+            assert req.dst == self._location
+            reply = -1
+            monitor = req.kwargs.get('monitor', None)
+            coro = req.kwargs.get('coro', None)
+            name = req.kwargs.get('name', None)
+            if coro and name:
+                if name[0] == '~':
+                    Coro._asyncoro._lock.acquire()
+                    coro = Coro._asyncoro._coros.get(int(coro), None)
+                    if coro and coro._name == name:
+                        reply = Coro._asyncoro._monitor(monitor, coro)
+                    Coro._asyncoro._lock.release()
+                elif name == '!':
+                    coro = self._coros.get(int(coro), None)
+                    if coro and coro._name == name:
+                        reply = self._monitor(monitor, coro)
+            raise StopIteration(reply)
+        elif req.name == 'terminate_coro':
+            reply = -1
+            coro = req.kwargs.get('coro', None)
+            name = req.kwargs.get('name', None)
+            if coro and name:
+                if name[0] == '~':
+                    Coro._asyncoro._lock.acquire()
+                    coro = Coro._asyncoro._coros.get(int(coro), None)
+                    Coro._asyncoro._lock.release()
+                elif name[0] == '!':
+                    coro = self._coros.get(int(coro), None)
+            if isinstance(coro, Coro):
+                reply = coro.terminate()
+            raise StopIteration(reply)
+        elif req.name == 'subscribe':
+            # synchronous message
+            assert req.dst == self._location
+            reply = -1
+            channel = req.kwargs.get('channel', ' ')
+            if channel[0] == '~':
+                Channel._asyncoro._lock.acquire()
+                channel = Channel._asyncoro._channels.get(channel, None)
+                Channel._asyncoro._lock.release()
+            elif channel[0] == '!':
+                channel = self._channels.get(channel, None)
+            if isinstance(channel, Channel) and channel._location == self._location:
+                subscriber = req.kwargs.get('subscriber', None)
+                if isinstance(subscriber, Coro):
+                    if subscriber._location == self._location:
+                        Coro._asyncoro._lock.acquire()
+                        subscriber = Coro._asyncoro._coros.get(int(subscriber._id), None)
+                        Coro._asyncoro._lock.release()
+                elif isinstance(subscriber, Channel):
+                    if subscriber._location == self._location:
+                        Channel._asyncoro._lock.acquire()
+                        subscriber = self._channels.get(subscriber._name, None)
+                        Channel._asyncoro._lock.release()
+                if isinstance(channel, TopicChannel):
+                    reply = yield channel.subscribe(subscriber,
+                                                    topic=req.kwargs.get('topic', '#'))
+                else:
+                    reply = yield channel.subscribe(
+                        subscriber, replay_from=req.kwargs.get('replay_from', None),
+                        replay_last=req.kwargs.get('replay_last', 0))
+            raise StopIteration(reply)
+        elif req.name == 'unsubscribe':
+            # synchronous message
+            assert req.dst == self._location
+            reply = -1
+            channel = req.kwargs.get('channel', ' ')
+            if channel[0] == '~':
+                Channel._asyncoro._lock.acquire()
+                channel = Channel._asyncoro._channels.get(channel, None)
+                Channel._asyncoro._lock.release()
+            elif channel[0] == '!':
+                channel = self._channels.get(channel, None)
+            if isinstance(channel, Channel) and channel._location == self._location:
+                subscriber = req.kwargs.get('subscriber', None)
+                if isinstance(subscriber, Coro):
+                    if subscriber._location == self._location:
+                        Coro._asyncoro._lock.acquire()
+                        subscriber = Coro._asyncoro._coros.get(int(subscriber._id), None)
+                        Coro._asyncoro._lock.release()
+                elif isinstance(subscriber, Channel):
+                    if subscriber._location == self._location:
+                        Channel._asyncoro._lock.acquire()
+                        subscriber = self._channels.get(subscriber._name, None)
+                        Channel._asyncoro._lock.release()
+                if isinstance(channel, TopicChannel):
+                    reply = yield channel.unsubscribe(subscriber,
+                                                      topic=req.kwargs.get('topic', None))
+                else:
+                    reply = yield channel.unsubscribe(subscriber)
+            raise StopIteration(reply)
+        elif req.name == 'locate_peer':
+            if req.kwargs['name'] == self._name:
+                loc = self._location
+            elif req.dst == self._location:
+                loc = None
+            raise StopIteration(loc)
+        elif req.name == 'del_file':
+            # synchronous message
+            assert req.dst == self._location
+            tgt = os.path.basename(req.kwargs['file'])
+            dir = req.kwargs['dir']
+            if isinstance(dir, str) and dir:
+                tgt = os.path.join(dir, tgt)
+            tgt = os.path.join(self.__dest_path, tgt)
+            if tgt.startswith(self.__dest_path) and os.path.isfile(tgt + '.part'):
+                # partial file of failed send_file
+                os.remove(tgt + '.part')
+            if tgt.startswith(self.__dest_path) and os.path.isfile(tgt):
+                os.remove(tgt)
+                d = os.path.dirname(tgt)
+                try:
+                    while d > self.__dest_path and os.path.isdir(d):
+                        os.rmdir(d)
+                        d = os.path.dirname(d)
+                except:
+                    # logger.debug(traceback.format_exc())
+                    pass
+                reply = 0
+            else:
+                reply = -1
+            raise StopIteration(reply)
+        else:
+            logger.warning('invalid request "%s" ignored', req.name)
+            raise StopIteration(None)
 
     def _sync_reply(self, req, alarm_value=None):
         req.event = Event()
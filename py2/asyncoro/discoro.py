@@ -1113,6 +1113,9 @@ if __name__ == '__main__':
                         help='path prefix to where files sent by peers are stored')
     parser.add_argument('--max_file_size', dest='max_file_size', default=None, type=int,
                         help='maximum file size of any file transferred')
+    parser.add_argument('--file_cache_size', dest='file_cache_size', type=int,
+                        default=asyncoro.FileCacheSize,
+                        help='maximum total size of files kept to avoid transferring them again')
     parser.add_argument('-s', '--secret', dest='secret', default='',
                         help='authentication secret for handshake with peers')
     parser.add_argument('--certfile', dest='certfile', default=None,
@@ -512,6 +512,9 @@ if __name__ == '__main__':
                         help='path prefix to where files sent by peers are stored')
     parser.add_argument('--max_file_size', dest='max_file_size', default=None, type=int,
                         help='maximum file size of any file transferred')
+    parser.add_argument('--file_cache_size', dest='file_cache_size', type=int,
+                        default=asyncoro.FileCacheSize,
+                        help='maximum total size of files kept to avoid transferring them again')
     parser.add_argument('-s', '--secret', dest='secret', default='',
                         help='authentication secret for handshake with peers')
     parser.add_argument('--certfile', dest='certfile', default=None,
@@ -718,6 +721,7 @@ if __name__ == '__main__':
     _discoro_scheduler = asyncoro.AsynCoro(**_discoro_config)
     _discoro_timer_coro = asyncoro.Coro(_discoro_timer_proc, _discoro_msg_timeout,
                                         _discoro_ntotal_coros, _discoro_busy_time)
+    _discoro_timer_coro.set_priority(asyncoro.Coro.HighPriority)
     for _discoro_server_info in _discoro_server_infos:
         _discoro_server_info.Queue.put({'req': 'start', 'proc_auth': _discoro_auth,
                                         'timer_coro': _discoro_timer_coro})
@@ -16,6 +16,7 @@ import socket
 import inspect
 import traceback
 import select
+import os
 import sys
 import types
 import struct
@@ -27,11 +28,20 @@ import ssl
 from heapq import heappush, heappop
 from bisect import bisect_left
 import queue
+from _thread import get_ident as _get_ident
 import atexit
 import collections
 import pickle
 import copy
 
+if pickle.HIGHEST_PROTOCOL >= 5:
+    _pickle5 = pickle
+else:
+    try:
+        import pickle5 as _pickle5
+    except ImportError:
+        _pickle5 = None
+
 if platform.system() == 'Windows':
     from errno import WSAEINPROGRESS as EINPROGRESS
     from errno import WSAEWOULDBLOCK as EWOULDBLOCK
@@ -60,19 +70,106 @@ __version__ = "4.1.1"
 
 __all__ = ['AsyncSocket', 'AsynCoroSocket', 'Coro', 'AsynCoro',
            'Lock', 'RLock', 'Event', 'Condition', 'Semaphore',
-           'HotSwapException', 'MonitorException', 'Location', 'Channel',
-           'CategorizeMessages', 'AsyncThreadPool', 'AsyncDBCursor',
-           'Singleton', 'logger', 'serialize', 'unserialize', 'Logger']
+           'HotSwapException', 'MonitorException', 'Location', 'Channel', 'ChannelMessage',
+           'TopicChannel', 'CategorizeMessages', 'AsyncThreadPool', 'AsyncDBCursor',
+           'Singleton', 'logger', 'serialize', 'unserialize', 'register_serializer',
+           'Logger']
 
 # timeout in seconds used when sending messages
 MsgTimeout = 10
 
+# resolution (in seconds) of timers used for timeouts in suspend, receive,
+# socket operations etc.; timeouts expire at most this much later than
+# requested
+TimerResolution = 0.001
+
+# if True, (non-SSL) asynchronous sockets are registered with edge-triggered
+# notifications, where supported (epoll); otherwise, level-triggered
+# notifications are used. Edge-triggered notifications avoid updating
+# registration (e.g., epoll_ctl) for each operation, but are usually slower:
+# as an edge is not reported again, a socket that has been reported ready
+# is retried (in next poll) each time it is used until an operation fails
+# with EWOULDBLOCK, which costs more (in Python) than updating registration
+# (e.g., 'perf_echo.py' in examples processes about 20% fewer requests per
+# second), so it should not be enabled for speed
+EdgeTriggered = False
+
+# if 'buffers' is given to 'serialize' (and pickle protocol 5 is
+# available), buffers (e.g., arrays) in object of at least OOBBufferSize
+# bytes are not copied into serialized data, but added to 'buffers' so
+# they can be sent separately
+OOBBufferSize = 64 * 1024
+
+
+# serializers registered with 'register_serializer', indexed by name and
+# by tag (first byte of data they produce)
+_serializers = {}
+_unserializers = {}
+
+
+def register_serializer(name, tag, dumps, loads):
+    """Registers serializer 'name' that can be used with 'serialize'. 'dumps'
+    is called with object and 'buffers' (see 'serialize') and must return
+    bytes for the object, with 'tag' (bytes of length 1) as first byte, so
+    'unserialize' can use 'loads' for such data; 'loads' is called with
+    data and 'buffers' (see 'unserialize'). 'tag' must not be b'\\x80',
+    which is first byte of data produced with pickle.
+    """
+    if not isinstance(tag, bytes) or len(tag) != 1 or tag == b'\x80':
+        raise ValueError('invalid tag %r for serializer "%s"' % (tag, name))
+    _serializers[name] = dumps
+    _unserializers[tag[0]] = (name, loads)
+
 
-def serialize(obj):
+def serializer_name(data):
+    """Returns name of serializer used to produce 'data', or None if it was
+    produced with pickle.
+    """
+    serializer = _unserializers.get(data[0], None)
+    if serializer:
+        return serializer[0]
+    return None
+
+
+def serialize(obj, serializer=None, buffers=None):
+    """Returns bytes for 'obj'. If 'serializer' is None, 'obj' is pickled;
+    otherwise, it must be name of serializer registered with
+    'register_serializer'.
+
+    If 'buffers' is a list and pickle protocol 5 is available (with
+    Python 3.8+ or 'pickle5' module), buffers of at least OOBBufferSize
+    bytes in 'obj' that support protocol 5 (e.g., numpy arrays,
+    PickleBuffer instances) are not copied, but appended to 'buffers'
+    (as PickleBuffer instances); the same buffers (in the same order)
+    must then be given to 'unserialize'.
+    """
+    if serializer:
+        return _serializers[serializer](obj, buffers)
+    if buffers is not None and _pickle5:
+        def buffer_callback(buf):
+            with buf.raw() as view:
+                if view.nbytes < OOBBufferSize:
+                    return True
+            buffers.append(buf)
+            return False
+
+        return _pickle5.dumps(obj, 5, buffer_callback=buffer_callback)
     return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
 
 
-def unserialize(pkl):
+def unserialize(pkl, buffers=None):
+    """Returns object for data 'pkl' produced with 'serialize'. If 'buffers'
+    were appended to by 'serialize', buffers (e.g., bytearrays) with their
+    contents must be given; objects are created with these buffers
+    without copying them where possible.
+    """
+    serializer = _unserializers.get(pkl[0], None)
+    if serializer:
+        return serializer[1](pkl, buffers)
+    if _pickle5:
+        # data may have been pickled with protocol 5 (with 'pickle5'
+        # module in Python versions before 3.8)
+        return _pickle5.loads(pkl, buffers=buffers)
     return pickle.loads(pkl)
 
 
@@ -173,6 +270,81 @@ class Logger(object):
 logger = Logger('asyncoro')
 
 
+class _TimerWheel(object):
+    """Internal use only.
+
+    Hashed timing wheel: timers are kept in buckets (dictionaries) indexed
+    by tick (of given 'resolution') they expire in, and ticks with buckets
+    are kept in a heap, so adding and canceling timers take constant time
+    (heap is updated only when first timer is added to a tick), and
+    canceled timers don't take up space until their tick. Wheel is not
+    thread-safe; callers must serialize access to it.
+
+    Timers are identified by (hashable) 'key', which must be unique among
+    pending timers, and tick returned by 'add'.
+    """
+
+    def __init__(self, resolution=None):
+        if not resolution:
+            resolution = TimerResolution
+        self._resolution = float(resolution)
+        self._buckets = {}
+        self._ticks = []
+
+    def __len__(self):
+        return len(self._ticks)
+
+    def add(self, expires, key, value=None):
+        """Add timer for 'key' that expires at (absolute) time 'expires'; when
+        it expires, (key, value) is returned by 'expire'. Returns tick
+        (non-zero integer) which, along with 'key', is used to cancel the
+        timer.
+        """
+        # timer expires in tick after 'expires' (i.e., ceiling)
+        tick = int(expires / self._resolution) + 1
+        bucket = self._buckets.get(tick, None)
+        if bucket is None:
+            bucket = self._buckets[tick] = {}
+            heappush(self._ticks, tick)
+        bucket[key] = value
+        return tick
+
+    def cancel(self, tick, key):
+        """Remove timer for 'key' with 'tick' (returned by 'add') if it has
+        not expired yet.
+        """
+        bucket = self._buckets.get(tick, None)
+        if bucket:
+            bucket.pop(key, None)
+
+    def expire(self, now):
+        """Returns list of (key, value) of timers that expired by time 'now'.
+        """
+        # pollers may timeout slightly earlier, so give a bit of slack
+        tick = int(now / self._resolution + 0.1)
+        expired = []
+        while self._ticks and self._ticks[0] <= tick:
+            bucket = self._buckets.pop(heappop(self._ticks))
+            if bucket:
+                expired.extend(bucket.items())
+        return expired
+
+    def timeout(self, now):
+        """Returns time (in seconds) from 'now' until next timer expires, or
+        None if there are no timers.
+        """
+        # drop buckets whose timers have all been canceled
+        while self._ticks and not self._buckets[self._ticks[0]]:
+            del self._buckets[heappop(self._ticks)]
+        if self._ticks:
+            return max(self._ticks[0] * self._resolution - now, 0)
+        return None
+
+    def clear(self):
+        self._buckets.clear()
+        self._ticks = []
+
+
 class _AsyncSocket(object):
     """Base class for use with AsynCoro, for asynchronous I/O
     completion and coroutines. This class is for internal use
@@ -183,10 +355,25 @@ class _AsyncSocket(object):
                  '_timeout_id', '_read_coro', '_read_task', '_read_result', '_write_coro',
                  '_write_task', '_write_result', '_asyncoro', '_notifier', 'recvall', 'sendall',
                  'recv_msg', 'send_msg', '_blocking', 'recv', 'send', 'recvfrom', 'sendto',
-                 'accept', 'connect', 'ssl_server_ctx')
+                 'accept', 'connect', 'ssl_server_ctx', '_read_ahead', 'recv_into', 'sendfile')
 
     _default_timeout = None
     _MsgLengthSize = struct.calcsize('>L')
+    # length of messages of 4GB or more is sent as this marker,
+    # followed by 64-bit length
+    _LongMsgLength = 0xFFFFFFFF
+    _LongMsgLengthSize = struct.calcsize('>Q')
+    # payload received into buffer (or passed to callable) by recv_msg
+    # is received in chunks of (up to) this many bytes
+    _MsgChunkSize = 1048576
+    # recv_msg receives (up to) this many bytes at a time, so small
+    # messages that arrive together are received with one call
+    _ReadAheadSize = 65536
+    # maximum number of buffers passed to sendmsg (IOV_MAX)
+    _SendMsgBuffers = 1024
+    # if file can't be sent with os.sendfile, sendfile reads and sends
+    # it in chunks of this many bytes
+    _SendFileChunkSize = 1048576
 
     def __init__(self, sock, blocking=False, keyfile=None, certfile=None,
                  ssl_version=ssl.PROTOCOL_SSLv23):
@@ -201,7 +388,7 @@ class _AsyncSocket(object):
         Only methods without leading underscore should be used; other
         attributes are for internal use only. In addition to usual
         socket I/O methods, AsyncSocket implemnents 'recvall',
-        'send_msg', 'recv_msg' and 'unwrap' methods.
+        'send_msg', 'recv_msg', 'sendfile' and 'unwrap' methods.
         """
 
         if isinstance(sock, AsyncSocket):
@@ -225,11 +412,14 @@ class _AsyncSocket(object):
             self._asyncoro = None
             self._notifier = None
             self.ssl_server_ctx = None
+            # data received by recv_msg beyond current message
+            self._read_ahead = None
 
             self.recvall = None
             self.sendall = None
             self.recv_msg = None
             self.send_msg = None
+            self.sendfile = None
 
             self._blocking = None
             self.setblocking(blocking)
@@ -256,19 +446,22 @@ class _AsyncSocket(object):
                 self._rsock = ssl.wrap_socket(self._rsock, keyfile=self._keyfile,
                                               certfile=self._certfile,
                                               ssl_version=self._ssl_version)
-            for name in ['recv', 'send', 'recvfrom', 'sendto', 'accept', 'connect']:
+            for name in ['recv', 'send', 'recvfrom', 'sendto', 'accept', 'connect',
+                         'recv_into']:
                 setattr(self, name, getattr(self._rsock, name))
             if self._rsock.type & socket.SOCK_STREAM:
                 self.recvall = self._sync_recvall
                 self.sendall = self._sync_sendall
                 self.recv_msg = self._sync_recv_msg
                 self.send_msg = self._sync_send_msg
+                self.sendfile = self._sync_sendfile
             self._asyncoro = None
             self._notifier = None
         else:
             self._rsock.setblocking(0)
             self.recv = self._async_recv
             self.send = self._async_send
+            self.recv_into = self._async_recv_into
             self.recvfrom = self._async_recvfrom
             self.sendto = self._async_sendto
             self.accept = self._async_accept
@@ -278,6 +471,7 @@ class _AsyncSocket(object):
                 self.sendall = self._async_sendall
                 self.recv_msg = self._async_recv_msg
                 self.send_msg = self._async_send_msg
+                self.sendfile = self._async_sendfile
             self._asyncoro = AsynCoro.scheduler()
             self._notifier = _AsyncNotifier.instance()
             self._register()
@@ -303,6 +497,7 @@ class _AsyncSocket(object):
             self._rsock = None
         self._read_task = self._write_task = None
         self._read_coro = self._write_coro = None
+        self._read_ahead = None
 
     def unwrap(self):
         """Get rid of AsyncSocket setup and return underlying socket
@@ -374,23 +569,38 @@ class _AsyncSocket(object):
                     buf = bytes(self._read_result[:n])
                 if isinstance(view, memoryview):
                     view.release()
-            if buf:
-                self._read_coro._proceed_(buf)
-            else:
-                self._read_coro.throw(socket.timeout('timed out'))
+            # clear state before resuming coroutine, as it may issue
+            # another read (in scheduler's thread) before this returns
+            coro = self._read_coro
             self._notifier.clear(self, _AsyncPoller._Read)
             self._read_task = self._read_result = self._read_coro = None
+            if buf:
+                coro._proceed_(buf)
+            else:
+                coro.throw(socket.timeout('timed out'))
         if self._write_coro:
             sent = 0
             if isinstance(self._write_result, memoryview):
                 sent = self._write_task.args[1] - len(self._write_result)
                 self._write_result.release()
-            if sent:
-                self._write_coro._proceed_(sent)
-            else:
-                self._write_coro.throw(socket.timeout('timed out'))
+            elif isinstance(self._write_result, list):
+                if isinstance(self._write_task.args[1], int):
+                    # sendall with list of buffers; task has total length
+                    sent = self._write_task.args[1] - sum(len(buf) for buf in self._write_result)
+                else:
+                    # sendfile; result is [offset, count] and task has
+                    # file and initial offset; file's position is updated
+                    # to after data sent
+                    file, offset = self._write_task.args[1:]
+                    file.seek(self._write_result[0])
+                    sent = self._write_result[0] - offset
+            coro = self._write_coro
             self._notifier.clear(self, _AsyncPoller._Write)
             self._write_task = self._write_result = self._write_coro = None
+            if sent:
+                coro._proceed_(sent)
+            else:
+                coro.throw(socket.timeout('timed out'))
 
     def _eof(self):
         """Internal use only.
@@ -398,6 +608,19 @@ class _AsyncSocket(object):
         if self._read_task:
             self._read_task()
 
+    def _read_buffered(self, bufsize):
+        """Internal use only. Returns memoryview of (up to) 'bufsize'
+        bytes of data read ahead by recv_msg, which must be consumed
+        before reading from socket again.
+        """
+        view = self._read_ahead
+        if len(view) > bufsize:
+            self._read_ahead = view[bufsize:]
+            return view[:bufsize]
+        else:
+            self._read_ahead = None
+            return view
+
     def _async_recv(self, bufsize, *args):
         """Internal use only; use 'recv' with 'yield' instead.
 
@@ -415,6 +638,10 @@ class _AsyncSocket(object):
                     coro, self._read_coro = self._read_coro, None
                     coro.throw(*sys.exc_info())
             except:
+                if getattr(sys.exc_info()[1], 'errno', None) == EWOULDBLOCK:
+                    # socket is not ready after all (e.g., with
+                    # edge-triggered notification); wait for next event
+                    return
                 self._notifier.clear(self, _AsyncPoller._Read)
                 self._read_task = None
                 coro, self._read_coro = self._read_coro, None
@@ -425,27 +652,78 @@ class _AsyncSocket(object):
                 coro, self._read_coro = self._read_coro, None
                 coro._proceed_(buf)
 
-        self._read_task = partial_func(_recv, self, bufsize, *args)
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
+        if self._read_ahead:
+            coro = AsynCoro.cur_coro(self._asyncoro)
+            coro._await_()
+            coro._proceed_(self._read_buffered(bufsize).tobytes())
+            return
+        self._read_task = partial_func(_recv, self, bufsize, *args)
         self._read_coro = AsynCoro.cur_coro(self._asyncoro)
         self._read_coro._await_()
-        self._notifier.add(self, _AsyncPoller._Read)
         if self._certfile and self._rsock.pending():
+            # data buffered in SSL object is not reported by poller; task
+            # is run before it is added to notifier, so poller can't run
+            # it at the same time
+            self._read_task()
+            if not self._read_task:
+                return
+        self._notifier.add(self, _AsyncPoller._Read)
+
+    def _async_recv_into(self, buffer, nbytes=0, *args):
+        """Internal use only; use 'recv_into' with 'yield' instead.
+
+        Asynchronous version of socket recv_into method.
+        """
+        def _recv_into(self, view, *args):
             try:
-                buf = self._rsock.recv(bufsize)
-            except socket.error as err:
-                if err.args[0] != EWOULDBLOCK:
-                    self._read_task = None
+                recvd = self._rsock.recv_into(view, len(view), *args)
+            except ssl.SSLError as err:
+                if err.args[0] == ssl.SSL_ERROR_WANT_READ:
+                    pass
+                else:
+                    view.release()
                     self._notifier.clear(self, _AsyncPoller._Read)
+                    self._read_task = None
                     coro, self._read_coro = self._read_coro, None
                     coro.throw(*sys.exc_info())
+            except:
+                if getattr(sys.exc_info()[1], 'errno', None) == EWOULDBLOCK:
+                    return
+                view.release()
+                self._notifier.clear(self, _AsyncPoller._Read)
+                self._read_task = None
+                coro, self._read_coro = self._read_coro, None
+                coro.throw(*sys.exc_info())
             else:
-                if buf:
-                    self._read_task = None
-                    self._notifier.clear(self, _AsyncPoller._Read)
-                    coro, self._read_coro = self._read_coro, None
-                    coro._proceed_(buf)
+                view.release()
+                self._notifier.clear(self, _AsyncPoller._Read)
+                self._read_task = None
+                coro, self._read_coro = self._read_coro, None
+                coro._proceed_(recvd)
+
+        view = memoryview(buffer).cast('B')
+        if nbytes:
+            view = view[:nbytes]
+        if not self._asyncoro:
+            self._asyncoro = AsynCoro.scheduler()
+        if self._read_ahead:
+            data = self._read_buffered(len(view))
+            view[:len(data)] = data
+            view.release()
+            coro = AsynCoro.cur_coro(self._asyncoro)
+            coro._await_()
+            coro._proceed_(len(data))
+            return
+        self._read_task = partial_func(_recv_into, self, view, *args)
+        self._read_coro = AsynCoro.cur_coro(self._asyncoro)
+        self._read_coro._await_()
+        if self._certfile and self._rsock.pending():
+            self._read_task()
+            if not self._read_task:
+                return
+        self._notifier.add(self, _AsyncPoller._Read)
 
     def _async_recvall(self, bufsize, *args):
         """Internal use only; use 'recvall' with 'yield' instead.
@@ -469,6 +747,8 @@ class _AsyncSocket(object):
                     coro, self._read_coro = self._read_coro, None
                     coro.throw(*sys.exc_info())
             except:
+                if getattr(sys.exc_info()[1], 'errno', None) == EWOULDBLOCK:
+                    return
                 view.release()
                 self._notifier.clear(self, _AsyncPoller._Read)
                 self._read_task = self._read_result = None
@@ -498,32 +778,28 @@ class _AsyncSocket(object):
 
         self._read_result = bytearray(bufsize)
         view = memoryview(self._read_result)
-        self._read_task = partial_func(_recvall, self, view, *args)
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
+        if self._read_ahead:
+            data = self._read_buffered(bufsize)
+            view[:len(data)] = data
+            view = view[len(data):]
+            if len(view) == 0:
+                view.release()
+                buf, self._read_result = self._read_result, None
+                coro = AsynCoro.cur_coro(self._asyncoro)
+                coro._await_()
+                coro._proceed_(buf)
+                return
+        self._read_task = partial_func(_recvall, self, view, *args)
         self._read_coro = AsynCoro.cur_coro(self._asyncoro)
         self._read_coro._await_()
-        self._notifier.add(self, _AsyncPoller._Read)
         if self._certfile and self._rsock.pending():
-            try:
-                recvd = self._rsock.recv_into(view, bufsize)
-            except socket.error as err:
-                if err.args[0] != EWOULDBLOCK:
-                    self._read_task = self._read_result = None
-                    self._notifier.clear(self, _AsyncPoller._Read)
-                    coro, self._read_coro = self._read_coro, None
-                    coro.throw(*sys.exc_info())
-            else:
-                if recvd == bufsize:
-                    view.release()
-                    buf = self._read_result
-                    self._read_task = self._read_result = None
-                    self._notifier.clear(self, _AsyncPoller._Read)
-                    coro, self._read_coro = self._read_coro, None
-                    coro._proceed_(buf)
-                elif recvd:
-                    view = view[recvd:]
-                    self._read_task = partial_func(_recvall, self, view, *args)
+            # see _async_recv above
+            self._read_task()
+            if not self._read_task:
+                return
+        self._notifier.add(self, _AsyncPoller._Read)
 
     def _sync_recvall(self, bufsize, *args):
         """Internal use only; use 'recvall' instead.
@@ -532,6 +808,10 @@ class _AsyncSocket(object):
         """
         self._read_result = bytearray(bufsize)
         view = memoryview(self._read_result)
+        if self._read_ahead:
+            data = self._read_buffered(bufsize)
+            view[:len(data)] = data
+            view = view[len(data):]
         while len(view) > 0:
             recvd = self._rsock.recv_into(view, *args)
             if not recvd:
@@ -552,6 +832,8 @@ class _AsyncSocket(object):
             try:
                 res = self._rsock.recvfrom(*args)
             except:
+                if getattr(sys.exc_info()[1], 'errno', None) == EWOULDBLOCK:
+                    return
                 self._notifier.clear(self, _AsyncPoller._Read)
                 self._read_task = None
                 coro, self._read_coro = self._read_coro, None
@@ -586,6 +868,8 @@ class _AsyncSocket(object):
                     coro, self._write_coro = self._write_coro, None
                     coro.throw(*sys.exc_info())
             except:
+                if getattr(sys.exc_info()[1], 'errno', None) == EWOULDBLOCK:
+                    return
                 self._notifier.clear(self, _AsyncPoller._Write)
                 self._write_task = None
                 coro, self._write_coro = self._write_coro, None
@@ -612,6 +896,8 @@ class _AsyncSocket(object):
             try:
                 sent = self._rsock.sendto(*args)
             except:
+                if getattr(sys.exc_info()[1], 'errno', None) == EWOULDBLOCK:
+                    return
                 self._notifier.clear(self, _AsyncPoller._Write)
                 self._write_task = None
                 coro, self._write_coro = self._write_coro, None
@@ -637,7 +923,28 @@ class _AsyncSocket(object):
         sent, it returns the length of data sent if any data is
         sent. If no data has been sent before timeout, then it causes
         'socket.timeout' exception to be thrown.
+
+        'data' can also be a list (or tuple) of buffers, which are sent
+        with 'sendmsg' (without joining them), if supported.
         """
+        def _sendmsg(self, data_len):
+            try:
+                sent = self._rsock.sendmsg(self._write_result[:AsyncSocket._SendMsgBuffers])
+            except:
+                if getattr(sys.exc_info()[1], 'errno', None) == EWOULDBLOCK:
+                    return
+                self._notifier.clear(self, _AsyncPoller._Write)
+                self._write_task = self._write_result = None
+                coro, self._write_coro = self._write_coro, None
+                coro.throw(*sys.exc_info())
+            else:
+                _AsyncSocket._trim_buffers(self._write_result, sent)
+                if not self._write_result:
+                    self._notifier.clear(self, _AsyncPoller._Write)
+                    self._write_task = self._write_result = None
+                    coro, self._write_coro = self._write_coro, None
+                    coro._proceed_(None)
+
         def _sendall(self, data_len):
             try:
                 sent = self._rsock.send(self._write_result)
@@ -657,6 +964,8 @@ class _AsyncSocket(object):
                     coro, self._write_coro = self._write_coro, None
                     coro.throw(*sys.exc_info())
             except:
+                if getattr(sys.exc_info()[1], 'errno', None) == EWOULDBLOCK:
+                    return
                 self._write_result.release()
                 self._notifier.clear(self, _AsyncPoller._Write)
                 self._write_task = self._write_result = None
@@ -675,8 +984,17 @@ class _AsyncSocket(object):
                     #     self._notifier._del_timeout(self)
                     #     self._notifier._add_timeout(self)
 
-        self._write_result = memoryview(data)
-        self._write_task = partial_func(_sendall, self, len(data))
+        if isinstance(data, (list, tuple)) and not self._certfile and \
+           hasattr(self._rsock, 'sendmsg'):
+            self._write_result = [buf for buf in _AsyncSocket._byte_views(data) if buf]
+            self._write_task = partial_func(_sendmsg, self,
+                                            sum(len(buf) for buf in self._write_result))
+        else:
+            if isinstance(data, (list, tuple)):
+                # SSL sockets (and Windows) don't support sendmsg
+                data = b''.join(data)
+            self._write_result = memoryview(data)
+            self._write_task = partial_func(_sendall, self, len(data))
         if not self._asyncoro:
             self._asyncoro = AsynCoro.scheduler()
         self._write_coro = AsynCoro.cur_coro(self._asyncoro)
@@ -688,6 +1006,15 @@ class _AsyncSocket(object):
 
         Synchronous version of async_sendall.
         """
+        if isinstance(data, (list, tuple)):
+            if self._certfile or not hasattr(self._rsock, 'sendmsg'):
+                data = b''.join(data)
+            else:
+                bufs = [buf for buf in _AsyncSocket._byte_views(data) if buf]
+                while bufs:
+                    sent = self._rsock.sendmsg(bufs[:AsyncSocket._SendMsgBuffers])
+                    _AsyncSocket._trim_buffers(bufs, sent)
+                return None
         # TODO: is socket's sendall better?
         buf = memoryview(data)
         while len(buf) > 0:
@@ -699,6 +1026,140 @@ class _AsyncSocket(object):
         buf.release()
         return None
 
+    @staticmethod
+    def _byte_views(bufs):
+        """Internal use only. Returns list of memoryviews (of bytes) of
+        given buffers.
+        """
+        return [memoryview(buf).cast('B') for buf in bufs]
+
+    @staticmethod
+    def _trim_buffers(bufs, n):
+        """Internal use only. Removes first 'n' bytes (that have been
+        sent) from list 'bufs' of memoryviews.
+        """
+        i = 0
+        while i < len(bufs) and n >= len(bufs[i]):
+            n -= len(bufs[i])
+            i += 1
+        del bufs[:i]
+        if n:
+            bufs[0] = bufs[0][n:]
+
+    def _async_sendfile(self, file, offset=0, count=None):
+        """Internal use only; use 'sendfile' with 'yield' instead.
+
+        Send 'count' bytes (or until end of file if 'count' is None)
+        of 'file' (opened in binary mode) from 'offset' and return
+        number of bytes sent. With non-SSL sockets, data is sent with
+        'os.sendfile' (if available), so it is not copied through
+        Python; otherwise, file is read and sent in chunks. As with
+        socket's sendfile, file's position is updated to after the
+        data sent.
+        """
+        def _sendfile(self, file, offset):
+            # data is sent until socket is not ready (or end of file);
+            # otherwise, with edge-triggered notification, socket may
+            # not be reported writable again
+            try:
+                while self._write_result[1] > 0:
+                    sent = os.sendfile(self._fileno, file.fileno(), self._write_result[0],
+                                       self._write_result[1])
+                    if sent == 0:
+                        break
+                    self._write_result[0] += sent
+                    self._write_result[1] -= sent
+            except:
+                if getattr(sys.exc_info()[1], 'errno', None) == EWOULDBLOCK:
+                    return
+                file.seek(self._write_result[0])
+                self._notifier.clear(self, _AsyncPoller._Write)
+                self._write_task = self._write_result = None
+                coro, self._write_coro = self._write_coro, None
+                coro.throw(*sys.exc_info())
+            else:
+                file.seek(self._write_result[0])
+                sent = self._write_result[0] - offset
+                self._notifier.clear(self, _AsyncPoller._Write)
+                self._write_task = self._write_result = None
+                coro, self._write_coro = self._write_coro, None
+                coro._proceed_(sent)
+
+        if self._certfile or not hasattr(os, 'sendfile'):
+            return self._sendfile_buffered(file, offset, count)
+        if count is None:
+            count = max(os.fstat(file.fileno()).st_size - offset, 0)
+        if not self._asyncoro:
+            self._asyncoro = AsynCoro.scheduler()
+        if count == 0:
+            file.seek(offset)
+            coro = AsynCoro.cur_coro(self._asyncoro)
+            coro._await_()
+            coro._proceed_(0)
+            return
+        self._write_result = [offset, count]
+        self._write_task = partial_func(_sendfile, self, file, offset)
+        self._write_coro = AsynCoro.cur_coro(self._asyncoro)
+        self._write_coro._await_()
+        self._notifier.add(self, _AsyncPoller._Write)
+
+    def _sendfile_buffered(self, file, offset, count):
+        """Internal use only; use 'sendfile' with 'yield' instead.
+
+        Send data in 'file' with 'sendall', reading it in chunks into
+        same buffer.
+        """
+        if count is None:
+            buf = bytearray(AsyncSocket._SendFileChunkSize)
+        else:
+            buf = bytearray(min(count, AsyncSocket._SendFileChunkSize))
+        view = memoryview(buf)
+        file.seek(offset)
+        sent = 0
+        while count is None or sent < count:
+            if count is None:
+                n = file.readinto(view)
+            else:
+                n = file.readinto(view[:min(count - sent, len(view))])
+            if not n:
+                break
+            try:
+                partial = yield self.sendall(view[:n])
+            except socket.timeout:
+                if not sent:
+                    view.release()
+                    file.seek(offset)
+                    raise
+                partial = 0
+            if partial is not None:
+                # timed out after sending 'partial' bytes of this chunk
+                sent += partial
+                file.seek(offset + sent)
+                break
+            sent += n
+        view.release()
+        raise StopIteration(sent)
+
+    def _sync_sendfile(self, file, offset=0, count=None):
+        """Internal use only; use 'sendfile' instead.
+
+        Synchronous version of async_sendfile.
+        """
+        if hasattr(self._rsock, 'sendfile'):
+            return self._rsock.sendfile(file, offset, count)
+        file.seek(offset)
+        sent = 0
+        while count is None or sent < count:
+            if count is None:
+                data = file.read(AsyncSocket._SendFileChunkSize)
+            else:
+                data = file.read(min(count - sent, AsyncSocket._SendFileChunkSize))
+            if not data:
+                break
+            self._sync_sendall(data)
+            sent += len(data)
+        return sent
+
     def _async_accept(self):
         """Internal use only; use 'accept' with 'yield' instead.
 
@@ -707,7 +1168,13 @@ class _AsyncSocket(object):
         AsyncSocket with blocking=False).
         """
         def _accept(self):
-            conn, addr = self._rsock.accept()
+            try:
+                conn, addr = self._rsock.accept()
+            except socket.error as err:
+                if err.args[0] == EWOULDBLOCK:
+                    # see '_recv' above
+                    return
+                raise
             self._read_task = None
             self._notifier.clear(self, _AsyncPoller._Read)
 
@@ -743,6 +1210,10 @@ class _AsyncSocket(object):
                         coro._proceed_((conn, addr))
                 conn = AsyncSocket(conn, blocking=False, keyfile=self._keyfile,
                                    certfile=self._certfile, ssl_version=self._ssl_version)
+                # this may be running in thread of another scheduler (that
+                # polls for I/O events), so use scheduler of accepting
+                # coroutine
+                conn._asyncoro = self._asyncoro
                 try:
                     if self.ssl_server_ctx:
                         conn._rsock = self.ssl_server_ctx.wrap_socket(conn._rsock,
@@ -767,6 +1238,7 @@ class _AsyncSocket(object):
             else:
                 coro, self._read_coro = self._read_coro, None
                 conn = AsyncSocket(conn, blocking=False)
+                conn._asyncoro = self._asyncoro
                 coro._proceed_((conn, addr))
 
         self._read_task = partial_func(_accept, self)
@@ -855,74 +1327,248 @@ class _AsyncSocket(object):
 
         Messages are tagged with length of the data, so on the
         receiving side, recv_msg knows how much data to receive.
+        'data' can also be a list (or tuple) of buffers that make up the
+        message. Length and data are sent without copying data into
+        one buffer (see sendall).
         """
-        yield self.sendall(struct.pack('>L', len(data)) + data)
+        yield self.sendall(_AsyncSocket._msg_buffers(data))
 
     def _sync_send_msg(self, data):
         """Internal use only; use 'send_msg' instead.
 
         Synchronous version of async_send_msg.
         """
-        return self._sync_sendall(struct.pack('>L', len(data)) + data)
+        return self._sync_sendall(_AsyncSocket._msg_buffers(data))
+
+    @staticmethod
+    def _msg_buffers(data):
+        """Internal use only. Returns list of buffers to send for
+        message 'data' (with length of data first).
+        """
+        if isinstance(data, (list, tuple)):
+            bufs = _AsyncSocket._byte_views(data)
+            return [_AsyncSocket._msg_header(sum(len(buf) for buf in bufs))] + bufs
+        elif len(data) < 8192:
+            # copying small data is cheaper than sending buffers separately
+            return struct.pack('>L', len(data)) + data
+        else:
+            return [_AsyncSocket._msg_header(len(data)), data]
+
+    @staticmethod
+    def _msgs_buffers(msgs):
+        """Internal use only. Returns list of buffers to send messages in
+        list 'msgs' (each as would be given to 'send_msg') with one
+        'sendall'.
+        """
+        bufs = []
+        for data in msgs:
+            data = _AsyncSocket._msg_buffers(data)
+            if isinstance(data, list):
+                bufs.extend(data)
+            else:
+                bufs.append(data)
+        return bufs
+
+    @staticmethod
+    def _msg_header(size):
+        """Internal use only. Returns header (length) for message with
+        payload of 'size' bytes.
+        """
+        if size < _AsyncSocket._LongMsgLength:
+            return struct.pack('>L', size)
+        else:
+            return struct.pack('>LQ', _AsyncSocket._LongMsgLength, size)
+
+    @staticmethod
+    def _parse_msg_header(view):
+        """Internal use only. Returns tuple of length of header and
+        length of payload of message at the beginning of memoryview
+        'view', or None if 'view' doesn't have complete header.
+        """
+        n = _AsyncSocket._MsgLengthSize
+        if view is None or len(view) < n:
+            return None
+        size = struct.unpack('>L', view[:n].tobytes())[0]
+        if size == _AsyncSocket._LongMsgLength:
+            if len(view) < (n + _AsyncSocket._LongMsgLengthSize):
+                return None
+            size = struct.unpack('>Q', view[n:n + _AsyncSocket._LongMsgLengthSize].tobytes())[0]
+            n += _AsyncSocket._LongMsgLengthSize
+        return (n, size)
 
-    def _async_recv_msg(self):
+    @staticmethod
+    def _msg_dst_view(dst, size):
+        """Internal use only. Returns None if 'dst' (for recv_msg) is
+        callable, or writable memoryview of (buffer) 'dst'.
+        """
+        if callable(dst):
+            return None
+        view = memoryview(dst).cast('B')
+        if view.readonly or len(view) < size:
+            view.release()
+            raise ValueError('buffer for message of %s bytes is read-only or too small' % size)
+        return view
+
+    def _async_recv_msg(self, dst=None):
         """Internal use only; use 'recv_msg' with 'yield' instead.
 
         Message is tagged with length of the payload (data). This
         method receives length of payload, then the payload and
         returns the payload.
+
+        If 'dst' is given, the payload is written to 'dst' as it is
+        received (instead of being returned), so (large) messages can
+        be received without holding all of the payload in memory (or
+        allocating it up front): 'dst' can be a writable buffer (e.g.,
+        bytearray or mmap) at least as big as payload, or a callable
+        (e.g., 'write' method of a file) that is called with each
+        chunk of payload. In this case, length of payload is returned,
+        or None if connection is closed before all of message is
+        received.
+
+        Data is received in chunks of up to _ReadAheadSize bytes, so
+        any messages (and part of next message) received along with
+        this message are kept and returned by subsequent calls without
+        waiting for I/O. Messages bigger than _ReadAheadSize are
+        received with recvall.
         """
-        n = AsyncSocket._MsgLengthSize
-        try:
-            data = yield self.recvall(n)
-        except socket.error as err:
-            if err.args[0] == 'hangup':
-                raise StopIteration(b'')
-            else:
-                raise
-        if len(data) != n:
-            raise StopIteration(b'')
-        n = struct.unpack('>L', data)[0]
-        # assert n >= 0
+        closed = b'' if dst is None else None
+        view = self._read_ahead
+        while True:
+            header = _AsyncSocket._parse_msg_header(view)
+            if header:
+                n, size = header
+                if dst is not None:
+                    if len(view) > n:
+                        self._read_ahead = view[n:]
+                    else:
+                        self._read_ahead = None
+                    size = yield self._async_recv_msg_into(dst, size)
+                    raise StopIteration(size)
+                if len(view) >= (n + size):
+                    if len(view) > (n + size):
+                        self._read_ahead = view[n + size:]
+                    else:
+                        self._read_ahead = None
+                    raise StopIteration(view[n:n + size].tobytes())
+                if (n + size) > AsyncSocket._ReadAheadSize:
+                    # remaining data is received with recvall (which
+                    # gets data already read first)
+                    self._read_ahead = view[n:]
+                    try:
+                        data = yield self.recvall(size)
+                    except socket.error as err:
+                        if err.args[0] == 'hangup':
+                            raise StopIteration(b'')
+                        else:
+                            raise
+                    if len(data) != size:
+                        raise StopIteration(b'')
+                    raise StopIteration(data)
+            # partial message is kept here, so recv doesn't return it
+            self._read_ahead = None
+            try:
+                data = yield self.recv(AsyncSocket._ReadAheadSize)
+            except socket.error as err:
+                if err.args[0] == 'hangup':
+                    raise StopIteration(closed)
+                else:
+                    raise
+            if not data:
+                raise StopIteration(closed)
+            if view is not None:
+                data = view.tobytes() + data
+            view = memoryview(data)
+
+    def _async_recv_msg_into(self, dst, size):
+        """Internal use only. Receives payload of 'size' bytes into
+        'dst' (see recv_msg).
+        """
+        view = _AsyncSocket._msg_dst_view(dst, size)
+        pos = 0
         try:
-            data = yield self.recvall(n)
-        except socket.error as err:
-            if err.args[0] == 'hangup':
-                raise StopIteration(b'')
-            else:
-                raise
-        if len(data) != n:
-            raise StopIteration(b'')
-        raise StopIteration(data)
+            while pos < size:
+                try:
+                    if view is None:
+                        data = yield self.recv(min(size - pos, AsyncSocket._MsgChunkSize))
+                        n = len(data)
+                    else:
+                        # receive directly into buffer
+                        n = yield self.recv_into(view[pos:], min(size - pos,
+                                                                 AsyncSocket._MsgChunkSize))
+                except socket.error as err:
+                    if err.args[0] == 'hangup':
+                        raise StopIteration(None)
+                    else:
+                        raise
+                if not n:
+                    raise StopIteration(None)
+                if view is None:
+                    dst(data)
+                pos += n
+        finally:
+            if view is not None:
+                view.release()
+        raise StopIteration(size)
 
-    def _sync_recv_msg(self):
+    def _sync_recv_msg(self, dst=None):
         """Internal use only; use 'recv_msg' instead.
 
         Synchronous version of async_recv_msg.
         """
-        n = AsyncSocket._MsgLengthSize
+        closed = b'' if dst is None else None
         try:
-            data = self._sync_recvall(n)
+            data = self._sync_recvall(AsyncSocket._MsgLengthSize)
+            if len(data) != AsyncSocket._MsgLengthSize:
+                return closed
+            size = struct.unpack('>L', data)[0]
+            if size == AsyncSocket._LongMsgLength:
+                data = self._sync_recvall(AsyncSocket._LongMsgLengthSize)
+                if len(data) != AsyncSocket._LongMsgLengthSize:
+                    return closed
+                size = struct.unpack('>Q', data)[0]
+            if dst is not None:
+                return self._sync_recv_msg_into(dst, size)
+            data = self._sync_recvall(size)
         except socket.error as err:
             if err.args[0] == 'hangup':
-                return b''
-            else:
-                raise
-        if len(data) != n:
-            return b''
-        n = struct.unpack('>L', data)[0]
-        # assert n >= 0
-        try:
-            data = self._sync_recvall(n)
-        except socket.error as err:
-            if err.args[0] == 'hangup':
-                return b''
+                return closed
             else:
                 raise
-        if len(data) != n:
+        if len(data) != size:
             return b''
         return data
 
+    def _sync_recv_msg_into(self, dst, size):
+        """Internal use only.
+
+        Synchronous version of async_recv_msg_into.
+        """
+        view = _AsyncSocket._msg_dst_view(dst, size)
+        pos = 0
+        try:
+            while pos < size:
+                bufsize = min(size - pos, AsyncSocket._MsgChunkSize)
+                if self._read_ahead:
+                    data = self._read_buffered(bufsize).tobytes()
+                    n = len(data)
+                    if view is not None:
+                        view[pos:pos + n] = data
+                elif view is None:
+                    data = self._rsock.recv(bufsize)
+                    n = len(data)
+                else:
+                    n = self._rsock.recv_into(view[pos:], bufsize)
+                if not n:
+                    return None
+                if view is None:
+                    dst(data)
+                pos += n
+        finally:
+            if view is not None:
+                view.release()
+        return size
+
     def create_connection(self, host_port, timeout=None, source_address=None):
         if timeout is not None:
             self.settimeout(timeout)
@@ -1172,7 +1818,7 @@ if platform.system() == 'Windows':
                 self._poller_name = 'IOCP'
                 self.iocp = win32file.CreateIoCompletionPort(win32file.INVALID_HANDLE_VALUE,
                                                              None, 0, 0)
-                self._timeouts = []
+                self._timeouts = _TimerWheel()
                 self.async_poller = _AsyncPoller(self)
                 self.cmd_rsock, self.cmd_wsock = _AsyncPoller._socketpair()
                 self.cmd_wsock.setblocking(0)
@@ -1189,6 +1835,15 @@ if platform.system() == 'Windows':
                 self.poll_thread.daemon = True
                 self.poll_thread.start()
 
+            def _start(self, integrated=False):
+                """Internal use only. Poll thread is started when notifier
+                is created; scheduler can't poll in its own thread with
+                IOCP, so 'integrated' is not possible.
+                """
+                if integrated:
+                    return -1
+                return 0
+
             def cmd_rsock_recv(self, err, n):
                 if n == 0:
                     err = winerror.ERROR_CONNECTION_INVALID
@@ -1214,14 +1869,13 @@ if platform.system() == 'Windows':
             def poll(self):
                 while 1:
                     self._lock.acquire()
-                    if self._timeouts:
-                        timeout = self._timeouts[0][0] - _time()
-                        if timeout < 0.0001:
-                            timeout = 0
-                        else:
-                            timeout = int(timeout * 1000)
-                    else:
+                    timeout = self._timeouts.timeout(_time())
+                    if timeout is None:
                         timeout = _AsyncNotifier._Block
+                    elif timeout < 0.0001:
+                        timeout = 0
+                    else:
+                        timeout = int(timeout * 1000)
                     self._lock.release()
 
                     self._polling = True
@@ -1244,20 +1898,17 @@ if platform.system() == 'Windows':
 
                     self._lock.acquire()
                     if self._timeouts:
-                        now = _time() + 0.0001
-                        while self._timeouts and self._timeouts[0][0] <= now:
-                            fd_timeout, fd = self._timeouts.pop(0)
-                            if fd._timeout_id == fd_timeout:
-                                fd._timeout_id = None
-                                fd._timed_out()
+                        for fd, value in self._timeouts.expire(_time()):
+                            fd._timeout_id = None
+                            fd._timed_out()
                     self._lock.release()
 
             def _add_timeout(self, fd):
                 if fd._timeout:
                     self._lock.acquire()
-                    fd._timeout_id = _time() + fd._timeout
-                    i = bisect_left(self._timeouts, (fd._timeout_id, fd))
-                    self._timeouts.insert(i, (fd._timeout_id, fd))
+                    if fd._timeout_id:
+                        self._timeouts.cancel(fd._timeout_id, fd)
+                    fd._timeout_id = self._timeouts.add(_time() + fd._timeout, fd)
                     if self._polling:
                         self._interrupt()
                     self._lock.release()
@@ -1267,17 +1918,8 @@ if platform.system() == 'Windows':
             def _del_timeout(self, fd):
                 if fd._timeout_id:
                     self._lock.acquire()
-                    i = bisect_left(self._timeouts, (fd._timeout_id, fd))
-                    while i < len(self._timeouts):
-                        if self._timeouts[i] == (fd._timeout_id, fd):
-                            del self._timeouts[i]
-                            fd._timeout_id = None
-                            break
-                        if fd._timeout_id != self._timeouts[i][0]:
-                            logger.warning('fd %s with %s is not found',
-                                           fd._fileno, fd._timeout_id)
-                            break
-                        i += 1
+                    self._timeouts.cancel(fd._timeout_id, fd)
+                    fd._timeout_id = None
                     if self._polling:
                         self._interrupt()
                     self._lock.release()
@@ -1291,7 +1933,7 @@ if platform.system() == 'Windows':
                     iocp, self.iocp = self.iocp, None
                     win32file.CloseHandle(iocp)
                     self.poll_thread.join(0.2)
-                    self._timeouts = []
+                    self._timeouts.clear()
                     self.cmd_rsock = self.cmd_wsock = None
                     self.__class__._instance = None
 
@@ -1370,6 +2012,7 @@ if platform.system() == 'Windows':
                 if not self._blocking and self._rsock.type & socket.SOCK_STREAM:
                     self.recv = self._iocp_recv
                     self.send = self._iocp_send
+                    self.recv_into = self._iocp_recv_into
                     self.recvall = self._iocp_recvall
                     self.sendall = self._iocp_sendall
                     self.connect = self._iocp_connect
@@ -1401,10 +2044,15 @@ if platform.system() == 'Windows':
                         if coro:
                             coro._proceed_(buf)
 
-                self._read_result = win32file.AllocateReadBuffer(bufsize)
-                self._read_overlap.object = partial_func(_recv, self)
                 if not self._asyncoro:
                     self._asyncoro = AsynCoro.scheduler()
+                if self._read_ahead:
+                    coro = AsynCoro.cur_coro(self._asyncoro)
+                    coro._await_()
+                    coro._proceed_(self._read_buffered(bufsize).tobytes())
+                    return
+                self._read_result = win32file.AllocateReadBuffer(bufsize)
+                self._read_overlap.object = partial_func(_recv, self)
                 self._read_coro = AsynCoro.cur_coro(self._asyncoro)
                 self._read_coro._await_()
                 if self._timeout:
@@ -1414,6 +2062,19 @@ if platform.system() == 'Windows':
                     self._read_overlap.object = self._read_result = self._read_coro = None
                     raise socket.error(err)
 
+            def _iocp_recv_into(self, buffer, nbytes=0, *args):
+                """Internal use only; use 'recv_into' with 'yield' instead.
+
+                Data is received with recv and copied into 'buffer'.
+                """
+                view = memoryview(buffer).cast('B')
+                if nbytes:
+                    view = view[:nbytes]
+                data = yield self._iocp_recv(len(view), *args)
+                view[:len(data)] = data
+                view.release()
+                raise StopIteration(len(data))
+
             def _iocp_send(self, buf, *args):
                 """Internal use only; use 'send' with 'yield' instead.
                 """
@@ -1494,9 +2155,21 @@ if platform.system() == 'Windows':
                 self._read_result = win32file.AllocateReadBuffer(bufsize)
                 # buffer is memoryview object
                 view = self._read_result
-                self._read_overlap.object = partial_func(_recvall, self, view)
                 if not self._asyncoro:
                     self._asyncoro = AsynCoro.scheduler()
+                if self._read_ahead:
+                    data = self._read_buffered(bufsize)
+                    view[:len(data)] = data
+                    view = view[len(data):]
+                    if len(view) == 0:
+                        buf = self._read_result.tobytes()
+                        self._read_result.release()
+                        self._read_result = None
+                        coro = AsynCoro.cur_coro(self._asyncoro)
+                        coro._await_()
+                        coro._proceed_(buf)
+                        return
+                self._read_overlap.object = partial_func(_recvall, self, view)
                 self._read_coro = AsynCoro.cur_coro(self._asyncoro)
                 self._read_coro._await_()
                 if self._timeout:
@@ -1543,6 +2216,8 @@ if platform.system() == 'Windows':
                                 if coro:
                                     coro.throw(socket.error(err))
 
+                if isinstance(data, (list, tuple)):
+                    data = b''.join(data)
                 self._write_result = memoryview(data)
                 self._write_overlap.object = partial_func(_sendall, self)
                 if not self._asyncoro:
@@ -1759,6 +2434,7 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
         _Write = None
         _Hangup = None
         _Error = None
+        _EdgeTriggered = 0
 
         _Block = None
 
@@ -1773,6 +2449,7 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                 _AsyncPoller._Write = select.EPOLLOUT
                 _AsyncPoller._Hangup = select.EPOLLHUP
                 _AsyncPoller._Error = select.EPOLLERR
+                _AsyncPoller._EdgeTriggered = select.EPOLLET
                 _AsyncPoller._Block = -1
             elif hasattr(select, 'kqueue'):
                 self._poller_name = 'kqueue'
@@ -1812,15 +2489,31 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                 _AsyncPoller._Block = None
 
             self._fds = {}
+            # events wanted (with 'add' / 'clear') for each fd
             self._events = {}
-            self._timeouts = []
+            # events registered with poller for each fd; these are not
+            # cleared until poller reports an event that is not wanted
+            # anymore (so fds that repeatedly wait for same event don't
+            # modify registration every time)
+            self._armed = {}
+            # with edge-triggered notification, events that have been
+            # reported for each fd (and may still be ready), and fds to
+            # retry in next poll, as they are waiting for such events
+            self._edge_events = {}
+            self._edge_retry = []
+            # number of calls to register / modify / unregister fds with
+            # poller (e.g., epoll_ctl)
+            self.ctl_calls = 0
+            self._timeouts = _TimerWheel()
             self._lock = threading.RLock()
             self._polling = False
             self._run = True
             self.cmd_read, self.cmd_write = _AsyncPoller._cmd_read_write_fds()
-            self.poll_thread = threading.Thread(target=self.poll)
-            self.poll_thread.daemon = True
-            self.poll_thread.start()
+            self._interrupt = None
+            # polling is started by AsynCoro (see '_start'), either in
+            # poll thread or, with 'integrated_loop', in scheduler thread
+            self._integrated = False
+            self.poll_thread = None
 
         @classmethod
         def instance(cls):
@@ -1829,69 +2522,181 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
             cls._instance = cls()
             return cls._instance
 
-        def poll(self):
-            if hasattr(self.cmd_write, 'getsockname'):
-                self.cmd_read = AsyncSocket(self.cmd_read)
-                self.cmd_read._read_task = lambda: self.cmd_read._rsock.recv(128)
-                self._interrupt = lambda: self.cmd_write.send(b'I')
-            else:
-                self._interrupt = lambda: os.write(self.cmd_write._fileno, b'I')
-            self.add(self.cmd_read, _AsyncPoller._Read)
-            while self._run:
-                self._lock.acquire()
-                if self._timeouts:
-                    timeout = self._timeouts[0][0] - _time()
-                    if timeout < 0.0001:
-                        timeout = 0
+        def _start(self, integrated=False):
+            """Internal use only. Starts poll thread or, if 'integrated' is
+            True, lets calling scheduler poll (with '_poll_once') in its
+            own thread. Returns -1 if 'integrated' is not possible (another
+            thread is polling already), 0 otherwise.
+            """
+            self._lock.acquire()
+            if not self._interrupt:
+                if hasattr(self.cmd_write, 'getsockname'):
+                    self.cmd_read = AsyncSocket(self.cmd_read)
+                    self.cmd_read._read_task = lambda: self.cmd_read._rsock.recv(128)
+                    self._interrupt = lambda: self.cmd_write.send(b'I')
                 else:
-                    timeout = _AsyncPoller._Block
-                self._polling = True
-                self._lock.release()
-                try:
-                    events = self._poller.poll(timeout)
-                except:
-                    logger.debug(traceback.format_exc())
+                    self._interrupt = lambda: os.write(self.cmd_write._fileno, b'I')
+                self.add(self.cmd_read, _AsyncPoller._Read)
+            if integrated:
+                if self.poll_thread or self._integrated:
+                    self._lock.release()
+                    return -1
+                self._integrated = True
+            elif not self.poll_thread and not self._integrated:
+                self.poll_thread = threading.Thread(target=self.poll)
+                self.poll_thread.daemon = True
+                self.poll_thread.start()
+            self._lock.release()
+            return 0
+
+        def _detach(self):
+            """Internal use only. Called when scheduler polling in its own
+            thread quits; if notifier is still in use, poll thread takes
+            over.
+            """
+            self._lock.acquire()
+            self._integrated = False
+            if self._run:
+                self._start()
+            self._lock.release()
+
+        def poll(self):
+            while self._run:
+                if self._poll_once(None):
                     # prevent tight loops
                     time.sleep(5)
-                    continue
-                self._lock.acquire()
+            self._close()
+
+        def _poll_once(self, timeout):
+            """Internal use only. Waits for I/O events for at most
+            'timeout' seconds (or until interrupted if 'timeout' is None),
+            or until a socket times out, and processes them. Returns 0 on
+            success, -1 if polling failed.
+            """
+            self._lock.acquire()
+            if not self._poller:
+                self._lock.release()
+                return -1
+            expires = self._timeouts.timeout(_time())
+            if expires is not None and (timeout is None or expires < timeout):
+                timeout = expires
+            if self._edge_retry:
+                timeout = 0
+            if timeout is None:
+                timeout = _AsyncPoller._Block
+            elif timeout < 0.0001:
+                timeout = 0
+            self._polling = True
+            self._lock.release()
+            try:
+                events = self._poller.poll(timeout)
+            except:
+                logger.debug(traceback.format_exc())
                 self._polling = False
-                try:
-                    for fileno, event in events:
-                        fd = self._fds.get(fileno, None)
-                        if not fd:
-                            if not (event & _AsyncPoller._Hangup):
-                                logger.debug('invalid fd %s for event %s', fileno, event)
-                            continue
-                        if event & _AsyncPoller._Read:
+                return -1
+            self._lock.acquire()
+            self._polling = False
+            try:
+                for fileno, event in events:
+                    fd = self._fds.get(fileno, None)
+                    if not fd:
+                        if not (event & _AsyncPoller._Hangup):
+                            logger.debug('invalid fd %s for event %s', fileno, event)
+                        continue
+                    if self._armed[fileno] & _AsyncPoller._EdgeTriggered:
+                        # edges are not reported again, so don't let a
+                        # failed task lose events for other fds
+                        try:
+                            self._edge_dispatch(fd, event)
+                        except:
+                            logger.debug(traceback.format_exc())
+                        continue
+                    # both directions are processed for each event
+                    if event & _AsyncPoller._Read:
+                        # task may have been set but not added yet (as
+                        # fd stays registered), in which case it is run
+                        # after it is added
+                        if self._events[fileno] & _AsyncPoller._Read:
                             if fd._read_task:
                                 fd._read_task()
-                            else:
-                                logger.debug('fd %s is not registered for reading!', fd._fileno)
-                                # self.unregister(fd)
-                        elif event & _AsyncPoller._Write:
+                        elif not fd._read_task:
+                            self._disarm(fd)
+                    if event & _AsyncPoller._Write:
+                        # read task may have closed fd
+                        if self._fds.get(fileno, None) != fd:
+                            continue
+                        if self._events[fileno] & _AsyncPoller._Write:
                             if fd._write_task:
                                 fd._write_task()
-                            else:
-                                logger.debug('fd %s is not registered for writing!', fd._fileno)
-                                # self.unregister(fd)
-                        elif event & _AsyncPoller._Hangup:
-                            fd._eof()
-                        elif event & _AsyncPoller._Error:
-                            logger.warning('error on fd %s', fd._fileno)
-                            self.unregister(fd)
-                except:
-                    logger.debug(traceback.format_exc())
+                        elif not fd._write_task:
+                            self._disarm(fd)
+                    if event & (_AsyncPoller._Read | _AsyncPoller._Write):
+                        # hangup / error are reported again, so they are
+                        # processed after pending data is read
+                        continue
+                    if event & _AsyncPoller._Hangup:
+                        fd._eof()
+                    elif event & _AsyncPoller._Error:
+                        logger.warning('error on fd %s', fd._fileno)
+                        self.unregister(fd)
+            except:
+                logger.debug(traceback.format_exc())
 
-                if self._timeouts:
-                    now = _time() + 0.0001
-                    while self._timeouts and self._timeouts[0][0] <= now:
-                        fd_timeout, fd = self._timeouts.pop(0)
-                        if fd._timeout_id == fd_timeout:
-                            fd._timeout_id = None
-                            fd._timed_out()
-                self._lock.release()
+            if self._edge_retry:
+                edge_retry, self._edge_retry = self._edge_retry, []
+                for fd in edge_retry:
+                    if self._fds.get(fd._fileno, None) == fd:
+                        try:
+                            self._edge_dispatch(fd, 0)
+                        except:
+                            logger.debug(traceback.format_exc())
+
+            if self._timeouts:
+                for fd, value in self._timeouts.expire(_time()):
+                    fd._timeout_id = None
+                    fd._timed_out()
+            self._lock.release()
+            return 0
 
+        def _disarm(self, fd):
+            """Internal use only. Called with lock held when poller
+            reports event that is not wanted anymore; registration is
+            updated to wanted events.
+            """
+            event = self._events.get(fd._fileno, 0)
+            if self._armed.get(fd._fileno, event) != event:
+                self._armed[fd._fileno] = event
+                self._poller.modify(fd._fileno, event)
+                self.ctl_calls += 1
+
+        def _edge_dispatch(self, fd, event):
+            """Internal use only. Called with lock held to process 'event'
+            reported for fd registered with edge-triggered notification.
+            As edges are not reported again, events are remembered until
+            a task finds that socket is not ready (task is still pending
+            after it is run).
+            """
+            if event & (_AsyncPoller._Hangup | _AsyncPoller._Error):
+                # reading gets EOF / error
+                event |= _AsyncPoller._Read
+            event = self._edge_events.get(fd._fileno, 0) | event
+            # tasks that have not been added yet are run (retried) when
+            # they are added
+            wanted = self._events.get(fd._fileno, 0)
+            if (event & wanted & _AsyncPoller._Read) and fd._read_task:
+                task = fd._read_task
+                task()
+                if fd._read_task == task:
+                    event &= ~_AsyncPoller._Read
+            if (event & wanted & _AsyncPoller._Write) and fd._write_task:
+                task = fd._write_task
+                task()
+                if fd._write_task == task:
+                    event &= ~_AsyncPoller._Write
+            if self._fds.get(fd._fileno, None) == fd:
+                self._edge_events[fd._fileno] = event
+
+        def _close(self):
             self._lock.acquire()
             if hasattr(self.cmd_write, 'getsockname'):
                 self.cmd_write.close()
@@ -1904,7 +2709,11 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                                    fd._fileno, traceback.format_exc())
                 fd._notifier = None
             self._fds.clear()
-            self._timeouts = []
+            self._events.clear()
+            self._armed.clear()
+            self._edge_events.clear()
+            self._edge_retry = []
+            self._timeouts.clear()
             self._poller = None
             self.cmd_read = self.cmd_write = None
             self.__class__._instance = None
@@ -1914,31 +2723,26 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
             if self._run:
                 self._lock.acquire()
                 self._run = False
-                self._interrupt()
-                self._lock.release()
-                self.poll_thread.join(0.2)
+                if self.poll_thread:
+                    self._interrupt()
+                    self._lock.release()
+                    self.poll_thread.join(0.2)
+                else:
+                    self._lock.release()
+                    self._close()
 
         def _add_timeout(self, fd):
             self._lock.acquire()
-            fd._timeout_id = _time() + fd._timeout
-            i = bisect_left(self._timeouts, (fd._timeout_id, fd))
-            self._timeouts.insert(i, (fd._timeout_id, fd))
+            if fd._timeout_id:
+                self._timeouts.cancel(fd._timeout_id, fd)
+            fd._timeout_id = self._timeouts.add(_time() + fd._timeout, fd)
             self._lock.release()
 
         def _del_timeout(self, fd):
             self._lock.acquire()
-            i = bisect_left(self._timeouts, (fd._timeout_id, fd))
-            # in case of identical timeouts (unlikely?), search for
-            # correct index where fd is
-            while i < len(self._timeouts):
-                if self._timeouts[i] == (fd._timeout_id, fd):
-                    del self._timeouts[i]
-                    fd._timeout_id = None
-                    break
-                if fd._timeout_id != self._timeouts[i][0]:
-                    logger.warning('fd %s with %s is not found', fd._fileno, fd._timeout_id)
-                    break
-                i += 1
+            if fd._timeout_id:
+                self._timeouts.cancel(fd._timeout_id, fd)
+                fd._timeout_id = None
             self._lock.release()
 
         def unregister(self, fd):
@@ -1948,7 +2752,10 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                 self._lock.release()
                 return
             self._events.pop(fd._fileno, None)
+            self._armed.pop(fd._fileno, None)
+            self._edge_events.pop(fd._fileno, None)
             self._poller.unregister(fd._fileno)
+            self.ctl_calls += 1
             if self._polling:
                 self._interrupt()
             self._lock.release()
@@ -1961,16 +2768,41 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
             if cur_event is None:
                 self._fds[fd._fileno] = fd
                 self._events[fd._fileno] = event
-                self._poller.register(fd._fileno, event)
+                if (EdgeTriggered and _AsyncPoller._EdgeTriggered and
+                    isinstance(fd, AsyncSocket) and not fd._certfile):
+                    # stays registered for both reading and writing
+                    armed = (_AsyncPoller._Read | _AsyncPoller._Write |
+                             _AsyncPoller._EdgeTriggered)
+                else:
+                    armed = event
+                self._armed[fd._fileno] = armed
+                self._poller.register(fd._fileno, armed)
+                self.ctl_calls += 1
+                interrupt = True
             else:
+                interrupt = False
                 event |= cur_event
                 self._events[fd._fileno] = event
-                self._poller.modify(fd._fileno, event)
+                armed = self._armed[fd._fileno]
+                if armed & _AsyncPoller._EdgeTriggered:
+                    if self._edge_events.get(fd._fileno, 0) & event:
+                        # event has been reported already, so it won't be
+                        # reported again until socket is not ready
+                        self._edge_retry.append(fd)
+                        interrupt = True
+                elif event & ~armed:
+                    armed |= event
+                    self._armed[fd._fileno] = armed
+                    self._poller.modify(fd._fileno, armed)
+                    self.ctl_calls += 1
+                    interrupt = True
             if fd._timeout:
                 self._add_timeout(fd)
-            else:
+                interrupt = True
+            elif fd._timeout_id:
+                self._timeouts.cancel(fd._timeout_id, fd)
                 fd._timeout_id = None
-            if self._polling:
+            if interrupt and self._polling:
                 self._interrupt()
             self._lock.release()
 
@@ -1983,11 +2815,19 @@ if not hasattr(sys.modules[__name__], '_AsyncNotifier'):
                 else:
                     cur_event = 0
                 self._events[fd._fileno] = cur_event
-                self._poller.modify(fd._fileno, cur_event)
+                # read registration is kept; if it is reported before
+                # it is added again, it is disarmed then (in
+                # '_poll_once'); sockets are almost always writable, so
+                # write registration is removed now
+                armed = self._armed[fd._fileno]
+                if (armed & _AsyncPoller._Write) and not (cur_event & _AsyncPoller._Write) and \
+                   not (armed & _AsyncPoller._EdgeTriggered):
+                    armed &= ~_AsyncPoller._Write
+                    self._armed[fd._fileno] = armed
+                    self._poller.modify(fd._fileno, armed)
+                    self.ctl_calls += 1
                 if not cur_event and fd._timeout_id:
                     self._del_timeout(fd)
-                if self._polling:
-                    self._interrupt()
             self._lock.release()
 
         @staticmethod
@@ -2493,15 +3333,34 @@ class Coro(object):
     schedules that coroutine to be executed with AsynCoro. If the
     function definition has 'coro' keyword argument set to (default
     value) None, that argument will be set to the coroutine created.
+
+    If coroutine is created with keyword arguments (as 'target', 'args'
+    and 'kwargs' similar to threading.Thread), 'priority' keyword
+    argument can be used to set its priority. If coroutine is created
+    with generator function and its arguments, all keyword arguments
+    (including 'priority', if any) are passed to generator function;
+    priority of such coroutine can be set with 'set_priority'.
     """
 
     __slots__ = ('_generator', '_name', '_id', '_state', '_value', '_exceptions', '_callers',
                  '_timeout', '_daemon', '_complete', '_msgs', '_monitors', '_swap_generator',
-                 '_hot_swappable', '_location', '_scheduler')
+                 '_hot_swappable', '_location', '_scheduler', '_queued', '_priority')
 
     _asyncoro = None
 
+    # priorities of coroutines; coroutines with higher priority are
+    # executed before those with lower priority
+    LowPriority = 0
+    NormalPriority = 1
+    HighPriority = 2
+
     def __init__(self, *args, **kwargs):
+        if not args:
+            priority = kwargs.pop('priority', None)
+            if priority is not None:
+                if priority not in (Coro.LowPriority, Coro.NormalPriority, Coro.HighPriority):
+                    raise Exception('invalid priority: %s' % priority)
+                self._priority = priority
         self._generator = Coro.__get_generator(self, *args, **kwargs)
         self._name = self._generator.__name__
         self._id = id(self)
@@ -2516,6 +3375,9 @@ class Coro(object):
         self._monitors = set()
         self._swap_generator = None
         self._hot_swappable = False
+        self._queued = False
+        if getattr(self, '_priority', None) is None:
+            self._priority = Coro.NormalPriority
         if not Coro._asyncoro:
             Coro._asyncoro = AsynCoro.instance()
         if not getattr(self, '_scheduler', None):
@@ -2610,6 +3472,35 @@ class Coro(object):
         """
         return self._scheduler._set_daemon(self, bool(flag))
 
+    @property
+    def priority(self):
+        """Get priority of coroutine. For remote coroutines, this is
+        None.
+        """
+        return getattr(self, '_priority', None)
+
+    def set_priority(self, priority):
+        """Set priority of coroutine to one of Coro.LowPriority,
+        Coro.NormalPriority (default) or Coro.HighPriority.
+
+        When coroutines with different priorities are ready to
+        execute, AsynCoro executes those with higher priority
+        first. To avoid starving coroutines with lower priority, they
+        are executed after being passed over a number of times (see
+        AsynCoro.PriorityAging).
+
+        If the coroutine is currently waiting for its turn, new
+        priority is effective from next time it is scheduled.
+        """
+        if self._location != Coro._asyncoro._location:
+            logger.warning('priority of remote coroutine %s can not be set', self)
+            return -1
+        if priority not in (Coro.LowPriority, Coro.NormalPriority, Coro.HighPriority):
+            logger.warning('invalid priority: %s', priority)
+            return -1
+        self._priority = priority
+        return 0
+
     def suspend(self, timeout=None, alarm_value=None):
         """Must be used with 'yield' as 'yield coro.suspend()'.
 
@@ -2931,6 +3822,32 @@ class Location(object):
         return hash('%s:%s' % (self.addr, self.port))
 
 
+class ChannelMessage(object):
+    """Messages sent to a channel with history (see Channel) are
+    delivered to subscribers as instances of this class. 'channel' is
+    name of channel, 'seq' is sequence number of message (so
+    subscribers can detect messages they missed, and ask channel to
+    send them again; see 'subscribe' in Channel) and 'message' is the
+    message sent.
+    """
+
+    __slots__ = ('channel', 'seq', 'message')
+
+    def __init__(self, channel, seq, message):
+        self.channel = channel
+        self.seq = seq
+        self.message = message
+
+    def __getstate__(self):
+        return (self.channel, self.seq, self.message)
+
+    def __setstate__(self, state):
+        self.channel, self.seq, self.message = state
+
+    def __repr__(self):
+        return 'ChannelMessage(%s, %s)' % (self.channel, self.seq)
+
+
 class Channel(object):
     """Subscription based channel. Broadcasts a message to all
     registered subscribers, whether they are currently waiting for
@@ -2942,11 +3859,12 @@ class Channel(object):
     """
 
     __slots__ = ('_name', '_location', '_transform', '_subscribers', '_subscribe_event',
-                 '_scheduler')
+                 '_scheduler', '_fanout', '_seq', '_history', '_history_size',
+                 '_history_bytes', '_log', '_log_lock')
 
     _asyncoro = None
 
-    def __init__(self, name, transform=None):
+    def __init__(self, name, transform=None, history=0, history_size=0, log=None):
         """'name' must be unique across all channels.
 
         'transform' is a function that can either filter or
@@ -2954,6 +3872,20 @@ class Channel(object):
         message is filtered (ignored). The function is called with
         first parameter set to channel name and second parameter set
         to the message.
+
+        If 'history' is a positive number, last 'history' messages
+        sent to the channel are kept, so subscribers can ask for them
+        when subscribing (e.g., after joining late or reconnecting). If
+        'history_size' is a positive number, messages are also dropped
+        from history when their total (serialized) size exceeds
+        'history_size' bytes. If 'log' is path of a file, messages are
+        also appended to it, and history (and sequence numbers) are
+        restored from it when channel is created again with same
+        'log' (e.g., after restart); when it is loaded, the log is
+        compacted to messages kept in history if channel keeps history,
+        and is not changed otherwise. Messages sent to a channel with
+        history (or log) are delivered to subscribers as
+        ChannelMessage instances, with sequence numbers.
         """
 
         if not Channel._asyncoro:
@@ -2983,6 +3915,25 @@ class Channel(object):
             # assert self._location and self._scheduler == Channel._asyncoro._sys_asyncoro
             self._name = '!' + self._name
         self._subscribers = set()
+        # immutable snapshot of subscribers (grouped for 'send' and
+        # 'deliver'); it is discarded when subscribers change and rebuilt
+        # when needed next, so sending messages doesn't lock or copy
+        # subscribers
+        self._fanout = None
+        # sequence number of last message sent, if channel keeps history
+        self._seq = None
+        self._history = None
+        self._history_size = history_size
+        self._history_bytes = 0
+        self._log = None
+        self._log_lock = None
+        if history > 0 or history_size > 0 or log:
+            self._seq = 0
+            if history > 0 or history_size > 0:
+                # (message, size) tuples
+                self._history = collections.deque(maxlen=history if history > 0 else None)
+            if log:
+                self._load_log(log)
         self._subscribe_event = Event()
         self._scheduler._lock.acquire()
         if self._name in self._scheduler._channels:
@@ -3063,7 +4014,7 @@ class Channel(object):
         self._transform = transform
         return 0
 
-    def subscribe(self, subscriber, timeout=None):
+    def subscribe(self, subscriber, timeout=None, replay_from=None, replay_last=0):
         """Must be used with 'yield', as, for example,
         'yield channel.subscribe(coro)'.
 
@@ -3071,41 +4022,66 @@ class Channel(object):
         subscribe. A message sent to this channel is delivered to all
         subscribers.
 
+        If channel keeps history, messages in it with sequence number
+        'replay_from' or later (if it is not None) and / or last
+        'replay_last' messages (if it is a positive number) are sent to
+        subscriber before any new messages.
+
         Can also be used on remote channels.
         """
-        if not isinstance(subscriber, Coro) and not isinstance(subscriber, Channel):
+        if (not isinstance(subscriber, Coro) and not isinstance(subscriber, Channel)) or \
+           isinstance(subscriber, TopicChannel):
             logger.warning('invalid subscriber ignored')
             raise StopIteration(-1)
         if self._location == Channel._asyncoro._location:
-            if subscriber._location != self._location:
-                if isinstance(subscriber, Coro):
-                    # remote coro
-                    subscriber._id = int(subscriber._id)
-                    for s in self._subscribers:
-                        if isinstance(s, Coro) and \
-                           s._id == subscriber._id and s._location == subscriber._location:
-                            subscriber = s
-                            break
-                elif isinstance(subscriber, Channel):
-                    # remote channel
-                    for s in self._subscribers:
-                        if isinstance(s, Channel) and \
-                           s._name == subscriber._name and s._location == subscriber._location:
-                            subscriber = s
-                            break
+            subscriber = self._subscriber(subscriber)
             self._scheduler._lock.acquire()
             self._subscribers.add(subscriber)
+            self._fanout = None
+            if self._history and (replay_from is not None or replay_last > 0):
+                replay = [message for message, size in self._history
+                          if replay_from is None or message.seq >= replay_from]
+                if replay_last > 0:
+                    replay = replay[-replay_last:]
+            else:
+                replay = None
             self._subscribe_event.set()
             self._scheduler._lock.release()
+            if replay:
+                for message in replay:
+                    subscriber.send(message)
             reply = 0
         else:
             # remote channel
             kwargs = {'channel': self._name}
             kwargs['subscriber'] = subscriber
+            if replay_from is not None or replay_last > 0:
+                kwargs['replay_from'] = replay_from
+                kwargs['replay_last'] = replay_last
             request = _NetRequest('subscribe', kwargs=kwargs, dst=self._location, timeout=timeout)
             reply = yield Channel._asyncoro._sys_asyncoro._sync_reply(request)
         raise StopIteration(reply)
 
+    def _subscriber(self, subscriber):
+        """Internal use only. Returns subscriber of this channel that is
+        same as (remote) 'subscriber', or 'subscriber' if there is none.
+        """
+        if subscriber._location != self._location:
+            if isinstance(subscriber, Coro):
+                # remote coro
+                subscriber._id = int(subscriber._id)
+                for s in self._subscribers:
+                    if isinstance(s, Coro) and \
+                       s._id == subscriber._id and s._location == subscriber._location:
+                        return s
+            elif isinstance(subscriber, Channel):
+                # remote channel
+                for s in self._subscribers:
+                    if isinstance(s, Channel) and \
+                       s._name == subscriber._name and s._location == subscriber._location:
+                        return s
+        return subscriber
+
     def unsubscribe(self, subscriber, timeout=None):
         """Must be called with 'yield' as, for example,
         'yield channel.unsubscribe(coro)'.
@@ -3118,28 +4094,16 @@ class Channel(object):
             logger.warning('invalid subscriber ignored')
             raise StopIteration(-1)
         if self._location == Channel._asyncoro._location:
-            if subscriber._location != self._location:
-                if isinstance(subscriber, Coro):
-                    # remote coro
-                    subscriber._id = int(subscriber._id)
-                    for s in self._subscribers:
-                        if isinstance(s, Coro) and \
-                           s._id == subscriber._id and s._location == subscriber._location:
-                            subscriber = s
-                            break
-                elif isinstance(subscriber, Channel):
-                    # remote channel
-                    for s in self._subscribers:
-                        if isinstance(s, Channel) and \
-                           s._name == subscriber._name and s._location == subscriber._location:
-                            subscriber = s
-                            break
+            subscriber = self._subscriber(subscriber)
+            self._scheduler._lock.acquire()
             try:
                 self._subscribers.remove(subscriber)
             except KeyError:
                 reply = -1
             else:
+                self._fanout = None
                 reply = 0
+            self._scheduler._lock.release()
         else:
             # remote channel
             kwargs = {'channel': self._name}
@@ -3154,10 +4118,8 @@ class Channel(object):
         Can also be used on remote channels.
         """
         if self._location == Channel._asyncoro._location:
-            self._scheduler._lock.acquire()
             transform = self._transform
-            subscribers = list(self._subscribers)
-            self._scheduler._lock.release()
+            fanout = self._fanout or self._snapshot()
 
             if transform:
                 try:
@@ -3166,16 +4128,9 @@ class Channel(object):
                     message = None
                 if message is None:
                     return 0
-            invalid = []
-            for subscriber in subscribers:
-                if subscriber.send(message) != 0:
-                    invalid.append(subscriber)
-            if invalid:
-                def _unsub(self, subscriber, coro=None):
-                    logger.debug('remote subscriber %s is not valid; unsubscribing it', subscriber)
-                    yield self.unsubscribe(subscriber)
-                for subscriber in invalid:
-                    Coro(_unsub, self, subscriber)
+            if self._seq is not None:
+                message = self._record(message)
+            self._send_to(fanout, message)
         else:
             # remote channel
             request = _NetRequest('send', kwargs={'message': message, 'channel': self._name},
@@ -3186,6 +4141,171 @@ class Channel(object):
                 return -1
         return 0
 
+    def _send_to(self, fanout, message):
+        """Internal use only. Sends message to subscribers in 'fanout'
+        (see '_snapshot').
+        """
+        local, remote = fanout
+        invalid = []
+        for subscriber in local:
+            if subscriber.send(message) != 0:
+                invalid.append(subscriber)
+        # message is sent (and serialized) once to each peer with
+        # remote subscribers, which sends it to them
+        for location, group, recipients, ncoros in remote:
+            if len(group) == 1:
+                if group[0].send(message) != 0:
+                    invalid.append(group[0])
+                continue
+            request = _NetRequest('send', kwargs={'message': message,
+                                                  'recipients': recipients},
+                                  dst=location, timeout=MsgTimeout)
+            # request is queued for asynchronous processing
+            if _Peer.send_req(request) != 0:
+                invalid.extend(group)
+        if invalid:
+            def _unsub(self, subscriber, coro=None):
+                logger.debug('remote subscriber %s is not valid; unsubscribing it', subscriber)
+                yield self.unsubscribe(subscriber)
+            for subscriber in invalid:
+                Coro(_unsub, self, subscriber)
+
+    def _record(self, message):
+        """Internal use only. Returns ChannelMessage for 'message' with
+        next sequence number, after adding it to history (and log).
+        """
+        if self._history_size > 0 or self._log:
+            try:
+                data = serialize(message)
+            except:
+                logger.warning('message to channel "%s" could not be serialized', self._name)
+                data = None
+        else:
+            data = None
+        log = self._log
+        if log:
+            # messages are written to log outside of scheduler's lock (as
+            # writing may block), but in order of their sequence numbers
+            self._log_lock.acquire()
+        self._scheduler._lock.acquire()
+        self._seq += 1
+        seq = self._seq
+        message = ChannelMessage(self._name[1:], seq, message)
+        history = self._history
+        if history is not None:
+            size = len(data) if data is not None else 0
+            if history.maxlen is not None and len(history) == history.maxlen:
+                self._history_bytes -= history[0][1]
+            history.append((message, size))
+            self._history_bytes += size
+            if self._history_size > 0:
+                while self._history_bytes > self._history_size and len(history) > 1:
+                    self._history_bytes -= history.popleft()[1]
+        self._scheduler._lock.release()
+        if log:
+            if data is not None:
+                try:
+                    log.write(struct.pack('>LQ', len(data), seq) + data)
+                    log.flush()
+                except:
+                    logger.warning('could not write to log of channel "%s"', self._name)
+            self._log_lock.release()
+        return message
+
+    def _load_log(self, path):
+        """Internal use only. Restores history and sequence number from
+        log at 'path' and opens it to append messages. If channel keeps
+        history, log is compacted to messages in history; otherwise, log
+        is not changed, except that partially written message (e.g., when
+        program crashed) is removed.
+        """
+        if self._history is not None:
+            records = collections.deque(maxlen=self._history.maxlen)
+        else:
+            # only sequence number of last message is needed
+            records = collections.deque(maxlen=1)
+        count = 0
+        # offset of end of last complete message
+        end = 0
+        partial = False
+        if os.path.isfile(path):
+            with open(path, 'rb') as fd:
+                while True:
+                    header = fd.read(12)
+                    if len(header) < 12:
+                        partial = len(header) > 0
+                        break
+                    size, seq = struct.unpack('>LQ', header)
+                    data = fd.read(size)
+                    if len(data) < size:
+                        partial = True
+                        break
+                    end += 12 + size
+                    records.append((seq, data))
+                    count += 1
+                    self._seq = seq
+            if self._history is not None:
+                kept = []
+                for seq, data in records:
+                    try:
+                        message = unserialize(data)
+                    except:
+                        continue
+                    kept.append((seq, data))
+                    self._history.append((ChannelMessage(self._name[1:], seq, message),
+                                          len(data)))
+                    self._history_bytes += len(data)
+                if self._history_size > 0:
+                    while self._history_bytes > self._history_size and len(self._history) > 1:
+                        self._history_bytes -= self._history.popleft()[1]
+                        kept.pop(0)
+                if len(kept) != count:
+                    # log is rewritten with messages in history only
+                    with open(path + '.tmp', 'wb') as fd:
+                        for seq, data in kept:
+                            fd.write(struct.pack('>LQ', len(data), seq) + data)
+                    os.rename(path + '.tmp', path)
+                    partial = False
+            if partial:
+                with open(path, 'r+b') as fd:
+                    fd.truncate(end)
+        self._log = open(path, 'ab')
+        self._log_lock = threading.Lock()
+
+    def _snapshot(self):
+        """Internal use only. Returns (and saves) snapshot of subscribers:
+        tuple of local subscribers and tuple of remote subscribers grouped
+        by location, each as tuple of location, subscribers (coroutines
+        first), their names (and ids of coroutines) and number of
+        coroutines in them.
+        """
+        self._scheduler._lock.acquire()
+        if self._fanout is None:
+            self._fanout = self._group(self._subscribers)
+        fanout = self._fanout
+        self._scheduler._lock.release()
+        return fanout
+
+    def _group(self, subscribers):
+        """Internal use only. Returns 'subscribers' grouped as in
+        '_snapshot'.
+        """
+        local = []
+        remote = {}
+        for subscriber in subscribers:
+            if subscriber._location == self._location:
+                local.append(subscriber)
+            else:
+                remote.setdefault(subscriber._location, []).append(subscriber)
+        groups = []
+        for location, group in remote.items():
+            coros = [s for s in group if isinstance(s, Coro)]
+            group = tuple(coros + [s for s in group if not isinstance(s, Coro)])
+            recipients = tuple([(s._name, s._id) for s in coros] +
+                               [(s._name, None) for s in group[len(coros):]])
+            groups.append((location, group, recipients, len(coros)))
+        return (tuple(local), tuple(groups))
+
     def deliver(self, message, timeout=None, n=0):
         """Must be used with 'yield' as 'rcvd = yield channel.deliver(message)'.
 
@@ -3200,10 +4320,7 @@ class Channel(object):
         if not isinstance(n, int) or n < 0:
             raise StopIteration(-1)
         if self._location == Channel._asyncoro._location:
-            self._scheduler._lock.acquire()
             transform = self._transform
-            subscribers = list(self._subscribers)
-            self._scheduler._lock.release()
 
             if transform:
                 try:
@@ -3212,8 +4329,10 @@ class Channel(object):
                     message = None
                 if message is None:
                     raise StopIteration(0)
+            if self._seq is not None:
+                message = self._record(message)
             if n:
-                while len(subscribers) < n:
+                while len(self._subscribers) < n:
                     start = _time()
                     self._scheduler._lock.acquire()
                     self._subscribe_event.clear()
@@ -3224,50 +4343,8 @@ class Channel(object):
                         timeout -= _time() - start
                         if timeout <= 0:
                             raise StopIteration(0)
-                    self._scheduler._lock.acquire()
-                    subscribers = list(self._subscribers)
-                    self._scheduler._lock.release()
-
-            info = {'reply': 0, 'pending': len(subscribers), 'success': 0,
-                    'done': Event(), 'invalid': []}
-
-            def _deliver(subscriber, info, timeout, n, coro=None):
-                try:
-                    reply = yield subscriber.deliver(message, timeout=timeout)
-                    if reply > 0:
-                        info['reply'] += reply
-                        info['success'] += 1
-                        if n > 0 and info['success'] >= n:
-                            info['done'].set()
-                    elif reply < 0:
-                        info['invalid'].append(subscriber)
-                except:
-                    pass
-                info['pending'] -= 1
-                if info['pending'] == 0:
-                    info['done'].set()
-            for subscriber in subscribers:
-                if isinstance(subscriber, Coro) and self._location == subscriber._location:
-                    if subscriber.send(message) == 0:
-                        info['reply'] += 1
-                        info['success'] += 1
-                    info['pending'] -= 1
-                else:
-                    # channel/remote coro
-                    Coro(_deliver, subscriber, info, timeout, n)
-            if info['pending'] == 0:
-                info['done'].set()
-            if n == 0 or info['success'] < n:
-                yield info['done'].wait(timeout)
-
-            if info['invalid']:
-                def _unsub(self, subscriber, coro=None):
-                    logger.debug('remote subscriber %s is not valid; unsubscribing it', subscriber)
-                    yield self.unsubscribe(subscriber)
-                for subscriber in info['invalid']:
-                    Coro(_unsub, self, subscriber)
-
-            raise StopIteration(info['reply'])
+            reply = yield self._deliver_to(self._fanout or self._snapshot(), message, timeout, n)
+            raise StopIteration(reply)
         else:
             # remote channel
             request = _NetRequest('deliver', kwargs={'message': message, 'channel': self._name,
@@ -3282,10 +4359,94 @@ class Channel(object):
             #                    self._name, self._location)
             raise StopIteration(reply)
 
+    def _deliver_to(self, fanout, message, timeout, n):
+        """Internal use only. Delivers message to subscribers in 'fanout'
+        (see '_snapshot' and 'deliver').
+        """
+        local, remote = fanout
+        info = {'reply': 0, 'pending': 0, 'success': 0, 'done': Event(), 'invalid': []}
+
+        def _done(info, n):
+            info['pending'] -= 1
+            if info['pending'] == 0 or (n > 0 and info['success'] >= n):
+                info['done'].set()
+
+        def _deliver(subscriber, info, timeout, n, coro=None):
+            try:
+                reply = yield subscriber.deliver(message, timeout=timeout)
+                if reply > 0:
+                    info['reply'] += reply
+                    info['success'] += 1
+                elif reply < 0:
+                    info['invalid'].append(subscriber)
+            except:
+                pass
+            _done(info, n)
+
+        def _deliver_group(location, coros, recipients, info, timeout, n, coro=None):
+            # peer delivers message to its coroutines in 'recipients'
+            # and replies with number of them delivered to and
+            # indices of invalid ones
+            request = _NetRequest('deliver', kwargs={'message': message,
+                                                     'recipients': recipients},
+                                  dst=location, timeout=timeout)
+            request.reply = -1
+            try:
+                reply = yield Channel._asyncoro._sys_asyncoro._sync_reply(request,
+                                                                           alarm_value=0)
+                if isinstance(reply, tuple):
+                    info['reply'] += reply[0]
+                    info['success'] += reply[0]
+                    info['invalid'].extend(coros[i] for i in reply[1])
+                elif reply is None or reply < 0:
+                    info['invalid'].extend(coros)
+            except:
+                pass
+            _done(info, n)
+
+        for subscriber in local:
+            if isinstance(subscriber, Coro):
+                if subscriber.send(message) == 0:
+                    info['reply'] += 1
+                    info['success'] += 1
+            else:
+                info['pending'] += 1
+                Coro(_deliver, subscriber, info, timeout, n)
+        # message is sent once to each peer for its coroutines, and to
+        # each remote channel
+        for location, group, recipients, ncoros in remote:
+            if ncoros > 1:
+                info['pending'] += 1
+                Coro(_deliver_group, location, group[:ncoros], recipients[:ncoros],
+                     info, timeout, n)
+                group = group[ncoros:]
+            for subscriber in group:
+                info['pending'] += 1
+                Coro(_deliver, subscriber, info, timeout, n)
+        if info['pending'] == 0:
+            info['done'].set()
+        if n == 0 or info['success'] < n:
+            yield info['done'].wait(timeout)
+
+        if info['invalid']:
+            def _unsub(self, subscriber, coro=None):
+                logger.debug('remote subscriber %s is not valid; unsubscribing it', subscriber)
+                yield self.unsubscribe(subscriber)
+            for subscriber in info['invalid']:
+                Coro(_unsub, self, subscriber)
+
+        raise StopIteration(info['reply'])
+
     def close(self):
         if self._location == Channel._asyncoro._location:
             self.unregister()
             self._subscribers = set()
+            self._fanout = None
+            if self._log:
+                self._log_lock.acquire()
+                self._log.close()
+                self._log = None
+                self._log_lock.release()
             self._scheduler._lock.acquire()
             self._scheduler._channels.pop(self._name, None)
             self._scheduler._lock.release()
@@ -3316,6 +4477,300 @@ class Channel(object):
             return self._name
 
 
+class _TopicNode(object):
+    """Internal use only. Node in index of subscriptions of TopicChannel:
+    'children' maps next word of topic pattern (which may be '*' or
+    '#') to its node and 'subscribers' is set of subscribers with
+    pattern ending at this node.
+    """
+
+    __slots__ = ('children', 'subscribers')
+
+    def __init__(self):
+        self.children = {}
+        self.subscribers = set()
+
+
+class TopicChannel(Channel):
+    """Channel that routes messages on topics. Topics are dotted names,
+    e.g., 'sensor.room1.temp', and subscribers subscribe to topic
+    patterns, in which '*' matches exactly one word and '#' (which can
+    only be last word) matches zero or more words; e.g., 'sensor.*.temp'
+    and 'sensor.#' both match 'sensor.room1.temp'. A message sent on a
+    topic is delivered, as tuple (topic, message), to subscribers with
+    any pattern matching that topic, so a single (registered) channel
+    can be used instead of a channel for each topic.
+
+    Subscriptions are kept in an index (trie) of words in patterns, so
+    cost of routing a message depends on number of words in topic, not
+    number of subscriptions; subscribers for a topic are also cached
+    until subscriptions change. As with Channel, a message is sent once
+    to each peer with subscribers for its topic.
+    """
+
+    __slots__ = ('_topics', '_routes')
+
+    # maximum number of topics with cached subscribers
+    _max_routes = 16384
+
+    def __init__(self, name, transform=None):
+        """'name' must be unique across all channels.
+
+        'transform' is a function that can either filter or transform
+        a message, as in Channel, except that it is called with topic
+        (instead of channel name) as first parameter.
+        """
+        Channel.__init__(self, name, transform=transform)
+        # subscriber -> set of its topic patterns
+        self._subscribers = {}
+        self._topics = _TopicNode()
+        # topic -> subscribers grouped for 'send' and 'deliver' (see
+        # '_snapshot' in Channel)
+        self._routes = {}
+
+    @staticmethod
+    def _words(topic, pattern=False):
+        """Internal use only. Returns list of words in 'topic' (pattern
+        if 'pattern' is True), or None if it is not valid.
+        """
+        if not isinstance(topic, str):
+            return None
+        words = topic.split('.')
+        for i, word in enumerate(words):
+            if not word:
+                return None
+            if word == '*' or word == '#':
+                if not pattern or (word == '#' and i != len(words) - 1):
+                    return None
+            elif '*' in word or '#' in word:
+                return None
+        return words
+
+    def subscribe(self, subscriber, topic='#', timeout=None):
+        """Must be used with 'yield', as, for example,
+        'yield channel.subscribe(coro, "sensor.*.temp")'.
+
+        Subscribe to receive messages sent on topics matching pattern
+        'topic' (by default, all messages). A subscriber can subscribe
+        with more than one pattern; it receives a message once even if
+        more than one of its patterns match the topic.
+
+        Can also be used on remote channels.
+        """
+        if (not isinstance(subscriber, Coro) and not isinstance(subscriber, Channel)) or \
+           isinstance(subscriber, TopicChannel):
+            logger.warning('invalid subscriber ignored')
+            raise StopIteration(-1)
+        words = TopicChannel._words(topic, pattern=True)
+        if not words:
+            logger.warning('invalid topic "%s" ignored', topic)
+            raise StopIteration(-1)
+        if self._location == Channel._asyncoro._location:
+            subscriber = self._subscriber(subscriber)
+            self._scheduler._lock.acquire()
+            node = self._topics
+            for word in words:
+                child = node.children.get(word, None)
+                if child is None:
+                    child = node.children[word] = _TopicNode()
+                node = child
+            node.subscribers.add(subscriber)
+            self._subscribers.setdefault(subscriber, set()).add(topic)
+            self._routes = {}
+            self._subscribe_event.set()
+            self._scheduler._lock.release()
+            reply = 0
+        else:
+            # remote channel
+            kwargs = {'channel': self._name}
+            kwargs['subscriber'] = subscriber
+            kwargs['topic'] = topic
+            request = _NetRequest('subscribe', kwargs=kwargs, dst=self._location, timeout=timeout)
+            reply = yield Channel._asyncoro._sys_asyncoro._sync_reply(request)
+        raise StopIteration(reply)
+
+    def unsubscribe(self, subscriber, topic=None, timeout=None):
+        """Must be called with 'yield' as, for example,
+        'yield channel.unsubscribe(coro, "sensor.*.temp")'.
+
+        Remove subscription with pattern 'topic' or, if 'topic' is
+        None, all subscriptions of subscriber.
+
+        Can also be used on remote channels.
+        """
+        if not isinstance(subscriber, Coro) and not isinstance(subscriber, Channel):
+            logger.warning('invalid subscriber ignored')
+            raise StopIteration(-1)
+        if self._location == Channel._asyncoro._location:
+            subscriber = self._subscriber(subscriber)
+            reply = 0
+            self._scheduler._lock.acquire()
+            topics = self._subscribers.get(subscriber, None)
+            if not topics or (topic is not None and topic not in topics):
+                reply = -1
+            else:
+                if topic is None:
+                    topics, self._subscribers[subscriber] = list(topics), set()
+                else:
+                    topics.discard(topic)
+                    topics = [topic]
+                if not self._subscribers[subscriber]:
+                    del self._subscribers[subscriber]
+                for topic in topics:
+                    path = [self._topics]
+                    words = topic.split('.')
+                    for word in words:
+                        path.append(path[-1].children[word])
+                    path[-1].subscribers.discard(subscriber)
+                    # remove nodes not used by any pattern
+                    while len(path) > 1 and not path[-1].subscribers and \
+                          not path[-1].children:
+                        path.pop()
+                        del path[-1].children[words[len(path) - 1]]
+                self._routes = {}
+            self._scheduler._lock.release()
+        else:
+            # remote channel
+            kwargs = {'channel': self._name}
+            kwargs['subscriber'] = subscriber
+            kwargs['topic'] = topic
+            request = _NetRequest('unsubscribe', kwargs=kwargs, dst=self._location, timeout=timeout)
+            reply = yield Channel._asyncoro._sys_asyncoro._sync_reply(request)
+        raise StopIteration(reply)
+
+    def _route(self, topic):
+        """Internal use only. Returns (and caches) subscribers with
+        patterns matching 'topic', grouped as in '_snapshot' of Channel,
+        or None if 'topic' is not valid.
+        """
+        words = TopicChannel._words(topic)
+        if not words:
+            return None
+        self._scheduler._lock.acquire()
+        fanout = self._routes.get(topic, None)
+        if fanout is None:
+            subscribers = set()
+            nodes = [self._topics]
+            for word in words:
+                matched = []
+                for node in nodes:
+                    child = node.children.get('#', None)
+                    if child:
+                        subscribers.update(child.subscribers)
+                    child = node.children.get(word, None)
+                    if child:
+                        matched.append(child)
+                    child = node.children.get('*', None)
+                    if child:
+                        matched.append(child)
+                nodes = matched
+                if not nodes:
+                    break
+            for node in nodes:
+                subscribers.update(node.subscribers)
+                # '#' also matches zero words
+                child = node.children.get('#', None)
+                if child:
+                    subscribers.update(child.subscribers)
+            fanout = self._group(subscribers)
+            if len(self._routes) >= self._max_routes:
+                self._routes = {}
+            self._routes[topic] = fanout
+        self._scheduler._lock.release()
+        return fanout
+
+    def send(self, topic, message):
+        """Message is sent to currently registered subscribers with
+        patterns matching 'topic'.
+
+        Can also be used on remote channels.
+        """
+        if self._location == Channel._asyncoro._location:
+            fanout = self._routes.get(topic, None) or self._route(topic)
+            if fanout is None:
+                logger.warning('invalid topic "%s" ignored', topic)
+                return -1
+            transform = self._transform
+            if transform:
+                try:
+                    message = transform(topic, message)
+                except:
+                    message = None
+                if message is None:
+                    return 0
+            self._send_to(fanout, (topic, message))
+        else:
+            # remote channel
+            request = _NetRequest('send', kwargs={'message': message, 'channel': self._name,
+                                                  'topic': topic},
+                                  dst=self._location, timeout=MsgTimeout)
+            # request is queued for asynchronous processing
+            if _Peer.send_req(request) != 0:
+                logger.warning('remote channel at %s may not be valid', self._location)
+                return -1
+        return 0
+
+    def deliver(self, topic, message, timeout=None, n=0):
+        """Must be used with 'yield' as
+        'rcvd = yield channel.deliver(topic, message)'.
+
+        Blocking 'send': Wait until message can be delivered to at
+        least 'n' subscribers with patterns matching 'topic' before
+        timeout. Returns number of end-point recipients (coroutines) the
+        message is delivered to, as with 'deliver' in Channel.
+
+        Can also be used on remote channels.
+        """
+        if not isinstance(n, int) or n < 0:
+            raise StopIteration(-1)
+        if self._location == Channel._asyncoro._location:
+            fanout = self._routes.get(topic, None) or self._route(topic)
+            if fanout is None:
+                logger.warning('invalid topic "%s" ignored', topic)
+                raise StopIteration(-1)
+            transform = self._transform
+            if transform:
+                try:
+                    message = transform(topic, message)
+                except:
+                    message = None
+                if message is None:
+                    raise StopIteration(0)
+            while len(fanout[0]) + sum(len(group[1]) for group in fanout[1]) < n:
+                start = _time()
+                self._scheduler._lock.acquire()
+                self._subscribe_event.clear()
+                self._scheduler._lock.release()
+                if (yield self._subscribe_event.wait(timeout)) is False:
+                    raise StopIteration(0)
+                if timeout is not None:
+                    timeout -= _time() - start
+                    if timeout <= 0:
+                        raise StopIteration(0)
+                fanout = self._route(topic)
+            reply = yield self._deliver_to(fanout, (topic, message), timeout, n)
+            raise StopIteration(reply)
+        else:
+            # remote channel
+            request = _NetRequest('deliver', kwargs={'message': message, 'channel': self._name,
+                                                     'topic': topic, 'n': n},
+                                  dst=self._location, timeout=timeout)
+            request.reply = -1
+            reply = yield Channel._asyncoro._sys_asyncoro._sync_reply(request, alarm_value=0)
+            if reply is None:
+                reply = -1
+            raise StopIteration(reply)
+
+    def close(self):
+        if self._location == Channel._asyncoro._location:
+            Channel.close(self)
+            self._scheduler._lock.acquire()
+            self._subscribers = {}
+            self._topics = _TopicNode()
+            self._routes = {}
+            self._scheduler._lock.release()
+
+
 class CategorizeMessages(object):
     """Splits messages to coroutine into categories so that they can
     be processed on priority basis, for example.
@@ -3400,23 +4855,41 @@ class AsynCoro(object, metaclass=Singleton):
     coroutine is created, for example), so there is no reason to
     create it explicitly. To use distributed programming, AsynCoro in
     disasyncoro module should be used.
+
+    By default, I/O events (for asynchronous sockets, pipes etc.) are
+    processed in a separate poller thread, which hands off resuming
+    coroutines to the scheduler thread. If 'integrated_loop' is True, the
+    scheduler instead polls for I/O events in its own thread, alternating
+    between polling and running ready coroutines. This avoids locking
+    and switching threads for every I/O event, so I/O bound programs
+    (e.g., servers) are more efficient. In this case, AsynCoro must be
+    created explicitly (with 'integrated_loop=True') before any
+    coroutines are created. As the notifier is shared by all schedulers
+    in the process, I/O events for all asynchronous sockets are then
+    processed in this scheduler's thread, so coroutines that don't
+    yield for long also delay I/O of other coroutines. Integrated loop
+    is not available with IOCP notifier (on Windows).
     """
 
     _instance = None
     _schedulers = {}
 
-    # in _scheduled set, waiting for turn to execute
+    # in _ready queue, waiting for turn to execute
     _Scheduled = 1
-    # in _scheduled, currently executing
+    # currently executing
     _Running = 2
-    # in _suspended, waiting for resume
+    # waiting for resume
     _Suspended = 3
-    # in _suspended, waiting for I/O operation
+    # waiting for I/O operation
     _AwaitIO_ = 4
-    # in _suspended, waiting for message
+    # waiting for message
     _AwaitMsg_ = 5
 
-    def __init__(self):
+    # when coroutines with higher priority are ready, a ready coroutine
+    # with lower priority is passed over at most these many times in a row
+    PriorityAging = 8
+
+    def __init__(self, integrated_loop=False):
         if not AsynCoro._instance:
             AsynCoro._instance = self
             Coro._asyncoro = Channel._asyncoro = self
@@ -3426,9 +4899,12 @@ class AsynCoro(object, metaclass=Singleton):
         self._name = ''
         self.__cur_coro = None
         self._coros = {}
-        self._scheduled = set()
-        self._suspended = set()
-        self._timeouts = []
+        # coroutines ready to run, in FIFO order, one queue for each
+        # priority; a coroutine is in these queues at most once (its
+        # '_queued' flag is set while it is)
+        self._ready = [collections.deque() for priority in
+                       range(Coro.LowPriority, Coro.HighPriority + 1)]
+        self._timeouts = _TimerWheel()
         self._quit = False
         self._complete = threading.Event()
         self._complete.set()
@@ -3442,6 +4918,27 @@ class AsynCoro(object, metaclass=Singleton):
         self._atexit = []
         self._polling = False
         self._poll_event = threading.Event()
+        # scheduling state (_ready, _timeouts, state of coroutines) is
+        # updated only in scheduler thread, without locking; other
+        # threads (poller, thread pools etc.) queue their requests in
+        # _handoff (under _handoff_lock), which scheduler processes
+        # before running coroutines
+        self._handoff = collections.deque()
+        self._handoff_lock = threading.Lock()
+        self._scheduler_id = None
+        # with integrated loop, scheduler waits in notifier's poll (instead
+        # of waiting for _poll_event), so it is woken up with notifier's
+        # '_interrupt'
+        if integrated_loop and self._notifier._start(True) == 0:
+            self._integrated = True
+            self._wakeup = self._notifier._interrupt
+        else:
+            if integrated_loop:
+                logger.warning('integrated loop is not possible with %s I/O notifier; '
+                               'using poller thread', self._notifier._poller_name)
+            self._notifier._start()
+            self._integrated = False
+            self._wakeup = self._poll_event.set
         self._scheduler = threading.Thread(target=self._schedule)
         AsynCoro._schedulers[self._scheduler] = self
         self._scheduler.daemon = True
@@ -3484,6 +4981,23 @@ class AsynCoro(object, metaclass=Singleton):
                 return None
         return scheduler.__cur_coro
 
+    def _handoff_call(self, func, *args):
+        """Internal use only. Queue 'func(*args)' to be called in
+        scheduler thread.
+        """
+        self._handoff_lock.acquire()
+        self._handoff.append((func, args))
+        if self._polling and len(self._handoff) == 1:
+            self._wakeup()
+        self._handoff_lock.release()
+
+    def _enqueue(self, coro):
+        """Internal use only. Must be called in scheduler thread.
+        """
+        if coro._state == AsynCoro._Scheduled and not coro._queued:
+            coro._queued = True
+            self._ready[coro._priority].append(coro)
+
     def _add(self, coro):
         """Internal use only. See Coro class.
         """
@@ -3491,24 +5005,29 @@ class AsynCoro(object, metaclass=Singleton):
         self._coros[coro._id] = coro
         self._complete.clear()
         coro._state = AsynCoro._Scheduled
-        self._scheduled.add(coro._id)
-        if self._polling and len(self._scheduled) == 1:
-            self._poll_event.set()
         self._lock.release()
+        if _get_ident() == self._scheduler_id:
+            if not coro._queued:
+                coro._queued = True
+                self._ready[coro._priority].append(coro)
+        else:
+            self._handoff_call(self._enqueue, coro)
 
     def _remove(self, coro):
         """Internal use only.
         """
-        self._lock.acquire()
-        try:
-            self._scheduled.remove(coro._id)
-        except KeyError:
-            ret = -1
-        else:
+        if _get_ident() != self._scheduler_id:
+            self._handoff_call(self._remove, coro)
+            return 0
+        if coro._state == AsynCoro._Scheduled:
+            # entry in _ready is skipped (and dropped) by scheduler
+            coro._state = None
+            self._lock.acquire()
             self._coros.pop(coro._id, None)
-            ret = 0
-        self._lock.release()
-        return ret
+            self._lock.release()
+            return 0
+        else:
+            return -1
 
     def _set_daemon(self, coro, flag):
         """Internal use only. See set_daemon in Coro.
@@ -3547,180 +5066,176 @@ class AsynCoro(object, metaclass=Singleton):
     def _suspend(self, coro, timeout, alarm_value, state):
         """Internal use only. See sleep/suspend in Coro.
         """
-        self._lock.acquire()
-        if self.__cur_coro != coro:
-            self._lock.release()
+        if self.__cur_coro != coro or _get_ident() != self._scheduler_id:
             logger.warning('invalid "suspend" - "%s" != "%s"', coro, self.__cur_coro)
             return -1
-        cid = coro._id
         if state == AsynCoro._AwaitMsg_ and coro._msgs:
             s, update = coro._msgs[0]
             if s == state:
                 coro._msgs.popleft()
-                self._lock.release()
                 return update
         if timeout is None:
             coro._timeout = None
         else:
             if not isinstance(timeout, (float, int)):
                 logger.warning('invalid timeout %s', timeout)
-                self._lock.release()
                 return -1
             if timeout <= 0:
-                self._lock.release()
                 return alarm_value
             else:
-                coro._timeout = _time() + timeout
-                heappush(self._timeouts, (coro._timeout, cid, alarm_value))
-        self._scheduled.discard(cid)
-        self._suspended.add(cid)
+                coro._timeout = self._timeouts.add(_time() + timeout, coro._id, alarm_value)
         coro._state = state
-        self._lock.release()
         return 0
 
     def _resume(self, coro, update, state):
         """Internal use only. See resume in Coro.
         """
-        self._lock.acquire()
         cid = coro._id
+        if _get_ident() != self._scheduler_id:
+            if cid not in self._coros:
+                logger.warning('invalid coroutine %s to resume', cid)
+                return -1
+            self._handoff_call(self._resume, coro, update, state)
+            return 0
         coro = self._coros.get(cid, None)
         if not coro:
-            self._lock.release()
             logger.warning('invalid coroutine %s to resume', cid)
             return -1
         if coro._state == state:
-            coro._timeout = None
+            if coro._timeout:
+                self._timeouts.cancel(coro._timeout, coro._id)
+                coro._timeout = None
             coro._value = update
-            self._suspended.discard(cid)
-            self._scheduled.add(cid)
             coro._state = AsynCoro._Scheduled
-            if self._polling and len(self._scheduled) == 1:
-                self._poll_event.set()
+            if not coro._queued:
+                coro._queued = True
+                self._ready[coro._priority].append(coro)
         elif state == AsynCoro._AwaitMsg_:
             coro._msgs.append((state, update))
-            self._lock.release()
-            return 0
         else:
             logger.warning('ignoring resume for %s: %s', coro, coro._state)
-        self._lock.release()
         return 0
 
     def _throw(self, coro, *args):
         """Internal use only. See throw in Coro.
         """
-        self._lock.acquire()
         cid = coro._id
+        if _get_ident() != self._scheduler_id:
+            if cid not in self._coros:
+                logger.warning('invalid coroutine %s to throw exception', cid)
+                return -1
+            self._handoff_call(self._throw, coro, *args)
+            return 0
         coro = self._coros.get(cid, None)
         if coro is None or coro._state not in (AsynCoro._Scheduled, AsynCoro._Suspended,
                                                AsynCoro._AwaitIO_, AsynCoro._AwaitMsg_):
             logger.warning('invalid coroutine %s to throw exception', cid)
-            self._lock.release()
             return -1
-        coro._timeout = None
+        if coro._timeout:
+            self._timeouts.cancel(coro._timeout, coro._id)
+            coro._timeout = None
         coro._exceptions.append(args)
         if coro._state in (AsynCoro._AwaitIO_, AsynCoro._Suspended, AsynCoro._AwaitMsg_):
-            self._suspended.discard(cid)
-            self._scheduled.add(cid)
             coro._state = AsynCoro._Scheduled
-            if self._polling and len(self._scheduled) == 1:
-                self._poll_event.set()
-        self._lock.release()
+            if not coro._queued:
+                coro._queued = True
+                self._ready[coro._priority].append(coro)
         return 0
 
     def _terminate_coro(self, coro):
         """Internal use only.
         """
-        self._lock.acquire()
         cid = coro._id
+        if _get_ident() != self._scheduler_id:
+            if cid not in self._coros:
+                logger.warning('invalid coroutine %s to terminate', cid)
+                return -1
+            self._handoff_call(self._terminate_coro, coro)
+            return 0
         coro = self._coros.get(cid, None)
         if coro is None:
             logger.warning('invalid coroutine %s to terminate', cid)
-            self._lock.release()
             return -1
         # TODO: if currently waiting I/O or holding locks, warn?
         if coro._state == AsynCoro._Running:
             logger.warning('coroutine to terminate %s/%s is running', coro._name, cid)
         else:
-            self._suspended.discard(cid)
-            self._scheduled.add(cid)
             coro._state = AsynCoro._Scheduled
-            coro._timeout = None
+            if not coro._queued:
+                coro._queued = True
+                self._ready[coro._priority].append(coro)
+            if coro._timeout:
+                self._timeouts.cancel(coro._timeout, coro._id)
+                coro._timeout = None
             coro._callers = []
-            if self._polling and len(self._scheduled) == 1:
-                self._poll_event.set()
         coro._exceptions.append((GeneratorExit, GeneratorExit('close')))
-        self._lock.release()
         return 0
 
     def _swap_generator(self, coro):
         """Internal use only.
         """
-        self._lock.acquire()
         cid = coro._id
+        if _get_ident() != self._scheduler_id:
+            if cid not in self._coros:
+                logger.warning('invalid coroutine %s to swap', cid)
+                return -1
+            self._handoff_call(self._swap_generator, coro)
+            return 0
         coro = self._coros.get(cid, None)
         if coro is None:
             logger.warning('invalid coroutine %s to swap', cid)
-            self._lock.release()
             return -1
         if coro._callers or not coro._hot_swappable:
             logger.debug('postponing hot swapping of %s', str(coro))
-            self._lock.release()
             return 0
         else:
-            coro._timeout = None
+            if coro._timeout:
+                self._timeouts.cancel(coro._timeout, coro._id)
+                coro._timeout = None
             # TODO: check that another HotSwapException is not pending?
             if coro._state is None:
-                # assert coro._id not in self._scheduled
-                # assert coro._id not in self._suspended
+                # assert not coro._queued
                 coro._generator = coro._swap_generator
                 coro._value = None
+                self._lock.acquire()
                 if coro._complete == 0:
                     coro._complete = None
                 elif isinstance(coro._complete, Event):
                     coro._complete.clear()
-                self._scheduled.add(cid)
+                self._lock.release()
                 coro._state = AsynCoro._Scheduled
                 coro._hot_swappable = False
             else:
                 coro._exceptions.append((HotSwapException, HotSwapException(coro._swap_generator)))
                 # assert coro._state != AsynCoro._AwaitIO_
                 if coro._state in (AsynCoro._Suspended, AsynCoro._AwaitMsg_):
-                    self._suspended.discard(cid)
-                    self._scheduled.add(cid)
                     coro._state = AsynCoro._Scheduled
+            if coro._state == AsynCoro._Scheduled and not coro._queued:
+                coro._queued = True
+                self._ready[coro._priority].append(coro)
             coro._swap_generator = None
-            if self._polling and len(self._scheduled) == 1:
-                self._poll_event.set()
-        self._lock.release()
         return 0
 
     def _schedule(self):
         """Internal use only.
         """
+        self._scheduler_id = _get_ident()
+        # ready queues, from highest priority to lowest, and number of
+        # times each queue is passed over
+        queues = list(enumerate(self._ready))[::-1]
+        passed = [0] * len(self._ready)
         while not self._quit:
-            self._lock.acquire()
-            if not self._scheduled:
-                if self._timeouts:
-                    timeout = self._timeouts[0][0] - _time()
-                    if timeout < 0.0001:
-                        timeout = 0
-                else:
-                    timeout = None
-                self._polling = True
-                self._poll_event.clear()
-                self._lock.release()
-                self._poll_event.wait(timeout)
-                self._lock.acquire()
-                self._polling = False
+            if self._handoff:
+                self._handoff_lock.acquire()
+                handoff, self._handoff = self._handoff, collections.deque()
+                self._handoff_lock.release()
+                for func, args in handoff:
+                    func(*args)
             if self._timeouts:
-                # wake up timed suspends; pollers may timeout slightly
-                # earlier, so give a bit of slack
-                now = _time() + 0.0001
-                while self._timeouts and self._timeouts[0][0] <= now:
-                    timeout, cid, alarm_value = heappop(self._timeouts)
-                    assert timeout <= now
+                # wake up timed suspends
+                for cid, alarm_value in self._timeouts.expire(_time()):
                     coro = self._coros.get(cid, None)
-                    if not coro or coro._timeout != timeout:
+                    if not coro:
                         continue
                     if coro._state not in (AsynCoro._AwaitIO_, AsynCoro._Suspended,
                                            AsynCoro._AwaitMsg_):
@@ -3728,18 +5243,64 @@ class AsynCoro(object, metaclass=Singleton):
                                        coro._name, coro._id, coro._state)
                         continue
                     coro._timeout = None
-                    self._suspended.discard(cid)
-                    self._scheduled.add(cid)
                     coro._state = AsynCoro._Scheduled
                     coro._value = alarm_value
-            scheduled = [self._coros[cid] for cid in self._scheduled]
-            self._lock.release()
-
-            for coro in scheduled:
-                self._lock.acquire()
+                    if not coro._queued:
+                        coro._queued = True
+                        self._ready[coro._priority].append(coro)
+            n = sum(len(ready) for ready in self._ready)
+            if not n:
+                timeout = self._timeouts.timeout(_time())
+                if timeout is not None and timeout < 0.0001:
+                    continue
+                self._handoff_lock.acquire()
+                if self._handoff or self._quit:
+                    self._handoff_lock.release()
+                    continue
+                self._polling = True
+                if self._integrated:
+                    self._handoff_lock.release()
+                    if self._notifier._poll_once(timeout):
+                        # prevent tight loops
+                        time.sleep(0.1)
+                else:
+                    self._poll_event.clear()
+                    self._handoff_lock.release()
+                    self._poll_event.wait(timeout)
+                self._polling = False
+                continue
+
+            if self._integrated:
+                # process I/O events that are ready, without waiting, so
+                # coroutines waiting for I/O are not held up by coroutines
+                # that are ready
+                self._notifier._poll_once(0)
+
+            # run as many coroutines as are ready at this point, each time
+            # picking from highest priority queue that is not empty, unless
+            # a lower priority queue has been passed over PriorityAging
+            # times, in which case that queue gets its turn
+            aging = AsynCoro.PriorityAging
+            while n > 0:
+                n -= 1
+                ready = None
+                for priority, pending in queues:
+                    if pending:
+                        if ready is None:
+                            ready = pending
+                            passed[priority] = 0
+                        elif passed[priority] < aging:
+                            passed[priority] += 1
+                        else:
+                            ready = pending
+                            passed[priority] = 0
+                            break
+                coro = ready.popleft()
+                coro._queued = False
+                if coro._state != AsynCoro._Scheduled:
+                    continue
                 coro._state = AsynCoro._Running
                 self.__cur_coro = coro
-                self._lock.release()
 
                 try:
                     if coro._exceptions:
@@ -3753,7 +5314,6 @@ class AsynCoro(object, metaclass=Singleton):
                     else:
                         retval = coro._generator.send(coro._value)
                 except:
-                    self._lock.acquire()
                     exc = sys.exc_info()
                     if exc[0] == StopIteration:
                         v = exc[1].args
@@ -3782,7 +5342,9 @@ class AsynCoro(object, metaclass=Singleton):
                         else:
                             logger.warning('invalid HotSwapException from %s/%s ignored',
                                            coro._name, coro._id)
-                        self._lock.release()
+                        if coro._state == AsynCoro._Scheduled and not coro._queued:
+                            coro._queued = True
+                            self._ready[coro._priority].append(coro)
                         continue
                     else:
                         coro._exceptions.append(exc)
@@ -3799,11 +5361,12 @@ class AsynCoro(object, metaclass=Singleton):
                         elif coro._exceptions:
                             # exception in callee, restore saved value
                             coro._value = caller[1]
-                            self._suspended.discard(coro._id)
-                            self._scheduled.add(coro._id)
                             coro._state = AsynCoro._Scheduled
                         elif coro._state == AsynCoro._Running:
                             coro._state = AsynCoro._Scheduled
+                        if coro._state == AsynCoro._Scheduled and not coro._queued:
+                            coro._queued = True
+                            self._ready[coro._priority].append(coro)
                     else:
                         if coro._exceptions:
                             exc = coro._exceptions[0]
@@ -3819,6 +5382,7 @@ class AsynCoro(object, metaclass=Singleton):
                                 logger.warning('closing %s raised exception: %s',
                                                coro._name, traceback.format_exc())
                         # delete this coro
+                        self._lock.acquire()
                         if coro._state not in (AsynCoro._Scheduled, AsynCoro._Running):
                             logger.warning('coro "%s" is in state: %s', coro._name, coro._state)
                         monitors = list(coro._monitors)
@@ -3869,12 +5433,10 @@ class AsynCoro(object, metaclass=Singleton):
                             coro._complete.set()
                         else:
                             coro._complete = 0
-                        self._scheduled.discard(coro._id)
                         if len(self._coros) == self._daemons:
                             self._complete.set()
-                    self._lock.release()
+                        self._lock.release()
                 else:
-                    self._lock.acquire()
                     if coro._state == AsynCoro._Running:
                         coro._state = AsynCoro._Scheduled
                         # if this coroutine is suspended, don't update
@@ -3888,7 +5450,9 @@ class AsynCoro(object, metaclass=Singleton):
                         coro._callers.append((coro._generator, coro._value))
                         coro._generator = retval
                         coro._value = None
-                    self._lock.release()
+                    if coro._state == AsynCoro._Scheduled and not coro._queued:
+                        coro._queued = True
+                        self._ready[coro._priority].append(coro)
             self.__cur_coro = None
 
         self._lock.acquire()
@@ -3911,14 +5475,19 @@ class AsynCoro(object, metaclass=Singleton):
                 coro._complete.set()
             else:
                 coro._complete = 0
-        self._scheduled = set()
-        self._suspended = set()
-        self._timeouts = []
+        for ready in self._ready:
+            ready.clear()
+        self._handoff_lock.acquire()
+        self._handoff.clear()
+        self._handoff_lock.release()
+        self._timeouts.clear()
         self._coros = {}
         self._channels = {}
         self.__class__._instance = None
         self._quit = True
         self._lock.release()
+        if self._integrated:
+            self._notifier._detach()
         if self._location:
             logger.debug('AsynCoro %s terminated', self._location)
         else:
@@ -3963,11 +5532,13 @@ class AsynCoro(object, metaclass=Singleton):
         self._lock.acquire()
         if not self._quit:
             self._complete.clear()
+            self._handoff_lock.acquire()
             self._quit = True
-            # add a dummy timeout so scheduler will not wait for any other
-            # timeouts left behind by coroutines that may have quit already
-            heappush(self._timeouts, (_time() + 0.1, None, None))
-            self._poll_event.set()
+            # scheduler checks for _quit before waiting, so wake it up only
+            # if it is waiting already
+            if self._polling:
+                self._wakeup()
+            self._handoff_lock.release()
             self._lock.release()
             self._complete.wait()
         else: